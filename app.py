@@ -1,11 +1,37 @@
 import mysql.connector
 from mysql.connector import errorcode
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, g, jsonify, request, send_from_directory
 from flask_cors import CORS
 import os
+import base64
+import csv
+import io
+import functools
 import json
-from datetime import datetime
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 from dotenv import load_dotenv
+import numpy as np
+
+from db_pool import get_pool, PoolExhaustedError
+from response_cache import CACHE_DEFAULT_TTL, make_cache
+from rating_stats import AVERAGE_RATING_SQL, apply_rating_deltas, record_rating, record_ratings
+from taste_profiles import apply_taste_deltas
+from popularity import CACHE_TAG as POPULARITY_TAG, parse_popular_window, recompute_popularity_if_due, \
+    refresh_popularity
+from trending import compact_buckets_if_free, parse_trending_args, record_rating_activity, trending_query
+from genre_rankings import GENRE_SORTS, add_genre_link, genre_page_query, intersect_genres, refresh_movie_rankings, \
+    sort_values
+from user_neighbors import NeighborRefresher, likes_changed
+from rating_buffer import RATING_WRITE_BEHIND, BufferFullError, RatingBuffer
+from search_index import TitleSearchIndex
+from mf_engine import MF_MODEL_DIR, MatrixFactorizationModel, current_version as current_mf_version
+from content_index import CONTENT_REBUILD_SECONDS, CONTENT_SNAPSHOT, ContentSimilarityIndex
+import queries
+import sql_metrics
 
 # --- Configuration ---
 # Use 'static' as the folder to serve the frontend
@@ -33,21 +59,246 @@ DB_CONFIG = {
     "database": DB_NAME
 }
 
-# --- Database Connection Helper ---
+# --- Database Connection Helpers ---
 def get_db_connection():
-    """Establishes a connection to the MySQL database."""
+    """Checks out a connection from this worker's pool. Calling close() returns it."""
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        return conn
-    except mysql.connector.Error as err:
-        print(f"Error connecting to database: {err}")
+        return get_pool(DB_CONFIG).acquire()
+    except (mysql.connector.Error, PoolExhaustedError) as err:
+        app.logger.error("Error connecting to database: %s", err)
         return None
 
+@contextmanager
+def db_connection():
+    """
+    Context manager around get_db_connection().
+    Yields None if no connection could be made; the connection is always
+    handed back to the pool, including on error paths.
+    """
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        if conn:
+            conn.close()
+
+# --- Title Search Index ---
+# Built lazily per worker on the first search, then caught up on new movies
+# and genre links every SEARCH_REFRESH_SECONDS to see inserts from other workers.
+SEARCH_REFRESH_SECONDS = float(os.getenv("SEARCH_REFRESH_SECONDS", 30))
+_search_index = None
+_search_index_lock = threading.Lock()
+
+def get_search_index(conn):
+    """Returns this worker's title index, building or refreshing it as needed."""
+    global _search_index
+    if _search_index is None:
+        with _search_index_lock:
+            if _search_index is None:
+                index = TitleSearchIndex()
+                cursor = conn.cursor()
+                try:
+                    index.build(cursor)
+                finally:
+                    cursor.close()
+                _search_index = index
+    elif time.monotonic() - _search_index.last_refresh > SEARCH_REFRESH_SECONDS:
+        cursor = conn.cursor()
+        try:
+            _search_index.refresh(cursor)
+        finally:
+            cursor.close()
+    return _search_index
+
+# --- Content Similarity Index ---
+# Loaded from the snapshot (or built from the junction tables) on first use,
+# then rebuilt in a background thread every CONTENT_REBUILD_SECONDS.
+_content_index = None
+_content_index_lock = threading.Lock()
+_content_rebuilding = False
+
+def _rebuild_content_index():
+    global _content_index, _content_rebuilding
+    try:
+        with db_connection() as conn:
+            if conn:
+                index = ContentSimilarityIndex()
+                cursor = conn.cursor()
+                try:
+                    index.build(cursor)
+                finally:
+                    cursor.close()
+                _content_index = index
+    except mysql.connector.Error as err:
+        app.logger.exception("Content index rebuild failed: %s", err)
+    finally:
+        _content_rebuilding = False
+
+def get_content_index(conn):
+    """Returns this worker's content-similarity index, loading or building it as needed."""
+    global _content_index, _content_rebuilding
+    if _content_index is None:
+        with _content_index_lock:
+            if _content_index is None:
+                index = None
+                if os.path.exists(CONTENT_SNAPSHOT):
+                    try:
+                        index = ContentSimilarityIndex.load()
+                    except (OSError, ValueError, KeyError) as err:
+                        app.logger.warning("Could not load content index snapshot: %s", err)
+                if index is None:
+                    index = ContentSimilarityIndex()
+                    cursor = conn.cursor()
+                    try:
+                        index.build(cursor)
+                    finally:
+                        cursor.close()
+                _content_index = index
+    elif time.time() - _content_index.built_at > CONTENT_REBUILD_SECONDS and not _content_rebuilding:
+        with _content_index_lock:
+            if not _content_rebuilding:
+                _content_rebuilding = True
+                threading.Thread(target=_rebuild_content_index, daemon=True).start()
+    return _content_index
+
+# --- Matrix-Factorization Model ---
+# Loaded from MF_MODEL_DIR on first use and reloaded once `manage.py
+# train-mf` points CURRENT at a new version (see mf_engine.py); CURRENT is
+# re-read at most every MF_VERSION_CHECK_SECONDS.
+MF_MAX_RESULTS = 100
+MF_VERSION_CHECK_SECONDS = float(os.getenv("MF_VERSION_CHECK_SECONDS", 5))
+_mf_model = None
+_mf_model_lock = threading.Lock()
+_mf_checked_at = None
+
+def get_mf_model():
+    """Returns this worker's MF model, or None if no model has been trained yet."""
+    global _mf_model, _mf_checked_at
+    now = time.monotonic()
+    if _mf_checked_at is not None and now - _mf_checked_at < MF_VERSION_CHECK_SECONDS:
+        return _mf_model
+    _mf_checked_at = now
+    version = current_mf_version(MF_MODEL_DIR)
+    if version is None:
+        return _mf_model
+    if _mf_model is None or _mf_model.version != version:
+        with _mf_model_lock:
+            if _mf_model is None or _mf_model.version != version:
+                try:
+                    _mf_model = MatrixFactorizationModel.load(version=version)
+                except (OSError, ValueError) as err:
+                    # e.g. the version was pruned by a newer run; keep serving the previous one
+                    app.logger.warning("Could not load MF model %s: %s", version, err)
+    return _mf_model
+
+def fetch_user_ratings(cursor, user_id):
+    cursor.execute("SELECT movie_id, rating FROM ratings WHERE user_id = %s", (user_id,))
+    return [(row[0], row[1]) if not isinstance(row, dict) else (row['movie_id'], row['rating'])
+            for row in cursor.fetchall()]
+
+# --- Response Cache ---
+# Hot GET endpoints are served through response_cache. Each route names the
+# tags its response depends on; write endpoints invalidate those tags.
+cache = make_cache()
+
+def cached_response(tags, ttl=CACHE_DEFAULT_TTL):
+    """
+    Caches a route's 200 responses keyed by path and query string.
+    `tags(**view_args)` returns the invalidation tags for the request.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            key = request.full_path
+            body = cache.get(key)
+            if body is not None:
+                response = app.response_class(body, mimetype='application/json')
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            # Read tag versions before touching the database (see response_cache.py)
+            versions = cache.versions(tags(**kwargs))
+            response = app.make_response(view(**kwargs))
+            if response.status_code == 200:
+                cache.set(key, response.get_data(), ttl, versions)
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+def movie_detail_tags(movie_id):
+    tags = [f"movie:{movie_id}"]
+    if request.args.get('user_id'):
+        tags.append(f"user:{request.args.get('user_id')}")
+    return tags
+
+# --- Request Metrics ---
+# Every request is timed by URL rule (not raw path, to keep label values
+# bounded); SQL statements are timed by the pool's cursors. See sql_metrics.
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop('request_started', None)
+    if started is not None and sql_metrics.SQL_METRICS_ENABLED:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        sql_metrics.record_request(request.method, route, response.status_code, time.perf_counter() - started)
+    return response
+
+# --- Keyset Pagination ---
+# List endpoints page with opaque cursors that encode the last row's sort key,
+# so page N is an index seek rather than an OFFSET scan and stays stable
+# while rows are inserted. The next page's cursor is sent in X-Next-Cursor.
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def encode_cursor(kind, values):
+    raw = json.dumps([kind, *values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(token, kind):
+    """Returns the sort-key values in `token`; raises ValueError if it is malformed or for another list."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) < 2 or values[0] != kind:
+        raise ValueError("Invalid cursor")
+    return values[1:]
+
+def parse_page_size(default=DEFAULT_PAGE_SIZE):
+    try:
+        page_size = int(request.args.get('page_size', default))
+    except ValueError:
+        raise ValueError("page_size must be an integer")
+    if not 1 <= page_size <= MAX_PAGE_SIZE:
+        raise ValueError(f"page_size must be between 1 and {MAX_PAGE_SIZE}")
+    return page_size
+
+def paged_response(rows, page_size, kind, sort_key):
+    """
+    `rows` holds up to page_size + 1 rows; the extra row only signals that
+    another page exists. Sets X-Next-Cursor from the last row returned.
+    """
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    response = jsonify(rows)
+    if has_more:
+        response.headers['X-Next-Cursor'] = encode_cursor(kind, sort_key(rows[-1]))
+    return response, 200
+
 # --- Custom JSON Encoder ---
 def default_json_serializer(obj):
     """Handle special types like datetime for JSON serialization."""
-    if isinstance(obj, datetime):
+    if isinstance(obj, (datetime, date)):
         return obj.isoformat()
+    if isinstance(obj, (Decimal, timedelta)):
+        return str(obj)
+    if isinstance(obj, (bytes, bytearray)):
+        return obj.decode('utf-8', errors='replace')
     raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
 
 # --- API Endpoints ---
@@ -62,38 +313,37 @@ def register_user():
     if not username or not email or not password:
         return jsonify({"error": "Missing required fields"}), 400
 
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({"error": "Database connection failed"}), 500
+    with db_connection() as conn:
+        if not conn:
+            return jsonify({"error": "Database connection failed"}), 500
     
-    cursor = conn.cursor(dictionary=True)
+        cursor = conn.cursor(dictionary=True)
     
-    try:
-        # Simple password "hashing" for lab project. DO NOT USE IN PRODUCTION.
-        hashed_password = f"hashed_{password}_salt" 
+        try:
+            # Simple password "hashing" for lab project. DO NOT USE IN PRODUCTION.
+            hashed_password = f"hashed_{password}_salt" 
         
-        cursor.execute(
-            "INSERT INTO users (username, email, password_hash) VALUES (%s, %s, %s)",
-            (username, email, hashed_password)
-        )
-        new_user_id = cursor.lastrowid
+            cursor.execute(
+                "INSERT INTO users (username, email, password_hash) VALUES (%s, %s, %s)",
+                (username, email, hashed_password)
+            )
+            new_user_id = cursor.lastrowid
         
-        # --- NEW: Create a default watchlist for the new user ---
-        cursor.execute(
-            "INSERT INTO watchlists (user_id, name) VALUES (%s, %s)",
-            (new_user_id, "My Watchlist")
-        )
-        # --- End New ---
-
-        conn.commit()
-        return jsonify({"message": "User registered successfully"}), 201
-    except mysql.connector.Error as err:
-        if err.errno == errorcode.ER_DUP_ENTRY:
-            return jsonify({"error": "Username or email already exists"}), 409
-        return jsonify({"error": str(err)}), 500
-    finally:
-        cursor.close()
-        conn.close()
+            # --- NEW: Create a default watchlist for the new user ---
+            cursor.execute(
+                "INSERT INTO watchlists (user_id, name) VALUES (%s, %s)",
+                (new_user_id, "My Watchlist")
+            )
+            # --- End New ---
+
+            conn.commit()
+            return jsonify({"message": "User registered successfully"}), 201
+        except mysql.connector.Error as err:
+            if err.errno == errorcode.ER_DUP_ENTRY:
+                return jsonify({"error": "Username or email already exists"}), 409
+            return jsonify({"error": str(err)}), 500
+        finally:
+            cursor.close()
 
 # --- NEW: Rating Endpoint ---
 
@@ -111,37 +361,285 @@ def add_or_update_rating():
                         raise ValueError()
     except (ValueError, TypeError):
               return jsonify({"error": "Rating must be an integer between 1 and 5"}), 400
-
-    conn = get_db_connection()
-    if not conn: 
-              return jsonify({"error": "Database connection failed"}), 500
+    try:
+        user_id, movie_id = int(user_id), int(movie_id)
+    except (ValueError, TypeError):
+        return jsonify({"error": "user_id and movie_id must be integers"}), 400
+
+    if RATING_WRITE_BEHIND:
+        # Acknowledge once spilled and queued; the flusher group-commits it
+        try:
+            get_rating_buffer().submit(user_id, movie_id, rating_int)
+        except BufferFullError as err:
+            response = jsonify({"error": str(err)})
+            response.headers['Retry-After'] = '1'
+            return response, 503
+        except OSError as err:
+            return jsonify({"error": f"Could not spill rating: {err}"}), 500
+        return jsonify({"status": "accepted", "new_rating": rating_int}), 202
+
+    with db_connection() as conn:
+        if not conn: 
+                  return jsonify({"error": "Database connection failed"}), 500
           
-    cursor = conn.cursor()
+        cursor = conn.cursor()
     
-    try:
-        # Use INSERT ... ON DUPLICATE KEY UPDATE to handle both new ratings and updates
-        query = """
-                  INSERT INTO ratings (user_id, movie_id, rating)
-                  VALUES (%s, %s, %s)
-                  ON DUPLICATE KEY UPDATE rating = VALUES(rating);
-        """
-        params = (user_id, movie_id, rating_int)
-        
-        cursor.execute(query, params)
-        conn.commit()
+        try:
+            # Upsert the rating and apply the delta to movie_rating_stats in one transaction
+            status, old_rating = record_rating(cursor, user_id, movie_id, rating_int)
+            apply_taste_deltas(cursor, [(user_id, movie_id, old_rating, rating_int)])
+            refresh_movie_rankings(cursor, [movie_id])
+            top_changed = refresh_popularity(cursor, [movie_id])
+            record_rating_activity(cursor, [(movie_id, old_rating, rating_int)])
+            conn.commit()
+            cache.invalidate([f"movie:{movie_id}", f"user:{user_id}"] + ([POPULARITY_TAG] if top_changed else []))
+            if likes_changed(old_rating, rating_int):
+                get_neighbor_refresher().submit([user_id])
+            schedule_maintenance()
         
-        # cursor.rowcount == 1 means a new row was inserted
-        # cursor.rowcount == 2 means an existing row was updated
-        if cursor.rowcount == 1:
-                  return jsonify({"status": "created", "new_rating": rating_int}), 201
-        else:
-                  return jsonify({"status": "updated", "new_rating": rating_int}), 200
-
-    except mysql.connector.Error as err:
-              return jsonify({"error": str(err)}), 500
-    finally:
-              cursor.close()
-              conn.close()
+            if status == "created":
+                      return jsonify({"status": "created", "new_rating": rating_int}), 201
+            else:
+                      return jsonify({"status": "updated", "new_rating": rating_int}), 200
+
+        except mysql.connector.Error as err:
+                  return jsonify({"error": str(err)}), 500
+        finally:
+                  cursor.close()
+
+# --- Batch Rating Ingestion ---
+# /api/rate/batch validates the whole payload with NumPy, then upserts in
+# chunks of RATE_BATCH_CHUNK rows (one transaction each, rows sorted by key
+# so concurrent batches lock in the same order). Users whose likes changed
+# are queued for a neighbour refresh after the commit; whatever does not
+# fit in the queue catches up on the next build-user-neighbors run.
+RATE_BATCH_MAX_ROWS = 10000
+RATE_BATCH_CHUNK = 1000
+
+def store_ratings(conn, cursor, rows):
+    """
+    Upserts sorted, distinct (user_id, movie_id, rating) rows together with
+    the movie stats, taste profile deltas and genre rankings, and commits.
+    Returns the old rating of every row (None for new ones).
+    """
+    old_ratings = record_ratings(cursor, rows)
+    apply_taste_deltas(cursor, [(u, m, old, r) for (u, m, r), old in zip(rows, old_ratings)])
+    refresh_movie_rankings(cursor, [movie_id for _, movie_id, _ in rows])
+    top_changed = refresh_popularity(cursor, [movie_id for _, movie_id, _ in rows])
+    record_rating_activity(cursor, [(m, old, r) for (_, m, r), old in zip(rows, old_ratings)])
+    conn.commit()
+    if top_changed:
+        cache.invalidate([POPULARITY_TAG])
+    return old_ratings
+
+def after_ratings_stored(rows, old_ratings):
+    """
+    Queues neighbour refreshes and invalidates cache tags after
+    store_ratings(). Returns (users queued for a neighbour refresh, users
+    left to the next build-user-neighbors).
+    """
+    if not rows:
+        return 0, 0
+    changed_likes = sorted({user_id for (user_id, _, rating), old in zip(rows, old_ratings)
+                            if likes_changed(old, rating)})
+    deferred = get_neighbor_refresher().submit(changed_likes) if changed_likes else 0
+
+    touched_users = sorted({user_id for user_id, _, _ in rows})
+    cache.invalidate([f"movie:{movie_id}" for movie_id in sorted({movie_id for _, movie_id, _ in rows})]
+                     + [f"user:{user_id}" for user_id in touched_users])
+    schedule_maintenance()
+    return len(changed_likes) - deferred, deferred
+
+def _number_column(items, field):
+    """items[i][field] as float64, NaN where missing or not numeric."""
+    def number(item):
+        value = item.get(field) if isinstance(item, dict) else None
+        if isinstance(value, bool):
+            return np.nan
+        if isinstance(value, (int, float)):
+            return value
+        if isinstance(value, str):
+            try:
+                return float(value)
+            except ValueError:
+                return np.nan
+        return np.nan
+    return np.fromiter((number(item) for item in items), dtype=np.float64, count=len(items))
+
+def _existing_ids(cursor, table, column, ids):
+    found = []
+    for start in range(0, len(ids), RATE_BATCH_CHUNK):
+        chunk = ids[start:start + RATE_BATCH_CHUNK].tolist()
+        cursor.execute(f"SELECT {column} FROM {table} WHERE {column} IN ({', '.join(['%s'] * len(chunk))})", chunk)
+        found.extend(row[0] for row in cursor.fetchall())
+    return np.asarray(found, dtype=np.int64)
+
+def validate_rating_batch(cursor, items):
+    """
+    Vectorized validation of [{user_id, movie_id, rating}, ...]. Returns
+    (user_ids, movie_ids, ratings, errors): int64 arrays and an object array
+    holding an error message (or None) per row. Unknown users and movies are
+    checked with one IN query per table.
+    """
+    users = _number_column(items, 'user_id')
+    movies = _number_column(items, 'movie_id')
+    ratings = _number_column(items, 'rating')
+    errors = np.full(len(items), None, dtype=object)
+
+    def integral(values, low, high):
+        with np.errstate(invalid='ignore'):
+            return np.isfinite(values) & (values == np.floor(values)) & (values >= low) & (values <= high)
+
+    errors[~integral(ratings, 1, 5)] = "rating must be an integer between 1 and 5"
+    errors[~integral(movies, 1, 2**31 - 1)] = "movie_id must be a positive integer"
+    errors[~integral(users, 1, 2**31 - 1)] = "user_id must be a positive integer"
+    errors[[not isinstance(item, dict) for item in items]] = "each rating must be an object"
+
+    user_ids = np.where(np.isfinite(users), users, 0).astype(np.int64)
+    movie_ids = np.where(np.isfinite(movies), movies, 0).astype(np.int64)
+    rating_values = np.where(np.isfinite(ratings), ratings, 0).astype(np.int64)
+
+    valid = np.array([error is None for error in errors], dtype=bool)
+    known_movies = _existing_ids(cursor, 'movies', 'movie_id', np.unique(movie_ids[valid]))
+    errors[valid & ~np.isin(movie_ids, known_movies)] = "unknown movie_id"
+    known_users = _existing_ids(cursor, 'users', 'user_id', np.unique(user_ids[valid]))
+    errors[valid & ~np.isin(user_ids, known_users)] = "unknown user_id"
+    return user_ids, movie_ids, rating_values, errors
+
+@app.route('/api/rate/batch', methods=['POST'])
+def add_or_update_ratings_batch():
+    """
+    Body: {"ratings": [{"user_id", "movie_id", "rating"}, ...]} (up to
+    RATE_BATCH_MAX_ROWS). Returns a status per input row: created, updated,
+    skipped (a later row has the same user_id and movie_id) or error.
+    """
+    started = time.perf_counter()
+    data = request.get_json(silent=True)
+    items = data.get('ratings') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "ratings must be a non-empty list"}), 400
+    if len(items) > RATE_BATCH_MAX_ROWS:
+        return jsonify({"error": f"At most {RATE_BATCH_MAX_ROWS} ratings per batch"}), 400
+
+    with db_connection() as conn:
+        if not conn:
+            return jsonify({"error": "Database connection failed"}), 500
+
+        cursor = conn.cursor()
+        try:
+            user_ids, movie_ids, ratings, errors = validate_rating_batch(cursor, items)
+            statuses = np.array(["pending" if error is None else "error" for error in errors], dtype=object)
+
+            # The last row for a (user, movie) pair wins
+            pending = np.flatnonzero(statuses == "pending")
+            keys = (user_ids[pending] << 32) | movie_ids[pending]
+            _, last = np.unique(keys[::-1], return_index=True)
+            winners = pending[len(pending) - 1 - last]
+            statuses[pending] = "skipped"
+            statuses[winners] = "pending"
+            winners = winners[np.lexsort((movie_ids[winners], user_ids[winners]))]
+
+            stored_rows, stored_old = [], []
+            for start in range(0, len(winners), RATE_BATCH_CHUNK):
+                chunk = winners[start:start + RATE_BATCH_CHUNK]
+                rows = list(zip(user_ids[chunk].tolist(), movie_ids[chunk].tolist(), ratings[chunk].tolist()))
+                try:
+                    old_ratings = store_ratings(conn, cursor, rows)
+                except mysql.connector.Error as err:
+                    conn.rollback()
+                    statuses[chunk] = "error"
+                    errors[chunk] = str(err)
+                    continue
+                stored_rows += rows
+                stored_old += old_ratings
+                for index, old in zip(chunk.tolist(), old_ratings):
+                    statuses[index] = "created" if old is None else "updated"
+
+            queued, deferred = after_ratings_stored(stored_rows, stored_old)
+        except mysql.connector.Error as err:
+            return jsonify({"error": str(err)}), 500
+        finally:
+            cursor.close()
+
+    results = [{"index": i, "status": status} if error is None else {"index": i, "status": status, "error": error}
+               for i, (status, error) in enumerate(zip(statuses.tolist(), errors.tolist()))]
+    elapsed = time.perf_counter() - started
+    counts = {status: int(np.count_nonzero(statuses == status)) for status in ("created", "updated", "skipped", "error")}
+    return jsonify({
+        **counts,
+        "results": results,
+        "neighbors_queued": queued,
+        "neighbors_deferred": deferred,
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "rows_per_s": round(len(items) / max(elapsed, 1e-9), 1),
+    }), 200
+
+# --- Write-Behind Rating Buffer ---
+# With RATING_WRITE_BEHIND=on, /api/rate only queues the rating (see
+# rating_buffer.py). Each worker creates its buffer on first use; the
+# flusher writes through store_ratings() like /api/rate/batch.
+_rating_buffer = None
+_rating_buffer_pid = None
+_rating_buffer_lock = threading.Lock()
+
+def _write_buffered_ratings(rows):
+    """Flusher callback: stores the rows and returns how many had to be dropped."""
+    with db_connection() as conn:
+        if not conn:
+            raise RuntimeError("Database connection failed")
+        cursor = conn.cursor()
+        try:
+            stored_rows, stored_old, dropped = [], [], 0
+            for start in range(0, len(rows), RATE_BATCH_CHUNK):
+                chunk = rows[start:start + RATE_BATCH_CHUNK]
+                try:
+                    stored_old += store_ratings(conn, cursor, chunk)
+                    stored_rows += chunk
+                    continue
+                except mysql.connector.IntegrityError:
+                    conn.rollback()
+                # A user or movie that doesn't exist (any more): isolate the bad rows
+                for row in chunk:
+                    try:
+                        stored_old += store_ratings(conn, cursor, [row])
+                        stored_rows.append(row)
+                    except mysql.connector.IntegrityError as err:
+                        conn.rollback()
+                        dropped += 1
+                        app.logger.warning("Dropping buffered rating %s: %s", row, err)
+            after_ratings_stored(stored_rows, stored_old)
+        finally:
+            cursor.close()
+    return dropped
+
+# --- Neighbour Refresh Queue ---
+# Rating paths submit users whose liked set changed after their commit;
+# each worker refreshes them on its own background thread.
+_neighbor_refresher = None
+_neighbor_refresher_pid = None
+_neighbor_refresher_lock = threading.Lock()
+
+def get_neighbor_refresher():
+    """Returns this process's refresher, creating it (and its thread) on first use."""
+    global _neighbor_refresher, _neighbor_refresher_pid
+    pid = os.getpid()
+    if _neighbor_refresher is None or _neighbor_refresher_pid != pid:
+        with _neighbor_refresher_lock:
+            if _neighbor_refresher is None or _neighbor_refresher_pid != pid:
+                _neighbor_refresher = NeighborRefresher(db_connection)
+                _neighbor_refresher_pid = pid
+    return _neighbor_refresher
+
+def get_rating_buffer():
+    """Returns this process's buffer, creating it (and its flusher thread) on first use."""
+    global _rating_buffer, _rating_buffer_pid
+    pid = os.getpid()
+    if _rating_buffer is None or _rating_buffer_pid != pid:
+        with _rating_buffer_lock:
+            if _rating_buffer is None or _rating_buffer_pid != pid:
+                _rating_buffer = RatingBuffer(_write_buffered_ratings)
+                _rating_buffer_pid = pid
+    return _rating_buffer
 
 @app.route('/api/login', methods=['POST'])
 def login_user():
@@ -152,22 +650,25 @@ def login_user():
     if not username or not password:
         return jsonify({"error": "Username and password are required"}), 400
 
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({"error": "Database connection failed"}), 500
+    with db_connection() as conn:
+        if not conn:
+            return jsonify({"error": "Database connection failed"}), 500
     
-    cursor = conn.cursor(dictionary=True)
+        cursor = conn.cursor(dictionary=True)
     
-    # Simple password "check"
-    hashed_password = f"hashed_{password}_salt"
+        # Simple password "check"
+        hashed_password = f"hashed_{password}_salt"
     
-    cursor.execute(
-        "SELECT user_id, username, email FROM users WHERE username = %s AND password_hash = %s",
-        (username, hashed_password)
-    )
-    user = cursor.fetchone()
-    cursor.close()
-    conn.close()
+        try:
+            cursor.execute(
+                "SELECT user_id, username, email FROM users WHERE username = %s AND password_hash = %s",
+                (username, hashed_password)
+            )
+            user = cursor.fetchone()
+        except mysql.connector.Error as err:
+            return jsonify({"error": str(err)}), 500
+        finally:
+            cursor.close()
     
     if user:
         return jsonify({"message": "Login successful", "user": user}), 200
@@ -175,16 +676,20 @@ def login_user():
         return jsonify({"error": "Invalid username or password"}), 401
 
 @app.route('/api/genres', methods=['GET'])
+@cached_response(lambda: ["table:genres"], ttl=3600)
 def get_genres():
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({"error": "Database connection failed"}), 500
+    with db_connection() as conn:
+        if not conn:
+            return jsonify({"error": "Database connection failed"}), 500
     
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT genre_id, name FROM genres ORDER BY name ASC")
-    genres = cursor.fetchall()
-    cursor.close()
-    conn.close()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(*queries.genres_query())
+            genres = cursor.fetchall()
+        except mysql.connector.Error as err:
+            return jsonify({"error": str(err)}), 500
+        finally:
+            cursor.close()
     
     return jsonify(genres), 200
 
@@ -192,261 +697,380 @@ def get_genres():
 def search_movies():
     """
     Search endpoint for movies.
-    Can filter by 'search' term (title) and 'genre' (ID).
-    Can also fetch by 'list' type (e.g., 'recent')
+    Can filter by 'search' term (title) and 'genre' (ID, or comma-separated
+    IDs for movies in all of them).
+    Can also fetch by 'list' type (e.g., 'recent'; genre pages also take 'top_rated')
+    Title searches are answered by the in-process BM25 index; MySQL only
+    fetches the matched page of rows by primary key.
+    Paged with 'page_size' and the 'cursor' from the previous X-Next-Cursor.
     """
     search_term = request.args.get('search', '')
-    genre_id = request.args.get('genre', '')
     list_type = request.args.get('list', '') # e.g., 'recent'
+    recent = list_type == 'recent'
+    kind = ('search_' if search_term else '') + ('recent' if recent else 'title')
 
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({"error": "Database connection failed"}), 500
-    
-    cursor = conn.cursor(dictionary=True)
-    
-    # Base query with average rating
-    query = """
-        SELECT 
-            m.movie_id, m.title, m.release_year,
-            COALESCE(AVG(r.rating), 0) AS average_rating
-        FROM movies m
-        LEFT JOIN ratings r ON m.movie_id = r.movie_id
-    """
-    params = []
-
-    # Dynamic WHERE clause building
-    where_clauses = []
-    
-    if genre_id:
-        query += " JOIN movie_genres mg ON m.movie_id = mg.movie_id"
-        where_clauses.append("mg.genre_id = %s")
-        params.append(genre_id)
-        
-    if search_term:
-        where_clauses.append("m.title LIKE %s")
-        params.append(f"%{search_term}%")
+    try:
+        genre_ids = list(dict.fromkeys(int(part) for part in request.args.get('genre', '').split(',') if part.strip()))
+    except ValueError:
+        return jsonify({"error": "genre must be an integer or comma-separated integers"}), 400
+    genre_id = genre_ids[0] if genre_ids else None
 
-    if where_clauses:
-        query += " WHERE " + " AND ".join(where_clauses)
+    if genre_ids and not search_term:
+        return genre_page(genre_ids, list_type or 'title')
+    if len(genre_ids) > 1:
+        return jsonify({"error": "Title search takes a single genre"}), 400
 
-    query += " GROUP BY m.movie_id, m.title, m.release_year"
-    
-    if list_type == 'recent':
-        query += " ORDER BY m.release_year DESC, m.title ASC"
-    else:
-        query += " ORDER BY m.title ASC"
+    try:
+        page_size = parse_page_size()
+        after = decode_cursor(request.args['cursor'], kind) if request.args.get('cursor') else None
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
 
-    query += " LIMIT 50" # Add a limit for performance
-    
+    with db_connection() as conn:
+        if not conn:
+            return jsonify({"error": "Database connection failed"}), 500
+
+        # Base query with average rating (from the maintained aggregates)
+        query = f"""
+            SELECT
+                m.movie_id, m.title, m.release_year,
+                {AVERAGE_RATING_SQL} AS average_rating
+            FROM movies m
+            LEFT JOIN movie_rating_stats s ON m.movie_id = s.movie_id
+        """
+        params = []
+
+        if search_term:
+            # Search cursors end with the corpus statistics the first page was ranked with
+            stats = None
+            if after:
+                after, stats = after[:-1], after[-1]
+            try:
+                hits, stats = get_search_index(conn).search(
+                    search_term, genre_id=genre_id or None, recent=recent, limit=page_size + 1,
+                    after=after, stats=stats
+                )
+            except mysql.connector.Error as err:
+                return jsonify({"error": str(err)}), 500
+            except (ValueError, TypeError):
+                return jsonify({"error": "Invalid cursor"}), 400
+            if not hits:
+                return jsonify([]), 200
+
+            # Keep the index's ranking order
+            movie_ids = [movie_id for movie_id, _ in hits]
+            sort_keys = dict(hits)
+            placeholders = ", ".join(["%s"] * len(movie_ids))
+            query += f" WHERE m.movie_id IN ({placeholders}) ORDER BY FIELD(m.movie_id, {placeholders})"
+            params = movie_ids + movie_ids
+            sort_key = lambda row: [*sort_keys[row['movie_id']], row['movie_id'], stats]
+        else:
+            where_clauses = []
+
+            # Seek past the cursor's (release_year,) title, movie_id
+            if recent:
+                if after:
+                    year, title, movie_id = after
+                    where_clauses.append(
+                        "(m.release_year < %s OR (m.release_year = %s AND "
+                        "(m.title > %s OR (m.title = %s AND m.movie_id > %s))))"
+                    )
+                    params += [year, year, title, title, movie_id]
+                order_by = " ORDER BY m.release_year DESC, m.title ASC, m.movie_id ASC"
+                sort_key = lambda row: [row['release_year'], row['title'], row['movie_id']]
+            else:
+                if after:
+                    title, movie_id = after
+                    where_clauses.append("(m.title > %s OR (m.title = %s AND m.movie_id > %s))")
+                    params += [title, title, movie_id]
+                order_by = " ORDER BY m.title ASC, m.movie_id ASC"
+                sort_key = lambda row: [row['title'], row['movie_id']]
+
+            if where_clauses:
+                query += " WHERE " + " AND ".join(where_clauses)
+            query += order_by + " LIMIT %s"
+            params.append(page_size + 1)
+
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(query, tuple(params))
+            movies = cursor.fetchall()
+            return paged_response(movies, page_size, kind, sort_key)
+        except mysql.connector.Error as err:
+            return jsonify({"error": str(err)}), 500
+        finally:
+            cursor.close()
+
+def genre_page(genre_ids, sort):
+    """
+    /api/movies?genre=... without a search term: a keyset page of the
+    precomputed genre_movie_rankings lists (see genre_rankings.py). Several
+    genres are intersected by merging their lists.
+    """
+    if sort not in GENRE_SORTS:
+        return jsonify({"error": f"list must be one of: {', '.join(GENRE_SORTS)}"}), 400
+    kind = f"genre_{sort}"
     try:
-        cursor.execute(query, tuple(params))
-        movies = cursor.fetchall()
-        return jsonify(movies), 200
-    except mysql.connector.Error as err:
-        return jsonify({"error": str(err)}), 500
-    finally:
-        cursor.close()
-        conn.close()
+        page_size = parse_page_size()
+        after = decode_cursor(request.args['cursor'], kind) if request.args.get('cursor') else None
+        if after is not None and len(after) != len(GENRE_SORTS[sort][0]):
+            raise ValueError("Invalid cursor")
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+
+    with db_connection() as conn:
+        if not conn:
+            return jsonify({"error": "Database connection failed"}), 500
+    
+        cursor = conn.cursor(dictionary=True)
+        try:
+            if len(genre_ids) == 1:
+                cursor.execute(*genre_page_query(genre_ids[0], sort, after, page_size + 1))
+                movies = cursor.fetchall()
+            else:
+                movies = intersect_genres(cursor, genre_ids, sort, after, page_size + 1)
+        except mysql.connector.Error as err:
+            return jsonify({"error": str(err)}), 500
+        finally:
+            cursor.close()
+    
+    # Sort columns only go into the cursor, not the response
+    sort_keys = {}
+    for movie in movies:
+        sort_keys[movie['movie_id']] = sort_values(sort, movie)
+        del movie['title_key'], movie['weighted_rating']
+    return paged_response(movies, page_size, kind, lambda row: sort_keys[row['movie_id']])
+
+MAX_BATCH_MOVIES = 100
+
+def json_text(value):
+    """JSON columns may come back as str or bytes depending on the connector build."""
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8')
+    return value
+
+def movie_details_text(value):
+    """
+    A MOVIE_DETAILS_JSON_SQL document with its reviews newest first:
+    JSON_ARRAYAGG does not keep the ORDER BY of the derived table it reads.
+    """
+    text = json_text(value)
+    movie = json.loads(text)
+    reviews = movie['reviews']
+    keys = [(review['created_at'] or '', review['review_id']) for review in reviews]
+    if keys == sorted(keys, reverse=True):
+        return text
+    movie['reviews'] = [review for _, review in sorted(zip(keys, reviews), key=lambda pair: pair[0], reverse=True)]
+    return json.dumps(movie)
 
 @app.route('/api/movies/<int:movie_id>', methods=['GET'])
+@cached_response(movie_detail_tags)
 def get_movie_details(movie_id):
     user_id = request.args.get('user_id') # Get user_id to check watchlist status
-
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({"error": "Database connection failed"}), 500
     
-    cursor = conn.cursor(dictionary=True)
+    with db_connection() as conn:
+        if not conn:
+            return jsonify({"error": "Database connection failed"}), 500
+        
+        cursor = conn.cursor()
     
+        try:
+            cursor.execute(*queries.movie_details_query(movie_id, user_id))
+            row = cursor.fetchone()
+
+            if not row:
+                return jsonify({"error": "Movie not found"}), 404
+
+            return app.response_class(movie_details_text(row[0]), mimetype='application/json'), 200
+
+        except mysql.connector.Error as err:
+            return jsonify({"error": str(err)}), 500
+        finally:
+            cursor.close()
+
+@app.route('/api/movies/batch', methods=['GET'])
+def get_movie_details_batch():
+    """
+    Details for up to MAX_BATCH_MOVIES movies in one statement, for list views.
+    ?ids=1,2,3&user_id=7 -> JSON array in the requested order (unknown ids are skipped).
+    """
+    user_id = request.args.get('user_id')
     try:
-        # 1. Get basic movie info and rating stats
-        cursor.execute("""
-            SELECT 
-                m.movie_id, m.title, m.release_year, m.synopsis, m.duration_min,
-                COALESCE(AVG(r.rating), 0) AS average_rating,
-                COUNT(r.rating) AS total_ratings
-            FROM movies m
-            LEFT JOIN ratings r ON m.movie_id = r.movie_id
-            WHERE m.movie_id = %s
-            GROUP BY m.movie_id;
-        """, (movie_id,))
-        movie = cursor.fetchone()
-        
-        if not movie:
-            return jsonify({"error": "Movie not found"}), 404
-
-        # 2. Get actors
-        cursor.execute("""
-            SELECT a.first_name, a.last_name, ma.role_name
-            FROM actors a
-            JOIN movie_actors ma ON a.actor_id = ma.actor_id
-            WHERE ma.movie_id = %s;
-        """, (movie_id,))
-        movie['actors'] = [{"name": f"{row['first_name']} {row['last_name']}", "role": row['role_name']} for row in cursor.fetchall()]
-
-        # 3. Get directors
-        cursor.execute("""
-            SELECT d.first_name, d.last_name
-            FROM directors d
-            JOIN movie_directors md ON d.director_id = md.director_id
-            WHERE md.movie_id = %s;
-        """, (movie_id,))
-        movie['directors'] = [{"name": f"{row['first_name']} {row['last_name']}"} for row in cursor.fetchall()]
-        
-        # 4. Get recent reviews (with usernames)
-        cursor.execute("""
-            SELECT r.review_id, r.review_text, r.created_at, u.username
-            FROM reviews r
-            JOIN users u ON r.user_id = u.user_id
-            WHERE r.movie_id = %s
-            ORDER BY r.created_at DESC
-            LIMIT 10;
-        """, (movie_id,))
-        reviews_raw = cursor.fetchall()
-        movie['reviews'] = json.loads(json.dumps(reviews_raw, default=default_json_serializer))
-
-        # --- NEW: Get user's specific rating ---
-        movie['user_rating'] = 0 # Default
-        if user_id:
-            cursor.execute("""
-                SELECT rating FROM ratings
-                WHERE movie_id = %s AND user_id = %s
-            """, (movie_id, user_id))
-            user_rating_row = cursor.fetchone()
-            if user_rating_row:
-                movie['user_rating'] = user_rating_row['rating']
-        # --- End New ---
-
-        # --- NEW: Check watchlist status ---
-        movie['on_watchlist'] = False # Default
-        if user_id:
-            cursor.execute("""
-                SELECT wi.item_id 
-                FROM watchlist_items wi
-                JOIN watchlists w ON wi.watchlist_id = w.watchlist_id
-                WHERE wi.movie_id = %s AND w.user_id = %s
-                LIMIT 1;
-            """, (movie_id, user_id))
-            item = cursor.fetchone()
-            if item:
-                movie['on_watchlist'] = True
-        # --- End New ---
-        
-        return jsonify(movie), 200
+        movie_ids = [int(part) for part in request.args.get('ids', '').split(',') if part.strip()]
+    except ValueError:
+        return jsonify({"error": "ids must be a comma-separated list of integers"}), 400
+
+    movie_ids = list(dict.fromkeys(movie_ids)) # de-duplicate, keep order
+    if not movie_ids:
+        return jsonify({"error": "ids is required"}), 400
+    if len(movie_ids) > MAX_BATCH_MOVIES:
+        return jsonify({"error": f"At most {MAX_BATCH_MOVIES} ids per request"}), 400
+
+    with db_connection() as conn:
+        if not conn:
+            return jsonify({"error": "Database connection failed"}), 500
+
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute(*queries.movie_details_batch_query(movie_ids, user_id))
+
+            body = "[" + ",".join(movie_details_text(row[0]) for row in cursor.fetchall()) + "]"
+            return app.response_class(body, mimetype='application/json'), 200
+
+        except mysql.connector.Error as err:
+            return jsonify({"error": str(err)}), 500
+        finally:
+            cursor.close()
+
+# --- Periodic Maintenance ---
+# Rating writes start these jobs in a background thread, each at most once per
+# interval per worker; every job takes a MySQL named lock, so only one worker
+# actually runs it. Writes are always served by Flask, also under asgi_app.
+#   - popularity: re-estimates the prior and re-scores movie_popularity against
+#     drift (each write only re-scores its own movies; see popularity.py)
+#   - trending: compacts old hourly rating buckets into days (see trending.py)
+POPULAR_RECOMPUTE_SECONDS = float(os.getenv("POPULAR_RECOMPUTE_SECONDS", 600))
+TRENDING_COMPACT_SECONDS = float(os.getenv("TRENDING_COMPACT_SECONDS", 3600))
+_maintenance_started = {}
+_maintenance_lock = threading.Lock()
+
+def _recompute_popularity():
+    with db_connection() as conn:
+        if not conn:
+            return
+        try:
+            ranked = recompute_popularity_if_due(conn, POPULAR_RECOMPUTE_SECONDS)
+            if ranked is not None:
+                cache.invalidate([POPULARITY_TAG])
+                app.logger.info("Popularity leaderboard recomputed (%d movies).", ranked)
+        except mysql.connector.Error as err:
+            app.logger.exception("Popularity recompute failed: %s", err)
+
+def _compact_trending():
+    with db_connection() as conn:
+        if not conn:
+            return
+        try:
+            result = compact_buckets_if_free(conn)
+            if result is not None:
+                app.logger.info("Trending buckets compacted (%d hourly rows rolled up, %d expired).", *result)
+        except mysql.connector.Error as err:
+            app.logger.exception("Trending compaction failed: %s", err)
+
+MAINTENANCE_JOBS = {
+    "popularity": (POPULAR_RECOMPUTE_SECONDS, _recompute_popularity),
+    "trending": (TRENDING_COMPACT_SECONDS, _compact_trending),
+}
 
-    except mysql.connector.Error as err:
-        return jsonify({"error": str(err)}), 500
-    finally:
-        cursor.close()
-        conn.close()
+def schedule_maintenance():
+    now = time.monotonic()
+    due = []
+    with _maintenance_lock:
+        for name, (interval, job) in MAINTENANCE_JOBS.items():
+            started = _maintenance_started.get(name)
+            if started is None or now - started >= interval:
+                _maintenance_started[name] = now
+                due.append((name, job))
+    for name, job in due:
+        threading.Thread(target=job, name=f"maintenance-{name}", daemon=True).start()
 
 # --- Recommendation Endpoints ---
 @app.route('/api/recommendations/popular', methods=['GET'])
+@cached_response(lambda: [POPULARITY_TAG, "table:movies"])
 def get_popular_movies():
-    conn = get_db_connection()
-    if not conn: return jsonify({"error": "Database connection failed"}), 500
-    cursor = conn.cursor(dictionary=True)
+    """Top movies by weighted rating; ?limit=&offset= page through the top 1000."""
     try:
-        MIN_RATINGS = 5 
-        cursor.execute("SELECT AVG(rating) as C FROM ratings")
-        C_row = cursor.fetchone()
-        C = C_row['C'] if C_row and C_row['C'] is not None else 3.0 # Default to 3.0 if no ratings
-        
-        query = f"""
-            SELECT 
-                m.movie_id, m.title, m.release_year,
-                COUNT(r.rating) AS v, AVG(r.rating) AS R,
-                ( (COUNT(r.rating) / (COUNT(r.rating) + %s)) * AVG(r.rating) + ( %s / (COUNT(r.rating) + %s)) * %s ) AS weighted_rating
-            FROM movies m
-            LEFT JOIN ratings r ON m.movie_id = r.movie_id
-            GROUP BY m.movie_id, m.title, m.release_year
-            HAVING v >= %s
-            ORDER BY weighted_rating DESC
-            LIMIT 10;
-        """
-        params = (MIN_RATINGS, MIN_RATINGS, MIN_RATINGS, C, MIN_RATINGS)
-        cursor.execute(query, params)
-        movies = cursor.fetchall()
-        return jsonify(movies), 200
-    except mysql.connector.Error as err:
-        return jsonify({"error": str(err)}), 500
-    finally:
-        cursor.close()
-        conn.close()
+        limit, offset = parse_popular_window(request.args)
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+
+    with db_connection() as conn:
+        if not conn: return jsonify({"error": "Database connection failed"}), 500
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(*queries.popular_movies_query(limit, offset))
+            movies = cursor.fetchall()
+            return jsonify(movies), 200
+        except mysql.connector.Error as err:
+            return jsonify({"error": str(err)}), 500
+        finally:
+            cursor.close()
+
+TRENDING_CACHE_SECONDS = 60
+
+@app.route('/api/recommendations/trending', methods=['GET'])
+@cached_response(lambda: ["table:movies"], ttl=TRENDING_CACHE_SECONDS)
+def get_trending_movies():
+    """
+    Movies gaining the most new ratings lately: ?window=24h|7d|30d (default
+    7d), ?limit= up to 100. Read from the hourly rating buckets (trending.py);
+    cached for TRENDING_CACHE_SECONDS rather than invalidated on every rating.
+    """
+    try:
+        window, limit = parse_trending_args(request.args)
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+    
+    with db_connection() as conn:
+        if not conn: return jsonify({"error": "Database connection failed"}), 500
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(*trending_query(window, limit))
+            return jsonify(cursor.fetchall()), 200
+        except mysql.connector.Error as err:
+            return jsonify({"error": str(err)}), 500
+        finally:
+            cursor.close()
 
 @app.route('/api/recommendations/content/<int:movie_id>', methods=['GET'])
+@cached_response(lambda movie_id: [f"movie:{movie_id}", "table:movie_genres", "table:movie_directors", "table:movie_actors"])
 def get_content_recommendations(movie_id):
-    conn = get_db_connection()
-    if not conn: return jsonify({"error": "Database connection failed"}), 500
-    cursor = conn.cursor(dictionary=True)
-    try:
-        query = """
-            WITH TargetGenres AS (SELECT genre_id FROM movie_genres WHERE movie_id = %s),
-            TargetDirectors AS (SELECT director_id FROM movie_directors WHERE movie_id = %s),
-            MovieRatings AS (SELECT movie_id, COALESCE(AVG(rating), 0) as avg_rating FROM ratings GROUP BY movie_id)
-            SELECT 
-                m.movie_id, m.title, m.release_year,
-                COALESCE(mr.avg_rating, 0) AS average_rating,
-                COUNT(DISTINCT mg.genre_id) AS genre_matches,
-                COUNT(DISTINCT md.director_id) AS director_matches
-            FROM movies m
-            LEFT JOIN MovieRatings mr ON m.movie_id = mr.movie_id
-            LEFT JOIN movie_genres mg ON m.movie_id = mg.movie_id AND mg.genre_id IN (SELECT genre_id FROM TargetGenres)
-            LEFT JOIN movie_directors md ON m.movie_id = md.movie_id AND md.director_id IN (SELECT director_id FROM TargetDirectors)
-            WHERE m.movie_id != %s AND (mg.genre_id IS NOT NULL OR md.director_id IS NOT NULL)
-            GROUP BY m.movie_id, m.title, m.release_year, mr.avg_rating
-            ORDER BY (genre_matches + director_matches) DESC, average_rating DESC
-            LIMIT 10;
-        """
-        params = (movie_id, movie_id, movie_id)
-        cursor.execute(query, params)
-        movies = cursor.fetchall()
-        return jsonify(movies), 200
-    except mysql.connector.Error as err:
-        return jsonify({"error": str(err)}), 500
-    finally:
-        cursor.close()
-        conn.close()
-
+    """Movies sharing IDF-weighted genres, directors and top-billed actors (see content_index.py)."""
+    with db_connection() as conn:
+        if not conn: return jsonify({"error": "Database connection failed"}), 500
+        cursor = conn.cursor(dictionary=True)
+        try:
+            similar = get_content_index(conn).similar(movie_id, limit=10)
+            if not similar:
+                return jsonify([]), 200
+            cursor.execute(*queries.movies_by_ids_query([entry["movie_id"] for entry in similar]))
+            details = {row["movie_id"]: row for row in cursor.fetchall()}
+            movies = [dict(details[entry["movie_id"]], **entry) for entry in similar if entry["movie_id"] in details]
+            return jsonify(movies), 200
+        except mysql.connector.Error as err:
+            return jsonify({"error": str(err)}), 500
+        finally:
+            cursor.close()
+        
 @app.route('/api/recommendations/collaborative/<int:movie_id>', methods=['GET'])
 def get_collaborative_recommendations(movie_id):
-    conn = get_db_connection()
-    if not conn: return jsonify({"error": "Database connection failed"}), 500
-    cursor = conn.cursor(dictionary=True)
-    try:
-        MIN_RATING = 4
-        query = """
-            WITH SimilarUsers AS (
-                SELECT user_id FROM ratings WHERE movie_id = %s AND rating >= %s
-            ),
-            SimilarUsersRatings AS (
-                SELECT movie_id, COUNT(DISTINCT user_id) as similar_user_likes
-                FROM ratings
-                WHERE user_id IN (SELECT user_id FROM SimilarUsers)
-                  AND rating >= %s AND movie_id != %s
-                GROUP BY movie_id
-            )
-            SELECT 
-                m.movie_id, m.title, m.release_year,
-                COALESCE(AVG(r.rating), 0) AS average_rating,
-                sur.similar_user_likes
-            FROM movies m
-            JOIN SimilarUsersRatings sur ON m.movie_id = sur.movie_id
-            LEFT JOIN ratings r ON m.movie_id = r.movie_id
-            GROUP BY m.movie_id, m.title, m.release_year, sur.similar_user_likes
-            ORDER BY sur.similar_user_likes DESC, average_rating DESC
-            LIMIT 10;
-        """
-        params = (movie_id, MIN_RATING, MIN_RATING, movie_id)
-        cursor.execute(query, params)
-        movies = cursor.fetchall()
-        return jsonify(movies), 200
-    except mysql.connector.Error as err:
-        return jsonify({"error": str(err)}), 500
-    finally:
-        cursor.close()
-        conn.close()
+    with db_connection() as conn:
+        if not conn: return jsonify({"error": "Database connection failed"}), 500
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(*queries.collaborative_recommendations_query(movie_id))
+            movies = cursor.fetchall()
+            return jsonify(movies), 200
+        except mysql.connector.Error as err:
+            return jsonify({"error": str(err)}), 500
+        finally:
+            cursor.close()
+
+@app.route('/api/recommendations/synopsis/<int:movie_id>', methods=['GET'])
+@cached_response(lambda movie_id: [f"movie:{movie_id}"], ttl=3600)
+def get_synopsis_recommendations(movie_id):
+    with db_connection() as conn:
+        if not conn: return jsonify({"error": "Database connection failed"}), 500
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(*queries.synopsis_recommendations_query(movie_id))
+            movies = cursor.fetchall()
+            return jsonify(movies), 200
+        except mysql.connector.Error as err:
+            return jsonify({"error": str(err)}), 500
+        finally:
+            cursor.close()
 
 # --- User-Personalized Recommendation Endpoints ---
 
@@ -456,51 +1080,18 @@ def get_personal_content_recommendations():
     if not user_id:
         return jsonify({"error": "user_id is required"}), 400
     
-    conn = get_db_connection()
-    if not conn: return jsonify({"error": "Database connection failed"}), 500
-    cursor = conn.cursor(dictionary=True)
+    with db_connection() as conn:
+        if not conn: return jsonify({"error": "Database connection failed"}), 500
+        cursor = conn.cursor(dictionary=True)
     
-    try:
-        MIN_RATING = 4 
-        
-        query = """
-            WITH UserFavoriteGenres AS (
-                SELECT DISTINCT mg.genre_id
-                FROM ratings r
-                JOIN movie_genres mg ON r.movie_id = mg.movie_id
-                WHERE r.user_id = %s AND r.rating >= %s
-            ),
-            UserRatedMovies AS (
-                SELECT DISTINCT movie_id FROM ratings WHERE user_id = %s
-            )
-            SELECT 
-                m.movie_id, 
-                m.title, 
-                m.release_year,
-                COUNT(DISTINCT mg.genre_id) AS genre_matches,
-                COALESCE(AVG(r.rating), 0) AS average_rating
-            FROM movies m
-            JOIN movie_genres mg ON m.movie_id = mg.movie_id
-            LEFT JOIN ratings r ON m.movie_id = r.movie_id
-            WHERE 
-                mg.genre_id IN (SELECT genre_id FROM UserFavoriteGenres)
-                AND m.movie_id NOT IN (SELECT movie_id FROM UserRatedMovies)
-            GROUP BY m.movie_id, m.title, m.release_year
-            ORDER BY 
-                genre_matches DESC, 
-                average_rating DESC
-            LIMIT 10;
-        """
-        params = (user_id, MIN_RATING, user_id)
-        
-        cursor.execute(query, params)
-        movies = cursor.fetchall()
-        return jsonify(movies), 200
-    except mysql.connector.Error as err:
-        return jsonify({"error": str(err)}), 500
-    finally:
-        cursor.close()
-        conn.close()
+        try:
+            cursor.execute(*queries.personal_content_query(user_id))
+            movies = cursor.fetchall()
+            return jsonify(movies), 200
+        except mysql.connector.Error as err:
+            return jsonify({"error": str(err)}), 500
+        finally:
+            cursor.close()
 
 @app.route('/api/recommendations/personal_collaborative', methods=['GET'])
 def get_personal_collaborative_recommendations():
@@ -508,66 +1099,85 @@ def get_personal_collaborative_recommendations():
     if not user_id:
         return jsonify({"error": "user_id is required"}), 400
         
-    conn = get_db_connection()
-    if not conn: return jsonify({"error": "Database connection failed"}), 500
-    cursor = conn.cursor(dictionary=True)
+    with db_connection() as conn:
+        if not conn: return jsonify({"error": "Database connection failed"}), 500
+        cursor = conn.cursor(dictionary=True)
     
-    try:
-        MIN_RATING = 4 
-        SIMILARITY_THRESHOLD = 3 
-
-        query = """
-            WITH TargetUserRatings AS (
-                SELECT movie_id FROM ratings WHERE user_id = %s AND rating >= %s
-            ),
-            SimilarUsers AS (
-                SELECT 
-                    r.user_id, 
-                    COUNT(r.movie_id) AS shared_likes
-                FROM ratings r
-                WHERE 
-                    r.movie_id IN (SELECT movie_id FROM TargetUserRatings)
-                    AND r.user_id != %s 
-                    AND r.rating >= %s
-                GROUP BY r.user_id
-                HAVING shared_likes >= %s
-            ),
-            RecommendedMovies AS (
-                SELECT 
-                    r.movie_id, 
-                    COUNT(DISTINCT r.user_id) AS similar_user_likes
-                FROM ratings r
-                WHERE 
-                    r.user_id IN (SELECT user_id FROM SimilarUsers)
-                    AND r.rating >= %s
-                    AND r.movie_id NOT IN (SELECT movie_id FROM TargetUserRatings)
-                GROUP BY r.movie_id
-            )
-            SELECT 
-                m.movie_id, 
-                m.title, 
-                m.release_year,
-                rm.similar_user_likes,
-                COALESCE(AVG(r_all.rating), 0) AS average_rating
-            FROM RecommendedMovies rm
-            JOIN movies m ON rm.movie_id = m.movie_id
-            LEFT JOIN ratings r_all ON m.movie_id = r_all.movie_id
-            GROUP BY m.movie_id, m.title, m.release_year, rm.similar_user_likes
-            ORDER BY 
-                rm.similar_user_likes DESC,
-                average_rating DESC
-            LIMIT 10;
-        """
-        params = (user_id, MIN_RATING, user_id, MIN_RATING, SIMILARITY_THRESHOLD, MIN_RATING)
-        
-        cursor.execute(query, params)
-        movies = cursor.fetchall()
-        return jsonify(movies), 200
-    except mysql.connector.Error as err:
-        return jsonify({"error": str(err)}), 500
-    finally:
-        cursor.close()
-        conn.close()
+        try:
+            cursor.execute(*queries.personal_collaborative_query(user_id))
+            movies = cursor.fetchall()
+            return jsonify(movies), 200
+        except mysql.connector.Error as err:
+            return jsonify({"error": str(err)}), 500
+        finally:
+            cursor.close()
+
+@app.route('/api/recommendations/personal_mf', methods=['GET'])
+def get_personal_mf_recommendations():
+    """
+    Latent-factor recommendations: every movie is scored with one
+    mat-vec against the user's vector, minus the movies they already rated.
+    The vector is folded in from the user's current ratings, and reused
+    until they change (see MatrixFactorizationModel.folded_vector).
+    """
+    user_id = request.args.get('user_id', type=int)
+    if not user_id:
+        return jsonify({"error": "user_id is required"}), 400
+    limit = min(request.args.get('limit', 10, type=int), MF_MAX_RESULTS)
+
+    model = get_mf_model()
+    if model is None:
+        return jsonify({"error": "No matrix-factorization model has been trained (run manage.py train-mf)"}), 503
+
+    with db_connection() as conn:
+        if not conn: return jsonify({"error": "Database connection failed"}), 500
+        cursor = conn.cursor(dictionary=True)
+
+        try:
+            rated = fetch_user_ratings(cursor, user_id)
+            vector = model.folded_vector(user_id, rated)
+
+            scored, scoring_ms = model.recommend(vector, [movie_id for movie_id, _ in rated], limit)
+            if not scored:
+                movies = []
+            else:
+                cursor.execute(*queries.movies_by_ids_query([movie_id for movie_id, _ in scored]))
+                movies = cursor.fetchall()
+                predicted = dict(scored)
+                for movie in movies:
+                    movie["predicted_rating"] = round(predicted[movie["movie_id"]], 3)
+
+            response = jsonify(movies)
+            response.headers['X-Scoring-Ms'] = f"{scoring_ms:.3f}"
+            return response, 200
+        except mysql.connector.Error as err:
+            return jsonify({"error": str(err)}), 500
+        finally:
+            cursor.close()
+
+@app.route('/api/recommendations/rails', methods=['GET'])
+def get_recommendation_rails():
+    """
+    All home-page rails in one call: popular, plus the personal rails when
+    user_id is given. The sync app runs them one after another on a single
+    connection; asgi_app.py runs the same queries concurrently.
+    """
+    user_id = request.args.get('user_id')
+
+    with db_connection() as conn:
+        if not conn: return jsonify({"error": "Database connection failed"}), 500
+        cursor = conn.cursor(dictionary=True)
+
+        try:
+            rails = {}
+            for name, (query, params) in queries.recommendation_rails(user_id).items():
+                cursor.execute(query, params)
+                rails[name] = cursor.fetchall()
+            return jsonify(rails), 200
+        except mysql.connector.Error as err:
+            return jsonify({"error": str(err)}), 500
+        finally:
+            cursor.close()
 
 # --- NEW: Watchlist Endpoints ---
 
@@ -577,41 +1187,54 @@ def get_watchlist():
     if not user_id:
         return jsonify({"error": "user_id is required"}), 400
 
-    conn = get_db_connection()
-    if not conn: return jsonify({"error": "Database connection failed"}), 500
-    cursor = conn.cursor(dictionary=True)
-    
     try:
-        # 1. Find the user's primary (first) watchlist
-        cursor.execute("SELECT watchlist_id FROM watchlists WHERE user_id = %s LIMIT 1", (user_id,))
-        watchlist = cursor.fetchone()
+        page_size = parse_page_size(default=MAX_PAGE_SIZE)
+        after = decode_cursor(request.args['cursor'], 'watchlist') if request.args.get('cursor') else None
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+
+    with db_connection() as conn:
+        if not conn: return jsonify({"error": "Database connection failed"}), 500
+        cursor = conn.cursor(dictionary=True)
+    
+        try:
+            # 1. Find the user's primary (first) watchlist
+            cursor.execute("SELECT watchlist_id FROM watchlists WHERE user_id = %s LIMIT 1", (user_id,))
+            watchlist = cursor.fetchone()
         
-        if not watchlist:
-            return jsonify([]), 200 # User has no watchlist, return empty
+            if not watchlist:
+                return jsonify([]), 200 # User has no watchlist, return empty
             
-        watchlist_id = watchlist['watchlist_id']
+            watchlist_id = watchlist['watchlist_id']
         
-        # 2. Get all movies on that watchlist
-        cursor.execute("""
-            SELECT 
-                m.movie_id, m.title, m.release_year,
-                COALESCE(AVG(r.rating), 0) AS average_rating
-            FROM movies m
-            JOIN watchlist_items wi ON m.movie_id = wi.movie_id
-            LEFT JOIN ratings r ON m.movie_id = r.movie_id
-            WHERE wi.watchlist_id = %s
-            GROUP BY m.movie_id, m.title, m.release_year
-            ORDER BY m.title ASC;
-        """, (watchlist_id,))
+            # 2. Get one page of movies on that watchlist, seeking past the cursor
+            seek = ""
+            params = [watchlist_id]
+            if after:
+                title, movie_id = after
+                seek = "AND (m.title > %s OR (m.title = %s AND m.movie_id > %s))"
+                params += [title, title, movie_id]
+            params.append(page_size + 1)
+
+            cursor.execute(f"""
+                SELECT 
+                    m.movie_id, m.title, m.release_year,
+                    {AVERAGE_RATING_SQL} AS average_rating
+                FROM movies m
+                JOIN watchlist_items wi ON m.movie_id = wi.movie_id
+                LEFT JOIN movie_rating_stats s ON m.movie_id = s.movie_id
+                WHERE wi.watchlist_id = %s {seek}
+                ORDER BY m.title ASC, m.movie_id ASC
+                LIMIT %s;
+            """, tuple(params))
         
-        movies = cursor.fetchall()
-        return jsonify(movies), 200
+            movies = cursor.fetchall()
+            return paged_response(movies, page_size, 'watchlist', lambda row: [row['title'], row['movie_id']])
         
-    except mysql.connector.Error as err:
-        return jsonify({"error": str(err)}), 500
-    finally:
-        cursor.close()
-        conn.close()
+        except mysql.connector.Error as err:
+            return jsonify({"error": str(err)}), 500
+        finally:
+            cursor.close()
 
 @app.route('/api/watchlist/toggle', methods=['POST'])
 def toggle_watchlist_item():
@@ -622,71 +1245,70 @@ def toggle_watchlist_item():
     if not user_id or not movie_id:
         return jsonify({"error": "user_id and movie_id are required"}), 400
         
-    conn = get_db_connection()
-    if not conn: return jsonify({"error": "Database connection failed"}), 500
-    cursor = conn.cursor(dictionary=True)
+    with db_connection() as conn:
+        if not conn: return jsonify({"error": "Database connection failed"}), 500
+        cursor = conn.cursor(dictionary=True)
     
-    try:
-        # 1. Find the user's primary (first) watchlist
-        cursor.execute("SELECT watchlist_id FROM watchlists WHERE user_id = %s LIMIT 1", (user_id,))
-        watchlist = cursor.fetchone()
+        try:
+            # 1. Find the user's primary (first) watchlist
+            cursor.execute("SELECT watchlist_id FROM watchlists WHERE user_id = %s LIMIT 1", (user_id,))
+            watchlist = cursor.fetchone()
         
-        if not watchlist:
-            return jsonify({"error": "User has no watchlist"}), 404
+            if not watchlist:
+                return jsonify({"error": "User has no watchlist"}), 404
             
-        watchlist_id = watchlist['watchlist_id']
+            watchlist_id = watchlist['watchlist_id']
         
-        # 2. Check if the item already exists
-        cursor.execute("""
-            SELECT item_id FROM watchlist_items
-            WHERE watchlist_id = %s AND movie_id = %s
-        """, (watchlist_id, movie_id))
-        item = cursor.fetchone()
+            # 2. Check if the item already exists
+            cursor.execute("""
+                SELECT item_id FROM watchlist_items
+                WHERE watchlist_id = %s AND movie_id = %s
+            """, (watchlist_id, movie_id))
+            item = cursor.fetchone()
         
-        # 3. If it exists, remove it. If not, add it.
-        if item:
-            cursor.execute("DELETE FROM watchlist_items WHERE item_id = %s", (item['item_id'],))
-            message = "removed"
-        else:
-            cursor.execute(
-                "INSERT INTO watchlist_items (watchlist_id, movie_id) VALUES (%s, %s)",
-                (watchlist_id, movie_id)
-            )
-            message = "added"
+            # 3. If it exists, remove it. If not, add it.
+            if item:
+                cursor.execute("DELETE FROM watchlist_items WHERE item_id = %s", (item['item_id'],))
+                message = "removed"
+            else:
+                cursor.execute(
+                    "INSERT INTO watchlist_items (watchlist_id, movie_id) VALUES (%s, %s)",
+                    (watchlist_id, movie_id)
+                )
+                message = "added"
         
-        conn.commit()
-        return jsonify({"status": message}), 200
+            conn.commit()
+            cache.invalidate([f"user:{user_id}"])
+            return jsonify({"status": message}), 200
         
-    except mysql.connector.Error as err:
-        return jsonify({"error": str(err)}), 500
-    finally:
-        cursor.close()
-        conn.close()
+        except mysql.connector.Error as err:
+            return jsonify({"error": str(err)}), 500
+        finally:
+            cursor.close()
 
 # --- Admin API Endpoints ---
 
 @app.route('/api/schema', methods=['GET'])
 def get_schema():
-    conn = get_db_connection()
-    if not conn: return jsonify({"error": "Database connection failed"}), 500
-    cursor = conn.cursor(dictionary=True)
+    with db_connection() as conn:
+        if not conn: return jsonify({"error": "Database connection failed"}), 500
+        cursor = conn.cursor(dictionary=True)
     
-    try:
-        cursor.execute("SHOW TABLES")
-        tables = [row[f'Tables_in_{DB_CONFIG["database"]}'] for row in cursor.fetchall()]
+        try:
+            cursor.execute("SHOW TABLES")
+            tables = [row[f'Tables_in_{DB_CONFIG["database"]}'] for row in cursor.fetchall()]
         
-        schema = {}
-        for table in tables:
-            cursor.execute(f"DESCRIBE {table}")
-            columns = cursor.fetchall()
-            schema[table] = columns
+            schema = {}
+            for table in tables:
+                cursor.execute(f"DESCRIBE {table}")
+                columns = cursor.fetchall()
+                schema[table] = columns
         
-        return jsonify(schema), 200
-    except mysql.connector.Error as err:
-        return jsonify({"error": str(err)}), 500
-    finally:
-        cursor.close()
-        conn.close()
+            return jsonify(schema), 200
+        except mysql.connector.Error as err:
+            return jsonify({"error": str(err)}), 500
+        finally:
+            cursor.close()
 
 @app.route('/api/insert', methods=['POST'])
 def insert_data():
@@ -700,54 +1322,304 @@ def insert_data():
     if not table_name.replace('_', '').isalnum():
          return jsonify({"error": "Invalid table name"}), 400
 
-    conn = get_db_connection()
-    if not conn: return jsonify({"error": "Database connection failed"}), 500
-    cursor = conn.cursor()
-
+    # The admin form sends every value as a string; the derived-table updates need integer ids
     try:
-        columns = ", ".join(row_data.keys())
-        placeholders = ", ".join(["%s"] * len(row_data))
-        values = list(row_data.values())
+        for key in ('movie_id', 'user_id'):
+            if key in row_data:
+                row_data[key] = int(row_data[key])
+        if table_name == 'ratings' and 'rating' in row_data:
+            row_data['rating'] = int(row_data['rating'])
+    except (ValueError, TypeError):
+        return jsonify({"error": "movie_id, user_id and rating must be integers"}), 400
+
+    with db_connection() as conn:
+        if not conn: return jsonify({"error": "Database connection failed"}), 500
+        cursor = conn.cursor()
+
+        try:
+            columns = ", ".join(row_data.keys())
+            placeholders = ", ".join(["%s"] * len(row_data))
+            values = list(row_data.values())
         
-        query = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
+            query = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
         
-        cursor.execute(query, values)
-        conn.commit()
+            cursor.execute(query, values)
+            new_id = cursor.lastrowid
+            tags_after_commit = []
+
+            # Raw inserts into ratings must keep movie_rating_stats in step
+            if table_name == 'ratings' and 'movie_id' in row_data and 'rating' in row_data:
+                apply_rating_deltas(cursor, [(row_data['movie_id'], None, int(row_data['rating']))])
+                if 'user_id' in row_data:
+                    apply_taste_deltas(cursor, [(row_data['user_id'], row_data['movie_id'], None, int(row_data['rating']))])
+                refresh_movie_rankings(cursor, [row_data['movie_id']])
+                if refresh_popularity(cursor, [row_data['movie_id']]):
+                    tags_after_commit.append(POPULARITY_TAG)
+                record_rating_activity(cursor, [(row_data['movie_id'], None, int(row_data['rating']))])
+
+            # ... and new genre links need their genre_movie_rankings row
+            if table_name == 'movie_genres' and 'movie_id' in row_data and 'genre_id' in row_data:
+                add_genre_link(cursor, row_data['movie_id'], row_data['genre_id'])
+
+            conn.commit()
         
-        return jsonify({"message": "Data inserted successfully", "id": cursor.lastrowid}), 201
+            # Precise invalidation: the table, plus the movie/user the row belongs to
+            tags = [f"table:{table_name}"] + tags_after_commit
+            if row_data.get('movie_id'):
+                tags.append(f"movie:{row_data['movie_id']}")
+            if row_data.get('user_id'):
+                tags.append(f"user:{row_data['user_id']}")
+            cache.invalidate(tags)
+
+            # Keep this worker's search index current (other workers catch up on refresh)
+            if _search_index is not None:
+                if table_name == 'movies' and 'title' in row_data:
+                    _search_index.add_movie(int(row_data.get('movie_id') or new_id),
+                                            row_data['title'], int(row_data.get('release_year') or 0))
+                elif table_name == 'movie_genres' and 'movie_id' in row_data and 'genre_id' in row_data:
+                    _search_index.add_genre_link(int(row_data['movie_id']), int(row_data['genre_id']))
+
+            # ... and its content-similarity features
+            feature_columns = {'movie_genres': 'genre_id', 'movie_directors': 'director_id', 'movie_actors': 'actor_id'}
+            if _content_index is not None and table_name in feature_columns:
+                feature_column = feature_columns[table_name]
+                if 'movie_id' in row_data and feature_column in row_data:
+                    _content_index.add_link(table_name, int(row_data['movie_id']), int(row_data[feature_column]))
+
+            return jsonify({"message": "Data inserted successfully", "id": new_id}), 201
+        except mysql.connector.Error as err:
+            return jsonify({"error": f"MySQL Error: {err.msg}", "errno": err.errno}), 400
+        finally:
+            cursor.close()
+
+# --- Admin Query Console ---
+# Arbitrary SELECTs are bounded by a row cap and a MAX_EXECUTION_TIME hint.
+# format=ndjson|csv streams rows from an unbuffered cursor in chunks, so
+# memory stays flat no matter how large the result is.
+QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", 1000000))          # cap for streamed results
+QUERY_JSON_MAX_ROWS = int(os.getenv("QUERY_JSON_MAX_ROWS", 10000))  # cap for the default JSON response
+QUERY_TIMEOUT_MS = int(os.getenv("QUERY_TIMEOUT_MS", 30000))
+QUERY_STREAM_CHUNK = int(os.getenv("QUERY_STREAM_CHUNK", 1000))
+
+def cancel_query(conn):
+    """
+    Stops whatever is still running or streaming on `conn` (KILL QUERY from a
+    second connection) and drops it instead of returning it to the pool.
+    """
+    with db_connection() as killer:
+        if killer:
+            cursor = killer.cursor()
+            try:
+                cursor.execute("KILL QUERY %s", (conn.connection_id,))
+            except mysql.connector.Error as err:
+                app.logger.warning("Could not cancel query on connection %s: %s", conn.connection_id, err)
+            finally:
+                cursor.close()
+    conn.discard()
+
+def stream_query_rows(conn, cursor, fmt, max_rows):
+    """Yields the result set as NDJSON lines or CSV text, QUERY_STREAM_CHUNK rows at a time."""
+    columns = list(cursor.column_names)
+    finished = False
+    sent = 0
+    try:
+        if fmt == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+            yield buffer.getvalue()
+
+        while sent < max_rows:
+            rows = cursor.fetchmany(min(QUERY_STREAM_CHUNK, max_rows - sent))
+            if not rows:
+                finished = True
+                break
+            sent += len(rows)
+
+            if fmt == 'csv':
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerows(rows)
+                yield buffer.getvalue()
+            else:
+                yield "".join(
+                    json.dumps(dict(zip(columns, row)), default=default_json_serializer) + "\n" for row in rows
+                )
     except mysql.connector.Error as err:
-        return jsonify({"error": f"MySQL Error: {err.msg}", "errno": err.errno}), 400
+        # Headers are already sent; report the error in-band and stop
+        if fmt == 'ndjson':
+            yield json.dumps({"error": f"MySQL Error: {err.msg}", "errno": err.errno}) + "\n"
     finally:
-        cursor.close()
-        conn.close()
+        # Runs on normal completion, on the row cap, and when the client
+        # disconnects mid-stream (the server closes this generator). A
+        # generator closed before its first chunk never gets here; see
+        # execute_query's call_on_close.
+        if finished:
+            cursor.close()
+            conn.close()
+        else:
+            cancel_query(conn)
 
 @app.route('/api/query', methods=['POST'])
 def execute_query():
+    """
+    Body: {"query": "SELECT ...", "format": "json" | "ndjson" | "csv",
+           "max_rows": optional lower cap, "timeout_ms": optional lower limit}
+    """
     data = request.get_json()
     query = data.get('query')
+    fmt = data.get('format', 'json')
 
     if not query:
         return jsonify({"error": "Query is required"}), 400
 
-    if not query.strip().lower().startswith('select'):
+    query = query.strip()
+    if not query.lower().startswith('select'):
         return jsonify({"error": "Only SELECT statements are allowed."}), 403
 
+    if fmt not in ('json', 'ndjson', 'csv'):
+        return jsonify({"error": "format must be json, ndjson or csv"}), 400
+
+    row_cap = QUERY_JSON_MAX_ROWS if fmt == 'json' else QUERY_MAX_ROWS
+    try:
+        max_rows = min(int(data.get('max_rows', row_cap)), row_cap)
+        timeout_ms = min(int(data.get('timeout_ms', QUERY_TIMEOUT_MS)), QUERY_TIMEOUT_MS)
+    except (ValueError, TypeError):
+        return jsonify({"error": "max_rows and timeout_ms must be integers"}), 400
+
+    # Server-side statement time limit via optimizer hint (no session state to reset)
+    query = f"{query[:6]} /*+ MAX_EXECUTION_TIME({max(timeout_ms, 1)}) */{query[6:]}"
+
     conn = get_db_connection()
     if not conn: return jsonify({"error": "Database connection failed"}), 500
-    cursor = conn.cursor(dictionary=True)
+    cursor = conn.cursor(buffered=False)
 
     try:
         cursor.execute(query)
-        results = cursor.fetchall()
-        results = json.loads(json.dumps(results, default=default_json_serializer))
-        
-        return jsonify({"message": "Query executed successfully", "results": results, "columns": cursor.column_names}), 200
     except mysql.connector.Error as err:
+        cursor.close()
+        conn.close()
         return jsonify({"error": f"MySQL Error: {err.msg}", "errno": err.errno}), 400
-    finally:
+
+    if fmt != 'json':
+        mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+        response = Response(stream_query_rows(conn, cursor, fmt, max_rows), mimetype=mimetype)
+        response.headers['X-Max-Rows'] = str(max_rows)
+        # Runs after the generator is closed; releases the connection if it never started
+        response.call_on_close(lambda: None if conn.released else cancel_query(conn))
+        return response, 200
+
+    # Default JSON response: bounded, serialized once
+    try:
+        columns = list(cursor.column_names)
+        rows = cursor.fetchmany(max_rows + 1)
+        truncated = len(rows) > max_rows
+    except mysql.connector.Error as err:
+        cancel_query(conn)
+        return jsonify({"error": f"MySQL Error: {err.msg}", "errno": err.errno}), 400
+
+    if truncated:
+        cancel_query(conn)
+        rows = rows[:max_rows]
+    else:
         cursor.close()
         conn.close()
 
+    body = json.dumps({
+        "message": "Query executed successfully",
+        "results": [dict(zip(columns, row)) for row in rows],
+        "columns": columns,
+        "truncated": truncated,
+    }, default=default_json_serializer)
+    return app.response_class(body, mimetype='application/json'), 200
+
+@app.route('/api/pool', methods=['GET'])
+def get_pool_stats():
+    """Connection pool counters for this worker (wait times, exhaustion, recycling)."""
+    stats = get_pool(DB_CONFIG).stats()
+    stats["pid"] = os.getpid()
+    return jsonify(stats), 200
+
+@app.route('/api/cache', methods=['GET'])
+def get_cache_stats():
+    """Response cache hit/miss/eviction counters."""
+    return jsonify(cache.stats()), 200
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Request, SQL, pool and cache metrics of this worker in the Prometheus text format."""
+    pool_stats = get_pool(DB_CONFIG).stats()
+    cache_stats = cache.stats()
+    extra = [
+        ("db_pool_open_connections", "gauge", "Open connections in this worker's pool.", pool_stats["open"]),
+        ("db_pool_in_use_connections", "gauge", "Checked-out connections.", pool_stats["in_use"]),
+        ("db_pool_checkout_waits_total", "counter", "Checkouts that had to wait for a connection.",
+         pool_stats["waits"]),
+        ("db_pool_exhausted_total", "counter", "Checkouts that timed out.", pool_stats["exhausted"]),
+        ("response_cache_hits_total", "counter", "Response cache hits.", cache_stats["hits"]),
+        ("response_cache_misses_total", "counter", "Response cache misses.", cache_stats["misses"]),
+    ]
+    if RATING_WRITE_BEHIND:
+        buffer_stats = get_rating_buffer().stats()
+        extra += [
+            ("rating_buffer_queued", "gauge", "Ratings waiting for the flusher.", buffer_stats["queued"]),
+            ("rating_buffer_oldest_seconds", "gauge", "Age of the oldest queued rating.",
+             buffer_stats["oldest_queued_s"]),
+            ("rating_buffer_rejected_total", "counter", "Ratings refused because the buffer was full.",
+             buffer_stats["rejected"]),
+            ("rating_buffer_merged_total", "counter", "Ratings superseded before they were flushed.",
+             buffer_stats["rows_merged"]),
+            ("rating_buffer_dropped_total", "counter", "Ratings dropped for unknown users or movies.",
+             buffer_stats["rows_dropped"]),
+            ("rating_buffer_flush_failures_total", "counter", "Flushes that failed.",
+             buffer_stats["flush_failures"]),
+            ("rating_buffer_dead_lettered_total", "counter", "Ratings moved to dead-letter files after repeated "
+             "flush failures.", buffer_stats["rows_dead_lettered"]),
+        ]
+    if _neighbor_refresher is not None and _neighbor_refresher_pid == os.getpid():
+        neighbor_stats = _neighbor_refresher.stats()
+        extra += [
+            ("neighbor_refresh_queued", "gauge", "Users waiting for a neighbour refresh.", neighbor_stats["queued"]),
+            ("neighbor_refresh_dropped_total", "counter", "Users left to build-user-neighbors (queue full).",
+             neighbor_stats["dropped"]),
+            ("neighbor_refresh_failed_total", "counter", "Neighbour refreshes that failed.",
+             neighbor_stats["failed"]),
+        ]
+    return Response(sql_metrics.render_prometheus(extra), mimetype='text/plain; version=0.0.4'), 200
+
+@app.route('/api/metrics/slow_queries', methods=['GET'])
+def get_slow_queries():
+    """EXPLAIN plans captured for statements over SQL_EXPLAIN_THRESHOLD_MS, most recent first."""
+    return app.response_class(json.dumps({
+        "threshold_ms": sql_metrics.SQL_EXPLAIN_THRESHOLD_MS,
+        "plans": sql_metrics.captured_plans(),
+        "pid": os.getpid(),
+    }, default=default_json_serializer), mimetype='application/json'), 200
+
+@app.route('/api/rating_buffer', methods=['GET'])
+def get_rating_buffer_stats():
+    """Write-behind queue depth, flush sizes and lag for this worker."""
+    if not RATING_WRITE_BEHIND:
+        return jsonify({"error": "Write-behind ratings are off (RATING_WRITE_BEHIND=on enables them)"}), 404
+    return jsonify(get_rating_buffer().stats()), 200
+
+@app.route('/api/mf', methods=['GET'])
+def get_mf_stats():
+    """Loaded MF model metadata (training time, size) and this worker's scoring latency."""
+    model = get_mf_model()
+    if model is None:
+        return jsonify({"error": "No matrix-factorization model has been trained"}), 404
+    requests_scored = model.scoring_requests
+    return jsonify({
+        "model": model.meta,
+        "version": model.version,
+        "fold_ins": model.fold_ins,
+        "fold_in_cache_hits": model.fold_in_cache_hits,
+        "scoring_requests": requests_scored,
+        "scoring_avg_ms": round(model.scoring_ms_total / requests_scored, 3) if requests_scored else None,
+        "pid": os.getpid(),
+    }), 200
+
 # --- Frontend Serving Routes ---
 
 @app.route('/')
@@ -770,4 +1642,3 @@ def serve_static(filename):
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=True)
-
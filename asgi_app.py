@@ -0,0 +1,245 @@
+"""
+Optional asyncio/ASGI serving mode.
+
+The read endpoints below are re-implemented as Quart coroutines on top of an
+aiomysql connection pool, using the same SQL as app.py (see queries.py).
+Independent queries run concurrently on separate pooled connections, e.g.
+/api/recommendations/rails fans out the popular and personal rails with
+asyncio.gather instead of running them back to back.
+
+Every other route (writes, admin console, static files, and routes served
+from in-process indexes such as content similarity) falls through
+to the regular Flask app wrapped as ASGI, so the async mode exposes the same
+API. The sync mode is unchanged:
+
+    gunicorn -w 4 app:app                      # sync, one request per worker thread
+    uvicorn --workers 4 asgi_app:application   # async
+"""
+import asyncio
+import logging
+import os
+import time
+
+import aiomysql
+from asgiref.wsgi import WsgiToAsgi
+from quart import Quart, g, jsonify, request
+from werkzeug.exceptions import HTTPException
+
+import queries
+import sql_metrics
+from app import app as flask_app, DB_CONFIG, MAX_BATCH_MOVIES, movie_details_text
+from db_pool import POOL_SIZE, POOL_MAX_LIFETIME
+from popularity import parse_popular_window
+from trending import parse_trending_args, trending_query
+
+quart_app = Quart(__name__)
+pool = None
+logger = logging.getLogger(__name__)
+
+
+@quart_app.before_serving
+async def create_pool():
+    global pool
+    pool = await aiomysql.create_pool(
+        host=DB_CONFIG["host"],
+        port=int(DB_CONFIG["port"] or 3306),
+        user=DB_CONFIG["user"],
+        password=DB_CONFIG["password"],
+        db=DB_CONFIG["database"],
+        minsize=1,
+        maxsize=POOL_SIZE,
+        pool_recycle=POOL_MAX_LIFETIME,
+        autocommit=True,
+    )
+
+
+@quart_app.after_serving
+async def close_pool():
+    pool.close()
+    await pool.wait_closed()
+
+
+@quart_app.before_request
+async def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@quart_app.after_request
+async def record_request_time(response):
+    started = getattr(g, "request_started", None)
+    if started is not None and sql_metrics.SQL_METRICS_ENABLED:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        sql_metrics.record_request(request.method, route, response.status_code, time.perf_counter() - started)
+    return response
+
+
+# --- Query Helpers ---
+# Statements are recorded in sql_metrics like the sync app's pooled cursors,
+# including the EXPLAIN capture for slow ones.
+
+async def _timed_fetch(conn, cursor, sql, params):
+    start = time.perf_counter()
+    try:
+        await cursor.execute(sql, params)
+        rows = await cursor.fetchall()
+    except aiomysql.MySQLError:
+        if sql_metrics.SQL_METRICS_ENABLED:
+            sql_metrics.record_query(sql, time.perf_counter() - start, None, error=True)
+        raise
+    if sql_metrics.SQL_METRICS_ENABLED:
+        seconds = time.perf_counter() - start
+        qid = sql_metrics.record_query(sql, seconds, len(rows))
+        if qid:
+            try:
+                async with conn.cursor() as explain:
+                    await explain.execute("EXPLAIN " + sql, params)
+                    columns = [column[0] for column in explain.description]
+                    sql_metrics.store_plan(qid, seconds, columns, await explain.fetchall())
+            except aiomysql.MySQLError as err:
+                logger.warning("Could not EXPLAIN query %s: %s", qid, err)
+    return rows
+
+
+async def fetch_all(sql, params=()):
+    """Runs one query on its own pooled connection and returns dict rows."""
+    async with pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            return await _timed_fetch(conn, cursor, sql, params)
+
+
+async def fetch_values(sql, params=()):
+    """Runs one query and returns the first column of every row."""
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            return [row[0] for row in await _timed_fetch(conn, cursor, sql, params)]
+
+
+async def rows_response(sql, params=()):
+    try:
+        return jsonify(await fetch_all(sql, params)), 200
+    except aiomysql.MySQLError as err:
+        return jsonify({"error": str(err)}), 500
+
+
+# --- Async Endpoints ---
+
+@quart_app.route('/api/genres', methods=['GET'])
+async def get_genres():
+    return await rows_response(*queries.genres_query())
+
+
+@quart_app.route('/api/movies/<int:movie_id>', methods=['GET'])
+async def get_movie_details(movie_id):
+    user_id = request.args.get('user_id')
+    try:
+        rows = await fetch_values(*queries.movie_details_query(movie_id, user_id))
+    except aiomysql.MySQLError as err:
+        return jsonify({"error": str(err)}), 500
+    if not rows:
+        return jsonify({"error": "Movie not found"}), 404
+    return quart_app.response_class(movie_details_text(rows[0]), mimetype='application/json'), 200
+
+
+@quart_app.route('/api/movies/batch', methods=['GET'])
+async def get_movie_details_batch():
+    user_id = request.args.get('user_id')
+    try:
+        movie_ids = [int(part) for part in request.args.get('ids', '').split(',') if part.strip()]
+    except ValueError:
+        return jsonify({"error": "ids must be a comma-separated list of integers"}), 400
+
+    movie_ids = list(dict.fromkeys(movie_ids))
+    if not movie_ids:
+        return jsonify({"error": "ids is required"}), 400
+    if len(movie_ids) > MAX_BATCH_MOVIES:
+        return jsonify({"error": f"At most {MAX_BATCH_MOVIES} ids per request"}), 400
+
+    try:
+        rows = await fetch_values(*queries.movie_details_batch_query(movie_ids, user_id))
+    except aiomysql.MySQLError as err:
+        return jsonify({"error": str(err)}), 500
+    body = "[" + ",".join(movie_details_text(row) for row in rows) + "]"
+    return quart_app.response_class(body, mimetype='application/json'), 200
+
+
+@quart_app.route('/api/recommendations/popular', methods=['GET'])
+async def get_popular_movies():
+    try:
+        limit, offset = parse_popular_window(request.args)
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+    return await rows_response(*queries.popular_movies_query(limit, offset))
+
+
+@quart_app.route('/api/recommendations/trending', methods=['GET'])
+async def get_trending_movies():
+    try:
+        window, limit = parse_trending_args(request.args)
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+    return await rows_response(*trending_query(window, limit))
+
+
+@quart_app.route('/api/recommendations/collaborative/<int:movie_id>', methods=['GET'])
+async def get_collaborative_recommendations(movie_id):
+    return await rows_response(*queries.collaborative_recommendations_query(movie_id))
+
+
+@quart_app.route('/api/recommendations/synopsis/<int:movie_id>', methods=['GET'])
+async def get_synopsis_recommendations(movie_id):
+    return await rows_response(*queries.synopsis_recommendations_query(movie_id))
+
+
+@quart_app.route('/api/recommendations/personal_content', methods=['GET'])
+async def get_personal_content_recommendations():
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({"error": "user_id is required"}), 400
+    return await rows_response(*queries.personal_content_query(user_id))
+
+
+@quart_app.route('/api/recommendations/personal_collaborative', methods=['GET'])
+async def get_personal_collaborative_recommendations():
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({"error": "user_id is required"}), 400
+    return await rows_response(*queries.personal_collaborative_query(user_id))
+
+
+@quart_app.route('/api/recommendations/rails', methods=['GET'])
+async def get_recommendation_rails():
+    """Same payload as the sync route, but every rail runs concurrently."""
+    rails = queries.recommendation_rails(request.args.get('user_id'))
+    try:
+        results = await asyncio.gather(*(fetch_all(sql, params) for sql, params in rails.values()))
+    except aiomysql.MySQLError as err:
+        return jsonify({"error": str(err)}), 500
+    return jsonify(dict(zip(rails.keys(), results))), 200
+
+
+# --- ASGI Entry Point ---
+# Requests matching an async route go to Quart; everything else is served
+# by the Flask app (run in a thread pool by asgiref).
+
+flask_asgi = WsgiToAsgi(flask_app)
+_async_routes = quart_app.url_map.bind("localhost")
+
+
+def _is_async_route(scope):
+    try:
+        _async_routes.match(scope["path"], method=scope["method"])
+        return True
+    except HTTPException:
+        return False
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan" or (scope["type"] == "http" and _is_async_route(scope)):
+        await quart_app(scope, receive, send)
+    else:
+        await flask_asgi(scope, receive, send)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run("asgi_app:application", host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
@@ -0,0 +1,453 @@
+"""
+HTTP load generator and benchmark suite for the API.
+
+Ad-hoc mode hits a fixed list of GET paths, e.g. to compare serving modes:
+
+    gunicorn -w 4 --threads 8 app:app
+    python benchmark.py --path "/api/recommendations/rails?user_id=1" --concurrency 32 --duration 30
+
+    uvicorn --workers 4 asgi_app:application --port 5000
+    python benchmark.py --path "/api/recommendations/rails?user_id=1" --concurrency 32 --duration 30
+
+Suite mode replays a weighted mix of every public endpoint (MIX), including
+ratings and watchlist toggles, and reports QPS and p50/p95/p99 per endpoint.
+With --seed-db it recreates the database from schema.sql and loads it with
+data_generator.py at each --scale, (optionally) builds the offline indexes,
+and restarts the app with --server-cmd so every run starts cold:
+
+    python benchmark.py --seed-db --prepare --scale 1 --scale 10 --scale 100 \\
+        --server-cmd "gunicorn -w 4 --threads 8 -b 127.0.0.1:5000 app:app" \\
+        --concurrency 32 --duration 60 --output results/run.json
+    python benchmark.py --scale 10 --compare results/run.json   # against a server that is already up
+
+Results are JSON so runs can be diffed; --compare prints the change of
+every endpoint's QPS and p95 against an earlier file. --ingest-rows also
+measures rating ingestion in rows/s, one row per /api/rate call against
+/api/rate/batch.
+"""
+import argparse
+import datetime
+import http.client
+import json
+import logging
+import os
+import random
+import re
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import quote, urlparse
+
+from dotenv import load_dotenv
+
+import data_generator
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- Database configuration (the "DB_CONFIG" equivalent) ---
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST"),
+    "port": os.getenv("DB_PORT"),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD"),
+}
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SCHEMA_FILE = os.path.join(ROOT, "schema.sql")
+SERVER_READY_TIMEOUT = 180
+REQUEST_TIMEOUT = 30
+
+# manage.py commands run by --prepare, after the data is loaded. migrate
+# also builds the (still empty) co-occurrence, synopsis and neighbour tables.
+PREPARE_COMMANDS = [
+    ["migrate"],
+    ["build-content-index"],
+    ["train-mf"],
+]
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+# --- Request Mix ---
+# name -> (weight, factory). A factory takes (rng, counts) and returns
+# (method, path, json body or None). Ids are drawn from the ranges
+# data_generator produces at the benchmarked scale.
+
+def _user(rng, counts):
+    return rng.randint(1, counts["users"])
+
+def _movie(rng, counts):
+    return rng.randint(1, counts["movies"])
+
+MIX = {
+    "movies_list": (15, lambda rng, c: ("GET", "/api/movies", None)),
+    "movies_recent": (5, lambda rng, c: ("GET", "/api/movies?list=recent", None)),
+    "movies_search": (10, lambda rng, c: ("GET", f"/api/movies?search={quote(rng.choice(data_generator.WORDS))}", None)),
+    "movies_genre": (5, lambda rng, c: ("GET", f"/api/movies?genre={rng.randint(1, c['genres'])}", None)),
+    "movies_genre_top": (2, lambda rng, c: ("GET", f"/api/movies?genre={rng.randint(1, c['genres'])}&list=top_rated", None)),
+    "movies_genre_pair": (2, lambda rng, c: (
+        "GET", f"/api/movies?genre={','.join(map(str, rng.sample(range(1, c['genres'] + 1), 2)))}", None)),
+    "movie_detail": (15, lambda rng, c: ("GET", f"/api/movies/{_movie(rng, c)}", None)),
+    "popular": (6, lambda rng, c: ("GET", "/api/recommendations/popular", None)),
+    "popular_page": (2, lambda rng, c: ("GET", f"/api/recommendations/popular?limit=50&offset={rng.randrange(0, 950, 50)}", None)),
+    "trending": (2, lambda rng, c: ("GET", f"/api/recommendations/trending?window={rng.choice(['24h', '7d', '30d'])}", None)),
+    "content": (5, lambda rng, c: ("GET", f"/api/recommendations/content/{_movie(rng, c)}", None)),
+    "collaborative": (5, lambda rng, c: ("GET", f"/api/recommendations/collaborative/{_movie(rng, c)}", None)),
+    "synopsis": (3, lambda rng, c: ("GET", f"/api/recommendations/synopsis/{_movie(rng, c)}", None)),
+    "personal_content": (4, lambda rng, c: ("GET", f"/api/recommendations/personal_content?user_id={_user(rng, c)}", None)),
+    "personal_collaborative": (4, lambda rng, c: (
+        "GET", f"/api/recommendations/personal_collaborative?user_id={_user(rng, c)}", None)),
+    "personal_mf": (3, lambda rng, c: ("GET", f"/api/recommendations/personal_mf?user_id={_user(rng, c)}", None)),
+    "rails": (4, lambda rng, c: ("GET", f"/api/recommendations/rails?user_id={_user(rng, c)}", None)),
+    "rate": (8, lambda rng, c: ("POST", "/api/rate", {
+        "user_id": _user(rng, c), "movie_id": _movie(rng, c), "rating": rng.randint(1, 5)})),
+    "watchlist_toggle": (4, lambda rng, c: ("POST", "/api/watchlist/toggle", {
+        "user_id": _user(rng, c), "movie_id": _movie(rng, c)})),
+}
+
+
+def fixed_paths_mix(paths):
+    """The ad-hoc mix: every path equally often, reported under its own name."""
+    return {path: (1, lambda rng, c, path=path: ("GET", path, None)) for path in paths}
+
+
+# --- Load Generation ---
+
+def run_load(base_url, mix, counts, concurrency, duration, seed=0):
+    """
+    Replays `mix` from `concurrency` keep-alive clients for `duration` seconds.
+    Returns {"total": stats, "endpoints": {name: stats}}. Responses with
+    status >= 500 and connection failures count as errors; 4xx responses
+    (e.g. a user without a watchlist) are normal outcomes of random ids.
+    """
+    target = urlparse(base_url)
+    names = list(mix)
+    weights = [mix[name][0] for name in names]
+    deadline = time.monotonic() + duration
+    latencies = {name: [] for name in names}
+    errors = dict.fromkeys(names, 0)
+    lock = threading.Lock()
+
+    def connect():
+        return http.client.HTTPConnection(target.hostname, target.port or 80, timeout=REQUEST_TIMEOUT)
+
+    def worker(n):
+        rng = random.Random(f"{seed}:{n}")
+        conn = connect()
+        local = {name: [] for name in names}
+        local_errors = dict.fromkeys(names, 0)
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            method, path, body = mix[name][1](rng, counts)
+            payload = json.dumps(body) if body is not None else None
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                if response.status >= 500:
+                    local_errors[name] += 1
+            except (OSError, http.client.HTTPException):
+                local_errors[name] += 1
+                conn.close()
+                conn = connect()
+                continue
+            local[name].append((time.perf_counter() - start) * 1000)
+        conn.close()
+        with lock:
+            for name in names:
+                latencies[name].extend(local[name])
+                errors[name] += local_errors[name]
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    def summarize(values, error_count):
+        values.sort()
+        return {
+            "requests": len(values),
+            "errors": error_count,
+            "qps": round(len(values) / elapsed, 1),
+            "p50_ms": round(percentile(values, 50), 2),
+            "p95_ms": round(percentile(values, 95), 2),
+            "p99_ms": round(percentile(values, 99), 2),
+        }
+
+    endpoints = {name: summarize(latencies[name], errors[name]) for name in names}
+    everything = [value for name in names for value in latencies[name]]
+    return {"total": summarize(everything, sum(errors.values())), "endpoints": endpoints}
+
+
+# --- Rating Ingestion ---
+
+def run_ingest(base_url, counts, rows, batch_size, concurrency, seed=0):
+    """
+    Writes `rows` random ratings once through /api/rate (one request per
+    row) and once through /api/rate/batch (batch_size rows per request),
+    each from `concurrency` clients. Returns rows/s for both.
+    """
+    target = urlparse(base_url)
+    rng = random.Random(f"ingest:{seed}")
+    ratings = [{"user_id": _user(rng, counts), "movie_id": _movie(rng, counts), "rating": rng.randint(1, 5)}
+               for _ in range(rows)]
+
+    def post_all(path, bodies):
+        queue, failed, lock = list(reversed(bodies)), [0], threading.Lock()
+
+        def worker():
+            conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=REQUEST_TIMEOUT * 10)
+            while True:
+                with lock:
+                    if not queue:
+                        break
+                    body = queue.pop()
+                try:
+                    conn.request("POST", path, body=json.dumps(body), headers={"Content-Type": "application/json"})
+                    response = conn.getresponse()
+                    response.read()
+                    ok = response.status < 300
+                except (OSError, http.client.HTTPException):
+                    ok = False
+                    conn.close()
+                    conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=REQUEST_TIMEOUT * 10)
+                if not ok:
+                    with lock:
+                        failed[0] += 1
+            conn.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start, failed[0]
+
+    single_s, single_failed = post_all("/api/rate", ratings)
+    batches = [{"ratings": ratings[i:i + batch_size]} for i in range(0, rows, batch_size)]
+    batch_s, batch_failed = post_all("/api/rate/batch", batches)
+    return {
+        "rows": rows,
+        "batch_size": batch_size,
+        "single": {"seconds": round(single_s, 2), "failed_requests": single_failed,
+                   "rows_per_s": round(rows / single_s, 1)},
+        "batch": {"seconds": round(batch_s, 2), "failed_requests": batch_failed,
+                  "rows_per_s": round(rows / batch_s, 1)},
+    }
+
+
+# --- Database Seeding ---
+
+def schema_statements(path=SCHEMA_FILE):
+    """schema.sql split into statements, with comments stripped."""
+    with open(path, encoding="utf-8") as f:
+        text = re.sub(r"/\*.*?\*/", "", f.read(), flags=re.S)
+    text = "\n".join(line for line in text.splitlines() if not line.lstrip().startswith("--"))
+    return [statement.strip() for statement in text.split(";") if statement.strip()]
+
+
+def reset_database():
+    """Drops and recreates the database from schema.sql."""
+    import mysql.connector
+
+    cnx = mysql.connector.connect(**DB_CONFIG)
+    cursor = cnx.cursor()
+    try:
+        cursor.execute("DROP DATABASE IF EXISTS movie_rec_db")
+        for statement in schema_statements():
+            cursor.execute(statement)
+        cnx.commit()
+    finally:
+        cursor.close()
+        cnx.close()
+
+
+def run_step(args):
+    """Runs a repo script with the current interpreter. Returns its wall time."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + args, cwd=ROOT, check=True)
+    return round(time.perf_counter() - start, 2)
+
+
+def seed_database(scale, workers, prepare):
+    """Recreates the schema and loads it at `scale`. Returns {step: seconds}."""
+    timings = {}
+    start = time.perf_counter()
+    reset_database()
+    timings["reset_schema_s"] = round(time.perf_counter() - start, 2)
+    timings["data_generator_s"] = run_step(["data_generator.py", "--scale", str(scale), "--workers", str(workers)])
+    if prepare:
+        for command in PREPARE_COMMANDS:
+            timings[f"{command[0]}_s"] = run_step(["manage.py"] + command)
+    return timings
+
+
+# --- App Server ---
+
+def wait_until_ready(base_url, timeout=SERVER_READY_TIMEOUT):
+    target = urlparse(base_url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=5)
+        try:
+            conn.request("GET", "/api/genres")
+            if conn.getresponse().status < 500:
+                return
+        except (OSError, http.client.HTTPException):
+            pass
+        finally:
+            conn.close()
+        time.sleep(0.5)
+    raise RuntimeError(f"server at {base_url} not ready after {timeout}s")
+
+
+def start_server(command, base_url):
+    process = subprocess.Popen(shlex.split(command), cwd=ROOT)
+    try:
+        wait_until_ready(base_url)
+    except Exception:
+        logger.exception("Server did not start: %s", command)
+        stop_server(process)
+        raise
+    return process
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        logger.warning("Server did not stop within 15s; killing it.")
+        process.kill()
+        process.wait()
+
+
+# --- Reporting ---
+
+def print_report(result):
+    print(f"  {'endpoint':<24} {'requests':>9} {'errors':>7} {'qps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    rows = sorted(result["endpoints"].items()) + [("TOTAL", result["total"])]
+    for name, stats in rows:
+        print(f"  {name:<24} {stats['requests']:>9} {stats['errors']:>7} {stats['qps']:>9} "
+              f"{stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9}")
+
+
+def print_comparison(runs, baseline_path):
+    """Prints QPS and p95 changes against the runs of an earlier results file, matched by scale."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {run["scale"]: run for run in json.load(f)["runs"]}
+
+    def change(new, old):
+        return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+    for run in runs:
+        old_run = baseline.get(run["scale"])
+        if not old_run:
+            logger.warning("No baseline run at scale %s in %s.", run['scale'], baseline_path)
+            continue
+        print(f"Scale {run['scale']} vs {baseline_path}:")
+        print(f"  {'endpoint':<24} {'qps':>9} {'change':>8} {'p95 ms':>9} {'change':>8}")
+        rows = sorted(run["endpoints"].items()) + [("TOTAL", run["total"])]
+        for name, stats in rows:
+            old = old_run["total"] if name == "TOTAL" else old_run["endpoints"].get(name)
+            if not old:
+                continue
+            print(f"  {name:<24} {stats['qps']:>9} {change(stats['qps'], old['qps']):>8} "
+                  f"{stats['p95_ms']:>9} {change(stats['p95_ms'], old['p95_ms']):>8}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:5000")
+    parser.add_argument("--path", action="append", help="only hit this path (repeatable) instead of the full mix")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=0, help="seconds of unrecorded load before each run")
+    parser.add_argument("--scale", type=float, action="append",
+                        help="data scale factor (repeatable); sets the id ranges and, with --seed-db, the data set")
+    parser.add_argument("--seed-db", action="store_true", help="recreate and load the database before each scale")
+    parser.add_argument("--prepare", action="store_true", help="build the offline indexes after seeding")
+    parser.add_argument("--gen-workers", type=int, default=os.cpu_count() or 1, help="data_generator --workers")
+    parser.add_argument("--server-cmd", help="command that starts the app; restarted for every scale")
+    parser.add_argument("--random-seed", type=int, default=0, help="seed of the request mix")
+    parser.add_argument("--ingest-rows", type=int, default=0,
+                        help="also write this many ratings via /api/rate and /api/rate/batch and compare rows/s")
+    parser.add_argument("--ingest-batch", type=int, default=1000, help="rows per /api/rate/batch request")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    mix = fixed_paths_mix(args.path) if args.path else MIX
+    scales = args.scale or [1.0]
+    runs = []
+    for scale in scales:
+        counts = data_generator.scaled_counts(scale)
+        run = {"scale": scale, "counts": counts}
+        if args.seed_db:
+            logger.info("Seeding the database at scale %s...", scale)
+            run["seed_timings"] = seed_database(scale, args.gen_workers, args.prepare)
+
+        server = start_server(args.server_cmd, args.base_url) if args.server_cmd else None
+        try:
+            if args.warmup:
+                run_load(args.base_url, mix, counts, args.concurrency, args.warmup, args.random_seed + 1)
+            logger.info("Scale %s: %d clients for %ss against %s", scale, args.concurrency, args.duration, args.base_url)
+            run.update(run_load(args.base_url, mix, counts, args.concurrency, args.duration, args.random_seed))
+            if args.ingest_rows:
+                run["ingest"] = run_ingest(args.base_url, counts, args.ingest_rows, args.ingest_batch,
+                                           args.concurrency, args.random_seed)
+        finally:
+            if server:
+                stop_server(server)
+        print_report(run)
+        if "ingest" in run:
+            ingest = run["ingest"]
+            print(f"  ingest {ingest['rows']} ratings: /api/rate {ingest['single']['rows_per_s']} rows/s, "
+                  f"/api/rate/batch ({ingest['batch_size']}/request) {ingest['batch']['rows_per_s']} rows/s")
+        runs.append(run)
+
+    if args.compare:
+        print_comparison(runs, args.compare)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                "revision": git_revision(),
+                "base_url": args.base_url,
+                "concurrency": args.concurrency,
+                "duration_s": args.duration,
+                "server_cmd": args.server_cmd,
+                "mix": {name: weight for name, (weight, _) in mix.items()},
+                "runs": runs,
+            }, f, indent=2)
+        logger.info("Results written to %s.", args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+In-process content-similarity index for /api/recommendations/content/<id>.
+
+Every movie is a sparse one-hot row over its genres, directors and
+top-billed actors. Features are IDF-weighted (a shared director says more
+than a shared genre) and rows are L2-normalized, so "movies like X" is the
+cosine between X and every other movie. Scores are accumulated over the
+posting lists of X's features only, then the top K are taken with
+argpartition.
+
+The index is built per worker from the junction tables (or loaded from the
+snapshot written by `manage.py build-content-index`), kept current by
+add_link() for rows inserted through /api/insert, and rebuilt in the
+background every CONTENT_REBUILD_SECONDS to pick up other workers' inserts.
+add_link() updates the linked movie's norm and the feature's IDF right
+away; the norms of other movies catch up on the next rebuild.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+from scipy import sparse
+
+from array_utils import GrowableArray
+
+CONTENT_SNAPSHOT = os.getenv("CONTENT_SNAPSHOT", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "models", "content_index.npz"))
+CONTENT_REBUILD_SECONDS = float(os.getenv("CONTENT_REBUILD_SECONDS", 900))
+# movie_actors has no billing order; the lowest actor_ids per movie stand in for it
+TOP_BILLED_ACTORS = 5
+FETCH_BATCH = 50000
+
+# kind code -> (name, junction table, feature column)
+FEATURE_KINDS = {
+    0: ("genre", "movie_genres", "genre_id"),
+    1: ("director", "movie_directors", "director_id"),
+    2: ("actor", "movie_actors", "actor_id"),
+}
+_KIND_SHIFT = 40                  # (kind, feature_id) packed into one int64 while building
+KIND_OF_TABLE = {table: code for code, (_, table, _) in FEATURE_KINDS.items()}
+
+
+def _load_links(cursor):
+    """Returns (movie_ids, kinds, feature_ids) arrays for every feature link."""
+    movie_parts, kind_parts, feature_parts = [], [], []
+    for code, (_, table, column) in FEATURE_KINDS.items():
+        if table == "movie_actors":
+            # DISTINCT: an actor can appear under several role names
+            cursor.execute(f"""
+                SELECT movie_id, actor_id FROM (
+                    SELECT movie_id, actor_id,
+                           DENSE_RANK() OVER (PARTITION BY movie_id ORDER BY actor_id) AS billing
+                    FROM (SELECT DISTINCT movie_id, actor_id FROM movie_actors) ma
+                ) billed
+                WHERE billing <= {TOP_BILLED_ACTORS}
+            """)
+        else:
+            cursor.execute(f"SELECT movie_id, {column} FROM {table}")
+        while True:
+            rows = cursor.fetchmany(FETCH_BATCH)
+            if not rows:
+                break
+            pairs = np.asarray(rows, dtype=np.int64)
+            movie_parts.append(pairs[:, 0])
+            feature_parts.append(pairs[:, 1])
+            kind_parts.append(np.full(len(pairs), code, dtype=np.int8))
+    if not movie_parts:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, np.empty(0, dtype=np.int8), empty
+    return np.concatenate(movie_parts), np.concatenate(kind_parts), np.concatenate(feature_parts)
+
+
+class ContentSimilarityIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.movie_ids = GrowableArray(np.int64)
+        self.row_of_movie = {}
+        self.norms = GrowableArray(np.float32)
+
+        self.feature_kinds = GrowableArray(np.int8)
+        self.feature_ids = GrowableArray(np.int64)
+        self.column_of_feature = {}       # (kind, feature_id) -> column
+        self.df = GrowableArray(np.int32)
+        self.idf = GrowableArray(np.float32)
+
+        # Built part: CSR rows (movie -> columns) and CSC postings (column -> rows)
+        self.row_indptr = np.zeros(1, dtype=np.int64)
+        self.row_indices = np.empty(0, dtype=np.int32)
+        self.col_indptr = np.zeros(1, dtype=np.int64)
+        self.col_indices = np.empty(0, dtype=np.int32)
+        # Added since the build by add_link()
+        self.extra_row_features = {}      # row -> list of columns
+        self.extra_postings = {}          # column -> list of rows
+
+        self.built_at = 0.0
+
+    # --- Building ---
+
+    def _load_arrays(self, movie_ids, feature_kinds, feature_ids, indptr, indices):
+        """Installs a movies x features CSR structure and derives everything else from it."""
+        n_movies, n_features = len(movie_ids), len(feature_ids)
+        self.movie_ids.extend(movie_ids)
+        self.row_of_movie = dict(zip(np.asarray(movie_ids).tolist(), range(n_movies)))
+        self.feature_kinds.extend(feature_kinds)
+        self.feature_ids.extend(feature_ids)
+        self.column_of_feature = dict(zip(zip(np.asarray(feature_kinds).tolist(), np.asarray(feature_ids).tolist()),
+                                          range(n_features)))
+
+        matrix = sparse.csr_matrix((np.ones(len(indices), dtype=np.float32), indices, indptr),
+                                   shape=(n_movies, n_features))
+        self.row_indptr, self.row_indices = matrix.indptr.astype(np.int64), matrix.indices.astype(np.int32)
+        by_column = matrix.tocsc()
+        self.col_indptr, self.col_indices = by_column.indptr.astype(np.int64), by_column.indices.astype(np.int32)
+
+        df = np.diff(self.col_indptr).astype(np.int32)
+        idf = self._idf(df, n_movies)
+        self.df.extend(df)
+        self.idf.extend(idf)
+        weights = sparse.csr_matrix((idf[self.row_indices] ** 2, self.row_indices, self.row_indptr),
+                                    shape=(n_movies, n_features))
+        self.norms.extend(np.sqrt(np.asarray(weights.sum(axis=1)).ravel()))
+
+    @staticmethod
+    def _idf(df, n_movies):
+        return (np.log((1 + n_movies) / (1 + np.asarray(df, dtype=np.float64))) + 1).astype(np.float32)
+
+    def build(self, cursor):
+        """Loads every feature link. Returns the number of movies with features."""
+        movies, kinds, features = _load_links(cursor)
+        movie_ids, rows = np.unique(movies, return_inverse=True)
+        feature_keys, cols = np.unique((kinds.astype(np.int64) << _KIND_SHIFT) | features, return_inverse=True)
+        matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)),
+                                   shape=(len(movie_ids), len(feature_keys)))
+        matrix.sum_duplicates()
+        with self._lock:
+            self._load_arrays(movie_ids, (feature_keys >> _KIND_SHIFT).astype(np.int8),
+                              feature_keys & ((1 << _KIND_SHIFT) - 1), matrix.indptr, matrix.indices)
+            self.built_at = time.time()
+        return len(movie_ids)
+
+    def save(self, path=CONTENT_SNAPSHOT):
+        with self._lock:
+            matrix = self._matrix()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp.npz"
+            np.savez(tmp_path, movie_ids=self.movie_ids.view, feature_kinds=self.feature_kinds.view,
+                     feature_ids=self.feature_ids.view, indptr=matrix.indptr, indices=matrix.indices,
+                     built_at=np.float64(self.built_at))
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=CONTENT_SNAPSHOT):
+        index = cls()
+        with np.load(path) as data:
+            index._load_arrays(data["movie_ids"], data["feature_kinds"], data["feature_ids"],
+                               data["indptr"], data["indices"])
+            index.built_at = float(data["built_at"])
+        return index
+
+    def _matrix(self):
+        """Current movies x features structure, including links added since the build."""
+        n_rows, n_cols = self.movie_ids.size, self.feature_ids.size
+        built_rows = len(self.row_indptr) - 1
+        matrix = sparse.csr_matrix((np.ones(len(self.row_indices), dtype=np.float32), self.row_indices,
+                                    self.row_indptr), shape=(built_rows, n_cols))
+        matrix.resize((n_rows, n_cols))
+        if self.extra_row_features:
+            rows = [row for row, cols in self.extra_row_features.items() for _ in cols]
+            cols = [col for row_cols in self.extra_row_features.values() for col in row_cols]
+            extra = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(n_rows, n_cols))
+            matrix = matrix + extra
+        return matrix.tocsr()
+
+    # --- Incremental Updates ---
+
+    def _row_features(self, row):
+        cols = []
+        if row < len(self.row_indptr) - 1:
+            cols = self.row_indices[self.row_indptr[row]:self.row_indptr[row + 1]].tolist()
+        return cols + self.extra_row_features.get(row, [])
+
+    def add_link(self, table, movie_id, feature_id):
+        """Adds one junction-table row (movie_genres / movie_directors / movie_actors)."""
+        kind = KIND_OF_TABLE.get(table)
+        if kind is None:
+            return
+        with self._lock:
+            row = self.row_of_movie.get(movie_id)
+            if row is None:
+                row = self.movie_ids.size
+                self.movie_ids.append(movie_id)
+                self.norms.append(0.0)
+                self.row_of_movie[movie_id] = row
+
+            col = self.column_of_feature.get((kind, feature_id))
+            if col is None:
+                col = self.feature_ids.size
+                self.feature_kinds.append(kind)
+                self.feature_ids.append(feature_id)
+                self.df.append(0)
+                self.idf.append(0.0)
+                self.column_of_feature[(kind, feature_id)] = col
+
+            current = self._row_features(row)
+            if col in current:
+                return
+            if kind == 2 and sum(1 for c in current if self.feature_kinds.view[c] == 2) >= TOP_BILLED_ACTORS:
+                return
+
+            self.extra_row_features.setdefault(row, []).append(col)
+            self.extra_postings.setdefault(col, []).append(row)
+            self.df.view[col] += 1
+            self.idf.view[col] = self._idf(self.df.view[col], self.movie_ids.size)
+            cols = np.asarray(current + [col], dtype=np.int64)
+            self.norms.view[row] = np.sqrt(np.sum(self.idf.view[cols] ** 2))
+
+    # --- Querying ---
+
+    def similar(self, movie_id, limit=10):
+        """
+        Returns up to `limit` dicts {movie_id, similarity, genre_matches,
+        director_matches, actor_matches}, best first (ties by movie_id).
+        """
+        with self._lock:
+            row = self.row_of_movie.get(movie_id)
+            if row is None:
+                return []
+            cols = self._row_features(row)
+            if not cols:
+                return []
+
+            idf, norms = self.idf.view, self.norms.view
+            scores = np.zeros(self.movie_ids.size, dtype=np.float32)
+            for col in cols:
+                weight = idf[col] ** 2
+                if col < len(self.col_indptr) - 1:
+                    scores[self.col_indices[self.col_indptr[col]:self.col_indptr[col + 1]]] += weight
+                extra = self.extra_postings.get(col)
+                if extra:
+                    scores[extra] += weight
+            scores[row] = 0
+
+            candidates = np.flatnonzero(scores)
+            if not len(candidates):
+                return []
+            denominators = norms[candidates] * norms[row]
+            similarity = np.divide(scores[candidates], denominators,
+                                   out=np.zeros(len(candidates), dtype=np.float32), where=denominators > 0)
+            if len(candidates) > limit:
+                # Keep every candidate tied with the K-th score so ties break by movie_id
+                threshold = np.partition(similarity, len(similarity) - limit)[len(similarity) - limit]
+                keep = similarity >= threshold
+                candidates, similarity = candidates[keep], similarity[keep]
+            movie_ids = self.movie_ids.view[candidates]
+            order = np.lexsort((movie_ids, -similarity))[:limit]
+
+            query_cols = set(cols)
+            kinds = self.feature_kinds.view
+            results = []
+            for i in order:
+                shared = query_cols.intersection(self._row_features(int(candidates[i])))
+                matches = np.bincount(kinds[list(shared)], minlength=3)
+                results.append({
+                    "movie_id": int(movie_ids[i]),
+                    "similarity": round(float(similarity[i]), 4),
+                    "genre_matches": int(matches[0]),
+                    "director_matches": int(matches[1]),
+                    "actor_matches": int(matches[2]),
+                })
+            return results
@@ -0,0 +1,171 @@
+"""
+Item-to-item co-occurrence index for /api/recommendations/collaborative.
+
+For every movie we keep its top-K "co-liked" movies: movies that the same
+users rated >= LIKE_THRESHOLD. Similarity is the cosine between the two
+movies' columns of the binary user x movie "liked" matrix:
+
+    cos(i, j) = co_likes(i, j) / sqrt(likes(i) * likes(j))
+
+The matrix product is done with scipy.sparse in chunks of movies so memory
+stays bounded, and the result is written to movie_similar_movies so the
+endpoint is a single primary-key range read.
+"""
+import time
+
+import numpy as np
+from scipy import sparse
+
+LIKE_THRESHOLD = 4
+DEFAULT_TOP_K = 20
+CHUNK_MOVIES = 2000      # rows of X^T X computed at once
+FETCH_BATCH = 50000      # rows pulled from MySQL per fetchmany()
+
+
+def load_movie_ids(cursor):
+    cursor.execute("SELECT movie_id FROM movies ORDER BY movie_id")
+    return np.fromiter((row[0] for row in cursor.fetchall()), dtype=np.int64)
+
+
+def load_liked_matrix(cursor, movie_ids):
+    """
+    Builds the binary users x movies CSC matrix of likes.
+    Columns follow the order of movie_ids; users are re-indexed densely.
+    """
+    cursor.execute("SELECT user_id, movie_id FROM ratings WHERE rating >= %s", (LIKE_THRESHOLD,))
+    user_parts, movie_parts = [], []
+    while True:
+        rows = cursor.fetchmany(FETCH_BATCH)
+        if not rows:
+            break
+        pairs = np.asarray(rows, dtype=np.int64)
+        user_parts.append(pairs[:, 0])
+        movie_parts.append(pairs[:, 1])
+
+    if not user_parts:
+        return sparse.csc_matrix((0, len(movie_ids)), dtype=np.float32)
+
+    users = np.concatenate(user_parts)
+    movies = np.concatenate(movie_parts)
+
+    # Drop likes for movies that no longer exist, then map ids to dense indexes
+    cols = np.searchsorted(movie_ids, movies)
+    cols = np.clip(cols, 0, len(movie_ids) - 1)
+    known = movie_ids[cols] == movies
+    user_index, rows_idx = np.unique(users[known], return_inverse=True)
+
+    data = np.ones(rows_idx.shape[0], dtype=np.float32)
+    return sparse.csc_matrix((data, (rows_idx, cols[known])), shape=(len(user_index), len(movie_ids)))
+
+
+def top_k_similar(liked, columns, top_k=DEFAULT_TOP_K, min_co_likes=1):
+    """
+    Yields (column, [(other_column, similarity, co_likes), ...]) for each
+    requested column, best first.
+    """
+    likes = np.asarray(liked.sum(axis=0)).ravel()
+    liked_t = liked.T.tocsr()
+
+    for start in range(0, len(columns), CHUNK_MOVIES):
+        chunk = columns[start:start + CHUNK_MOVIES]
+        co = (liked_t[chunk] @ liked).tocsr()   # len(chunk) x n_movies co-like counts
+
+        row_of = np.repeat(np.arange(len(chunk)), np.diff(co.indptr))
+        denom = np.sqrt(likes[chunk][row_of] * likes[co.indices])
+        sims = co.data / np.maximum(denom, 1.0)
+
+        for i, column in enumerate(chunk):
+            lo, hi = co.indptr[i], co.indptr[i + 1]
+            others = co.indices[lo:hi]
+            counts = co.data[lo:hi]
+            scores = sims[lo:hi]
+
+            keep = (others != column) & (counts >= min_co_likes)
+            others, counts, scores = others[keep], counts[keep], scores[keep]
+
+            if len(scores) > top_k:
+                best = np.argpartition(-scores, top_k - 1)[:top_k]
+                others, counts, scores = others[best], counts[best], scores[best]
+
+            # Highest similarity first, more co-likes breaks ties
+            order = np.lexsort((-counts, -scores))
+            yield column, [(others[j], float(scores[j]), int(counts[j])) for j in order]
+
+
+def partition_columns(movie_ids, partition=None):
+    """Column indexes to rebuild. partition is (index, count): movies with movie_id % count == index."""
+    if partition is None:
+        return np.arange(len(movie_ids))
+    index, count = partition
+    return np.flatnonzero(movie_ids % count == index)
+
+
+def record_build(cursor, index_name, started, duration_ms, shape, nnz, items_built, partition_label):
+    cursor.execute("""
+        INSERT INTO index_builds
+            (index_name, started_at, duration_ms, matrix_rows, matrix_cols, matrix_nnz, items_built, partition_label)
+        VALUES (%s, FROM_UNIXTIME(%s), %s, %s, %s, %s, %s, %s)
+    """, (index_name, started, duration_ms, shape[0], shape[1], nnz, items_built, partition_label))
+
+
+def build_cooccurrence_index(cnx, top_k=DEFAULT_TOP_K, partition=None, min_co_likes=1):
+    """
+    (Re)builds movie_similar_movies for all movies, or for one partition of them.
+    Each chunk of movies is replaced and committed on its own.
+    Returns a summary dict with the build time and matrix size.
+    """
+    started = time.time()
+    t0 = time.perf_counter()
+    cursor = cnx.cursor()
+
+    try:
+        movie_ids = load_movie_ids(cursor)
+        liked = load_liked_matrix(cursor, movie_ids)
+        load_ms = (time.perf_counter() - t0) * 1000
+
+        columns = partition_columns(movie_ids, partition)
+        insert_sql = """
+            INSERT INTO movie_similar_movies (movie_id, rank_pos, similar_movie_id, similarity, co_likes)
+            VALUES (%s, %s, %s, %s, %s)
+        """
+
+        built = 0
+        batch_movies, batch_rows = [], []
+
+        def flush():
+            if not batch_movies:
+                return
+            placeholders = ", ".join(["%s"] * len(batch_movies))
+            cursor.execute(f"DELETE FROM movie_similar_movies WHERE movie_id IN ({placeholders})", batch_movies)
+            if batch_rows:
+                cursor.executemany(insert_sql, batch_rows)
+            cnx.commit()
+            batch_movies.clear()
+            batch_rows.clear()
+
+        for column, neighbours in top_k_similar(liked, columns, top_k, min_co_likes):
+            movie_id = int(movie_ids[column])
+            batch_movies.append(movie_id)
+            for rank, (other, similarity, co_likes) in enumerate(neighbours, start=1):
+                batch_rows.append((movie_id, rank, int(movie_ids[other]), similarity, co_likes))
+            built += 1
+            if len(batch_movies) >= CHUNK_MOVIES:
+                flush()
+        flush()
+
+        duration_ms = int((time.perf_counter() - t0) * 1000)
+        label = f"{partition[0]}/{partition[1]}" if partition else "all"
+        record_build(cursor, "movie_similar_movies", started, duration_ms, liked.shape, liked.nnz, built, label)
+        cnx.commit()
+    finally:
+        cursor.close()
+
+    return {
+        "movies_built": built,
+        "matrix_users": liked.shape[0],
+        "matrix_movies": liked.shape[1],
+        "matrix_nnz": int(liked.nnz),
+        "load_ms": int(load_ms),
+        "duration_ms": duration_ms,
+        "partition": label,
+    }
@@ -1,11 +1,48 @@
+"""
+Synthetic data generator.
+
+Rows are streamed to CSV files in chunks of --chunk-rows (nothing is held
+in memory per table), then imported with LOAD DATA LOCAL INFILE, one commit
+per chunk. Secondary indexes are dropped before the import and re-created
+once at the end, and the derived tables are rebuilt last.
+
+Generation is split into fixed-size id-range shards with seeds derived from
+BASE_SEED, run on --workers processes. The CSV files are byte-identical for
+any worker count (timestamps are relative to the current day).
+
+    python data_generator.py                  # the original small data set
+    python data_generator.py --scale 1000     # ~10M ratings
+    python data_generator.py --scale 1000 --workers 8
+    python data_generator.py --scale 10 --import-method insert   # server without local_infile
+
+The server needs local_infile=ON for the default import method.
+"""
 import mysql.connector
 from mysql.connector import errorcode
+import argparse
 import os
 import csv
-from faker import Faker
+import functools
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import shutil
+import tempfile
+import time
+from faker.providers.internet import Provider as InternetProvider
+from faker.providers.lorem.en_US import Provider as LoremProvider
+from faker.providers.person.en_US import Provider as PersonProvider
 import random
 import datetime
 from dotenv import load_dotenv
+import numpy as np
+
+from rating_stats import rebuild_rating_stats
+from taste_profiles import rebuild_taste_profiles
+from genre_rankings import rebuild_genre_rankings
+from popularity import recompute_popularity
+from trending import rebuild_trending
 
 # Load environment variables from .env file
 load_dotenv()
@@ -23,10 +60,13 @@ DB_CONFIG = {
     "port": DB_PORT,
     "user": DB_USER,
     "password": DB_PASSWORD,
-    "database": DB_NAME
+    "database": DB_NAME,
+    "allow_local_infile": True
 }
 
-# --- Configuration ---
+logger = logging.getLogger(__name__)
+
+# --- Configuration (sizes at --scale 1) ---
 NUM_USERS = 200
 NUM_MOVIES = 1000
 NUM_GENRES = 20
@@ -42,282 +82,541 @@ MOVIE_GENRES_LINKS = 3000
 MOVIE_ACTORS_LINKS = 4000
 MOVIE_DIRECTORS_LINKS = 1500 # 1-2 directors per movie
 
-# --- Initialize Faker ---
-fake = Faker()
-Faker.seed(0)
-random.seed(0)
+CHUNK_ROWS = 100000     # rows per CSV file / LOAD DATA statement / commit
+SHARD_SIZE = 2000       # parent ids per generation shard; never depends on --workers
 
-# --- Data Generation Functions ---
-# (These are the same as before, just generating lists)
-
-def generate_users():
-    users = []
-    for i in range(1, NUM_USERS + 1):
-        users.append({
-            "user_id": i,
-            "username": fake.user_name() + str(i),
-            "email": fake.email(),
-            "password_hash": fake.sha256(), # In a real app, hash a real password
-            "created_at": fake.date_time_this_decade()
-        })
-    return users
-
-def generate_movies():
-    movies = []
-    for i in range(1, NUM_MOVIES + 1):
-        movies.append({
-            "movie_id": i,
-            "title": ' '.join(fake.words(nb=random.randint(2, 5))).title().replace('"', "'"),
-            "release_year": random.randint(1980, 2024),
-            "synopsis": fake.paragraph(nb_sentences=3).replace('"', "'"),
-            "duration_min": random.randint(75, 180)
-        })
-    return movies
-
-def generate_genres():
-    genres_list = [
-        'Action', 'Comedy', 'Drama', 'Science Fiction', 'Horror', 'Romance',
-        'Thriller', 'Fantasy', 'Documentary', 'Animation', 'Crime', 'Mystery',
-        'Adventure', 'Family', 'War', 'History', 'Music', 'Western', 'Biography', 'Musical'
-    ]
-    return [{"genre_id": i + 1, "name": name} for i, name in enumerate(genres_list)]
-
-def generate_actors():
-    actors = []
-    for i in range(1, NUM_ACTORS + 1):
-        actors.append({
-            "actor_id": i,
-            "first_name": fake.first_name().replace('"', "'"),
-            "last_name": fake.last_name().replace('"', "'"),
-            "birthdate": fake.date_of_birth(minimum_age=18, maximum_age=80)
-        })
-    return actors
-
-def generate_directors():
-    directors = []
-    for i in range(1, NUM_DIRECTORS + 1):
-        directors.append({
-            "director_id": i,
-            "first_name": fake.first_name().replace('"', "'"),
-            "last_name": fake.last_name().replace('"', "'"),
-            "birthdate": fake.date_of_birth(minimum_age=30, maximum_age=90)
-        })
-    return directors
-
-def generate_ratings_and_reviews(user_ids, movie_ids):
-    ratings = []
-    reviews = []
-    used_pairs = set()
-    review_id_counter = 1
-
-    while len(ratings) < NUM_RATINGS:
-        user_id = random.choice(user_ids)
-        movie_id = random.choice(movie_ids)
-        if (user_id, movie_id) not in used_pairs:
-            used_pairs.add((user_id, movie_id))
-            ratings.append({
-                "user_id": user_id,
-                "movie_id": movie_id,
-                "rating": random.randint(1, 5),
-                "created_at": fake.date_time_this_year()
-            })
-
-    # Create reviews for a subset of ratings
-    review_pairs = random.sample(list(used_pairs), NUM_REVIEWS)
-    for user_id, movie_id in review_pairs:
-        reviews.append({
-            "review_id": review_id_counter,
-            "user_id": user_id,
-            "movie_id": movie_id,
-            "review_text": fake.paragraph(nb_sentences=random.randint(1, 4)).replace('"', "'"),
-            "created_at": fake.date_time_this_year()
-        })
-        review_id_counter += 1
-    return ratings, reviews
-
-def generate_watchlists(user_ids):
-    watchlists = []
-    watchlist_id_counter = 1
-    list_names = ['Favorites', 'To Watch', 'My Top 10', 'Guilty Pleasures']
-    for _ in range(NUM_WATCHLISTS):
-        watchlists.append({
-            "watchlist_id": watchlist_id_counter,
-            "user_id": random.choice(user_ids),
-            "name": random.choice(list_names),
-            "created_at": fake.date_time_this_year()
-        })
-        watchlist_id_counter += 1
-    return watchlists
-
-def generate_watchlist_items(watchlist_ids, movie_ids):
-    items = []
-    used_pairs = set()
-    while len(items) < NUM_WATCHLIST_ITEMS:
-        watchlist_id = random.choice(watchlist_ids)
-        movie_id = random.choice(movie_ids)
-        if (watchlist_id, movie_id) not in used_pairs:
-            used_pairs.add((watchlist_id, movie_id))
-            items.append({
-                "watchlist_id": watchlist_id,
-                "movie_id": movie_id,
-                "added_at": fake.date_time_this_year()
-            })
-    return items
-
-def generate_movie_genres(movie_ids, genre_ids):
-    links = []
-    used_pairs = set()
-    for movie_id in movie_ids:
-        # Ensure every movie has at least one genre
-        genre_id = random.choice(genre_ids)
-        links.append({"movie_id": movie_id, "genre_id": genre_id})
-        used_pairs.add((movie_id, genre_id))
-    # Add more random genres
-    while len(links) < MOVIE_GENRES_LINKS:
-        movie_id = random.choice(movie_ids)
-        genre_id = random.choice(genre_ids)
-        if (movie_id, genre_id) not in used_pairs:
-            used_pairs.add((movie_id, genre_id))
-            links.append({"movie_id": movie_id, "genre_id": genre_id})
-    return links
-
-def generate_movie_actors(movie_ids, actor_ids):
-    links = []
-    used_pairs = set()
-    while len(links) < MOVIE_ACTORS_LINKS:
-        movie_id = random.choice(movie_ids)
-        actor_id = random.choice(actor_ids)
-        role = fake.first_name().replace('"', "'")
-        if (movie_id, actor_id, role) not in used_pairs:
-            links.append({"movie_id": movie_id, "actor_id": actor_id, "role_name": role})
-            used_pairs.add((movie_id, actor_id, role))
-    return links
-
-def generate_movie_directors(movie_ids, director_ids):
-    links = []
-    used_pairs = set()
-    for movie_id in movie_ids:
-        # Ensure every movie has at least one director
-        director_id = random.choice(director_ids)
-        links.append({"movie_id": movie_id, "director_id": director_id})
-        used_pairs.add((movie_id, director_id))
-    # Add more
-    while len(links) < MOVIE_DIRECTORS_LINKS:
-        movie_id = random.choice(movie_ids)
-        director_id = random.choice(director_ids)
-        if (movie_id, director_id) not in used_pairs:
-            used_pairs.add((movie_id, director_id))
-            links.append({"movie_id": movie_id, "director_id": director_id})
-    return links
-
-# --- NEW: Database Insertion ---
-
-def insert_data_to_db(cursor, table_name, data, fields):
+# Zipf exponents of the popularity distributions (0 = uniform): rank r gets
+# weight r^-s, with ranks shuffled over the ids so hot rows are spread out
+SKEW = {
+    'movies': 1.0,      # which movies get rated and watchlisted
+    'users': 0.8,       # how many ratings a user makes
+    'actors': 1.0,      # which actors get cast
+}
+MAX_USER_MOVIE_FRACTION = 0.2   # cap on the share of the catalogue one user rates
+WEIGHTED_ROUNDS = 4             # sample_pairs rounds drawn from the skewed distribution
+MAX_SAMPLE_ROUNDS = 64
+INSERT_BATCH = 5000     # rows per executemany() with --import-method insert
+
+# Tables in load order, with the CSV column order of each
+TABLE_FIELDS = {
+    'users': ['user_id', 'username', 'email', 'password_hash', 'created_at'],
+    'movies': ['movie_id', 'title', 'release_year', 'synopsis', 'duration_min'],
+    'genres': ['genre_id', 'name'],
+    'actors': ['actor_id', 'first_name', 'last_name', 'birthdate'],
+    'directors': ['director_id', 'first_name', 'last_name', 'birthdate'],
+    'ratings': ['user_id', 'movie_id', 'rating', 'created_at'],
+    'reviews': ['user_id', 'movie_id', 'review_text', 'created_at'],
+    'watchlists': ['watchlist_id', 'user_id', 'name', 'created_at'],
+    'watchlist_items': ['watchlist_id', 'movie_id', 'added_at'],
+    'movie_genres': ['movie_id', 'genre_id'],
+    'movie_actors': ['movie_id', 'actor_id', 'role_name'],
+    'movie_directors': ['movie_id', 'director_id'],
+}
+
+GENRE_NAMES = [
+    'Action', 'Comedy', 'Drama', 'Science Fiction', 'Horror', 'Romance',
+    'Thriller', 'Fantasy', 'Documentary', 'Animation', 'Crime', 'Mystery',
+    'Adventure', 'Family', 'War', 'History', 'Music', 'Western', 'Biography', 'Musical'
+]
+WATCHLIST_NAMES = ['Favorites', 'To Watch', 'My Top 10', 'Guilty Pleasures']
+
+# --- Random Sources ---
+# Every shard seeds its own random.Random from BASE_SEED (see shard_seed)
+BASE_SEED = 0
+AS_OF = datetime.datetime.combine(datetime.date.today(), datetime.time())
+WORDS = list(LoremProvider.word_list)
+FIRST_NAMES = list(PersonProvider.first_names)
+LAST_NAMES = list(PersonProvider.last_names)
+EMAIL_DOMAINS = list(InternetProvider.free_email_domains)
+
+
+def scaled_counts(scale):
+    """Row targets for every generated table at the given scale factor."""
+    def scaled(n):
+        return max(1, int(round(n * scale)))
+    return {
+        "users": scaled(NUM_USERS),
+        "movies": scaled(NUM_MOVIES),
+        "genres": len(GENRE_NAMES),
+        "actors": scaled(NUM_ACTORS),
+        "directors": scaled(NUM_DIRECTORS),
+        "ratings": scaled(NUM_RATINGS),
+        "reviews": scaled(NUM_REVIEWS),
+        "watchlists": scaled(NUM_WATCHLISTS),
+        "watchlist_items": scaled(NUM_WATCHLIST_ITEMS),
+        "movie_genres": scaled(MOVIE_GENRES_LINKS),
+        "movie_actors": scaled(MOVIE_ACTORS_LINKS),
+        "movie_directors": scaled(MOVIE_DIRECTORS_LINKS),
+    }
+
+
+def per_item_counts(gen, n, average, minimum=0, maximum=None):
+    """Poisson counts for n items with the given mean, at least `minimum` and at most `maximum`."""
+    counts = gen.poisson(max(average - minimum, 0), n) + minimum
+    return counts if maximum is None else np.minimum(counts, maximum)
+
+
+# --- Skewed Sampling ---
+
+@functools.lru_cache(maxsize=None)
+def zipf_probabilities(kind, n, exponent):
     """
-    Inserts a list of dictionaries into the specified table.
+    Probability of each id 1..n under a Zipf(exponent) popularity law. The
+    ranks are a fixed shuffle of the ids (seeded from BASE_SEED), so every
+    shard sees the same hot movies and power users.
     """
-    if not data:
-        print(f"No data to insert for {table_name}")
-        return
+    ranks = np.random.default_rng(shard_seed(f"{kind}-ranks", 0)).permutation(n) + 1
+    weights = ranks.astype(np.float64) ** -exponent
+    return weights / weights.sum()
 
-    # Create the insert statement
-    # Example: INSERT INTO users (user_id, username, email, ...) VALUES (%s, %s, %s, ...)
-    query = f"INSERT INTO {table_name} ({', '.join(fields)}) VALUES ({', '.join(['%s'] * len(fields))})"
+@functools.lru_cache(maxsize=None)
+def zipf_cdf(kind, n, exponent):
+    return np.cumsum(zipf_probabilities(kind, n, exponent)) if exponent else None
 
-    # Create a list of tuples from the list of dictionaries
-    # This is what executemany() expects
-    values = []
-    for row in data:
-        values.append(tuple(row[field] for field in fields))
+def sample_pairs(gen, sizes, n_children, cdf=None):
+    """
+    Draws sizes[i] distinct children (0-based, out of n_children) for every
+    parent i without rejection loops in Python: candidate pairs are encoded
+    as parent * n_children + child, de-duplicated with NumPy and only the
+    shortfall is re-drawn. The first WEIGHTED_ROUNDS rounds follow `cdf`;
+    later ones are uniform so heavily skewed parents still fill quickly.
+    Returns (parents, children), sorted by parent then child.
+    """
+    sizes = np.minimum(np.asarray(sizes, dtype=np.int64), n_children)
+    codes = np.empty(0, dtype=np.int64)
+    need = sizes
+    for round_no in range(MAX_SAMPLE_ROUNDS):
+        total = int(need.sum())
+        if not total:
+            break
+        owners = np.repeat(np.arange(len(sizes), dtype=np.int64), need)
+        if cdf is not None and round_no < WEIGHTED_ROUNDS:
+            children = np.minimum(np.searchsorted(cdf, gen.random(total) * cdf[-1], side="right"), n_children - 1)
+        else:
+            children = gen.integers(0, n_children, total)
+        codes = np.union1d(codes, owners * n_children + children)
+        need = sizes - np.bincount(codes // n_children, minlength=len(sizes))
+    return codes // n_children, codes % n_children
+
+def random_datetimes(gen, n, days_back):
+    """n 'YYYY-MM-DD HH:MM:SS' strings within days_back days before AS_OF."""
+    seconds = gen.integers(0, days_back * 86400, n).astype("timedelta64[s]")
+    stamps = np.datetime_as_string(np.datetime64(AS_OF, "s") - seconds, unit="s")
+    return [stamp.replace("T", " ") for stamp in stamps.tolist()]
+
+
+# --- CSV Output ---
+
+class CsvChunkWriter:
+    """Streams the rows of one table (shard) into numbered CSV files of at most chunk_rows rows."""
+
+    def __init__(self, out_dir, table, chunk_rows=CHUNK_ROWS, shard=0):
+        self.out_dir = out_dir
+        self.table = table
+        self.shard = shard
+        self.chunk_rows = chunk_rows
+        self.paths = []
+        self.rows = 0
+        self._file = None
+        self._writer = None
+        self._in_chunk = 0
+
+    def _rotate(self):
+        if self._file:
+            self._file.close()
+        path = os.path.join(self.out_dir, f"{self.table}.{self.shard:05d}.{len(self.paths):04d}.csv")
+        self.paths.append(path)
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file, lineterminator="\n")
+        self._in_chunk = 0
+
+    def write(self, row):
+        if self._file is None or self._in_chunk >= self.chunk_rows:
+            self._rotate()
+        self._writer.writerow(row)
+        self._in_chunk += 1
+        self.rows += 1
+
+    def writerows(self, rows):
+        rows = iter(rows)
+        while True:
+            room = self.chunk_rows - self._in_chunk if self._file else self.chunk_rows
+            batch = list(itertools.islice(rows, room or self.chunk_rows))
+            if not batch:
+                return
+            if self._file is None or self._in_chunk >= self.chunk_rows:
+                self._rotate()
+            self._writer.writerows(batch)
+            self._in_chunk += len(batch)
+            self.rows += len(batch)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
 
-    try:
-        print(f"Inserting {len(values)} records into {table_name}...")
-        cursor.executemany(query, values)
-        print(f"Successfully inserted {cursor.rowcount} records.")
-    except mysql.connector.Error as err:
-        print(f"Error inserting into {table_name}: {err}")
-        print("SQL Query was:", query)
-        print("First row of data was:", values[0] if values else "No data")
 
+# --- Data Generation Functions ---
+# Every table is generated in shards of SHARD_SIZE parent ids (users, movies,
+# actors, directors). A shard draws from its own random.Random seeded by
+# shard_seed(kind, shard) and writes its own CSV files, so the output depends
+# only on BASE_SEED and the scale, never on the number of workers. Uniqueness
+# of (user, movie), (watchlist, movie) and the junction pairs comes from
+# sample_pairs(), which samples without replacement per parent row; parents
+# never span shards.
+#
+# Text, names and timestamps are drawn straight from the rng with Faker's
+# word and name lists: the Faker methods themselves cost tens of
+# microseconds per call, which dominated generation at large scales.
+
+def shard_seed(kind, shard):
+    """Seed of one shard, derived from BASE_SEED so every shard is reproducible on its own."""
+    digest = hashlib.sha256(f"{BASE_SEED}:{kind}:{shard}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big")
+
+def random_datetime(rng, days_back):
+    return AS_OF - datetime.timedelta(seconds=rng.randrange(days_back * 86400))
+
+def random_birthdate(rng, minimum_age, maximum_age):
+    return (AS_OF - datetime.timedelta(days=rng.randrange(minimum_age * 365, maximum_age * 365))).date()
+
+def sentence(rng):
+    text = " ".join(rng.choices(WORDS, k=rng.randint(4, 12)))
+    return text[0].upper() + text[1:] + "."
+
+def paragraph(rng, nb_sentences):
+    return " ".join(sentence(rng) for _ in range(nb_sentences))
+
+def generate_users(rng, writers, counts, lo, hi, skew):
+    for i in range(lo, hi):
+        username = f"{rng.choice(FIRST_NAMES).lower()}{rng.choice(LAST_NAMES).lower()}{i}"
+        writers['users'].write((
+            i,
+            username,
+            f"{username}@{rng.choice(EMAIL_DOMAINS)}",   # unique like the username
+            f"{rng.getrandbits(256):064x}", # In a real app, hash a real password
+            random_datetime(rng, 3650)
+        ))
+
+def generate_movies(rng, writers, counts, lo, hi, skew):
+    """Movies and their genre, actor and director links."""
+    gen = np.random.default_rng(rng.getrandbits(64))
+    for movie_id in range(lo, hi):
+        writers['movies'].write((
+            movie_id,
+            " ".join(rng.choices(WORDS, k=rng.randint(2, 5))).title(),
+            rng.randint(1980, 2024),
+            paragraph(rng, 3),
+            rng.randint(75, 180)
+        ))
+
+    n = hi - lo
+    # Ensure every movie has at least one genre and one director
+    owners, genres = sample_pairs(gen, per_item_counts(gen, n, counts["movie_genres"] / counts["movies"], 1),
+                                  counts["genres"])
+    writers['movie_genres'].writerows(zip((owners + lo).tolist(), (genres + 1).tolist()))
+
+    cdf = zipf_cdf("actors", counts["actors"], skew["actors"])
+    owners, actors = sample_pairs(gen, per_item_counts(gen, n, counts["movie_actors"] / counts["movies"]),
+                                  counts["actors"], cdf)
+    roles = [rng.choice(FIRST_NAMES) for _ in range(len(owners))]
+    writers['movie_actors'].writerows(zip((owners + lo).tolist(), (actors + 1).tolist(), roles))
+
+    owners, directors = sample_pairs(gen, per_item_counts(gen, n, counts["movie_directors"] / counts["movies"], 1),
+                                     counts["directors"])
+    writers['movie_directors'].writerows(zip((owners + lo).tolist(), (directors + 1).tolist()))
+
+def generate_genres(rng, writers, counts, lo, hi, skew):
+    for i in range(lo, hi):
+        writers['genres'].write((i, GENRE_NAMES[i - 1]))
+
+def generate_people(table, minimum_age, maximum_age):
+    def generate(rng, writers, counts, lo, hi, skew):
+        for i in range(lo, hi):
+            writers[table].write((
+                i, rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), random_birthdate(rng, minimum_age, maximum_age)
+            ))
+    return generate
+
+def generate_user_activity(rng, writers, counts, lo, hi, skew):
+    """
+    Ratings, reviews, watchlists and watchlist items of users [lo, hi).
+    A user's number of ratings follows their Zipf activity weight and the
+    movies they rate or watchlist follow the movie popularity law; a
+    fraction of ratings also get a review. Counts are Poisson draws, so the
+    totals land near the targets rather than exactly on them.
+    """
+    gen = np.random.default_rng(rng.getrandbits(64))
+    n, n_movies = hi - lo, counts["movies"]
+    movie_cdf = zipf_cdf("movies", n_movies, skew["movies"])
+
+    activity = zipf_probabilities("users", counts["users"], skew["users"])[lo - 1:hi - 1]
+    sizes = np.minimum(gen.poisson(activity * counts["ratings"]), max(1, int(MAX_USER_MOVIE_FRACTION * n_movies)))
+    owners, movies = sample_pairs(gen, sizes, n_movies, movie_cdf)
+    user_ids, movie_ids = (owners + lo).tolist(), (movies + 1).tolist()
+    writers['ratings'].writerows(zip(user_ids, movie_ids, gen.integers(1, 6, len(owners)).tolist(),
+                                     random_datetimes(gen, len(owners), 365)))
+
+    # review_id is left to AUTO_INCREMENT, which numbers rows in load (= shard) order
+    reviewed = np.flatnonzero(gen.random(len(owners)) < counts["reviews"] / counts["ratings"]).tolist()
+    created = random_datetimes(gen, len(reviewed), 365)
+    writers['reviews'].writerows(
+        (user_ids[i], movie_ids[i], paragraph(rng, rng.randint(1, 4)), created[j]) for j, i in enumerate(reviewed)
+    )
+
+    # Watchlists get distinct names per user (uk_user_watchlist_name) and a
+    # fixed id slot per (user, name), so ids never depend on other shards
+    owners, names = sample_pairs(gen, per_item_counts(gen, n, counts["watchlists"] / counts["users"]),
+                                 len(WATCHLIST_NAMES))
+    watchlist_ids = (owners + lo - 1) * len(WATCHLIST_NAMES) + names + 1
+    writers['watchlists'].writerows(zip(watchlist_ids.tolist(), (owners + lo).tolist(),
+                                        [WATCHLIST_NAMES[i] for i in names.tolist()],
+                                        random_datetimes(gen, len(owners), 365)))
+
+    sizes = per_item_counts(gen, len(watchlist_ids), counts["watchlist_items"] / counts["watchlists"])
+    owners, movies = sample_pairs(gen, sizes, n_movies, movie_cdf)
+    writers['watchlist_items'].writerows(zip(watchlist_ids[owners].tolist(), (movies + 1).tolist(),
+                                             random_datetimes(gen, len(owners), 365)))
+
+
+# shard kind -> (tables written, generator, table whose ids are sharded)
+SHARD_KINDS = {
+    'users': (['users'], generate_users, 'users'),
+    'movies': (['movies', 'movie_genres', 'movie_actors', 'movie_directors'], generate_movies, 'movies'),
+    'genres': (['genres'], generate_genres, 'genres'),
+    'actors': (['actors'], generate_people('actors', 18, 80), 'actors'),
+    'directors': (['directors'], generate_people('directors', 30, 90), 'directors'),
+    'user_activity': (['ratings', 'reviews', 'watchlists', 'watchlist_items'], generate_user_activity, 'users'),
+}
 
-def main():
-    print("Generating synthetic data in memory...")
 
-    users = generate_users()
-    movies = generate_movies()
-    genres = generate_genres()
-    actors = generate_actors()
-    directors = generate_directors()
+def plan_shards(counts, shard_size=SHARD_SIZE):
+    """(kind, shard, lo, hi) for every shard. Boundaries depend only on the counts."""
+    shards = []
+    for kind, (_, _, id_table) in SHARD_KINDS.items():
+        for shard, lo in enumerate(range(1, counts[id_table] + 1, shard_size)):
+            shards.append((kind, shard, lo, min(lo + shard_size, counts[id_table] + 1)))
+    return shards
+
+def _generate_shard(job):
+    """Generates one shard into its own CSV files. Returns (kind, {table: (paths, rows)}, seconds)."""
+    (kind, shard, lo, hi), counts, skew, out_dir, chunk_rows = job
+    tables, generator, _ = SHARD_KINDS[kind]
+    start = time.perf_counter()
+    writers = {table: CsvChunkWriter(out_dir, table, chunk_rows, shard) for table in tables}
+    generator(random.Random(shard_seed(kind, shard)), writers, counts, lo, hi, skew)
+    for writer in writers.values():
+        writer.close()
+    return kind, {table: (w.paths, w.rows) for table, w in writers.items()}, time.perf_counter() - start
+
+
+def generate_all(out_dir, counts, chunk_rows, workers=1, skew=SKEW):
+    """Generates every shard on `workers` processes. Returns {table: (CSV paths in load order, rows)}."""
+    jobs = [(shard, counts, skew, out_dir, chunk_rows) for shard in plan_shards(counts)]
+    outputs = {table: ([], 0) for table in TABLE_FIELDS}
+    seconds = dict.fromkeys(SHARD_KINDS, 0.0)
+
+    if workers > 1:
+        pool = multiprocessing.get_context("fork").Pool(workers)
+        results = pool.imap_unordered(_generate_shard, jobs)
+    else:
+        pool, results = None, map(_generate_shard, jobs)
+    try:
+        for kind, written, elapsed in results:
+            seconds[kind] += elapsed
+            for table, (paths, rows) in written.items():
+                outputs[table] = (outputs[table][0] + paths, outputs[table][1] + rows)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
 
-    user_ids = [u['user_id'] for u in users]
-    movie_ids = [m['movie_id'] for m in movies]
-    genre_ids = [g['genre_id'] for g in genres]
-    actor_ids = [a['actor_id'] for a in actors]
-    director_ids = [d['director_id'] for d in directors]
+    for kind, (tables, _, _) in SHARD_KINDS.items():
+        for table in tables:
+            rows = outputs[table][1]
+            logger.info("  generated %10d %-16s %8.2fs  %10.0f rows/s per worker",
+                        rows, table, seconds[kind], rows / max(seconds[kind], 1e-9))
+    # File names sort by table, shard and chunk, i.e. in id order
+    return {table: (sorted(paths), rows) for table, (paths, rows) in outputs.items()}
 
-    ratings, reviews = generate_ratings_and_reviews(user_ids, movie_ids)
-    watchlists = generate_watchlists(user_ids)
-    
-    watchlist_ids = [w['watchlist_id'] for w in watchlists]
-    watchlist_items = generate_watchlist_items(watchlist_ids, movie_ids)
 
-    movie_genres = generate_movie_genres(movie_ids, genre_ids)
-    movie_actors = generate_movie_actors(movie_ids, actor_ids)
-    movie_directors = generate_movie_directors(movie_ids, director_ids)
+# --- Deferred Secondary Indexes ---
 
-    print("Data generation complete. Connecting to database...")
+def drop_secondary_indexes(cursor, tables):
+    """
+    Drops the secondary indexes of `tables` and returns their definitions.
+    Indexes a foreign key depends on cannot be dropped and are left in place.
+    """
+    placeholders = ", ".join(["%s"] * len(tables))
+    cursor.execute(f"""
+        SELECT TABLE_NAME, INDEX_NAME, NON_UNIQUE, INDEX_TYPE, COLUMN_NAME, SUB_PART, COLLATION
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND INDEX_NAME != 'PRIMARY' AND TABLE_NAME IN ({placeholders})
+        ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX
+    """, list(tables))
+
+    indexes = {}
+    for table, name, non_unique, index_type, column, sub_part, collation in cursor.fetchall():
+        index = indexes.setdefault((table, name), {"unique": not non_unique, "type": index_type, "columns": []})
+        if column is None:
+            index["columns"] = None   # functional index: leave it alone
+        elif index["columns"] is not None:
+            spec = f"`{column}`" + (f"({sub_part})" if sub_part else "") + (" DESC" if collation == "D" else "")
+            index["columns"].append(spec)
+
+    dropped = []
+    for (table, name), index in indexes.items():
+        if index["columns"] is None:
+            continue
+        try:
+            cursor.execute(f"ALTER TABLE {table} DROP INDEX `{name}`")
+            dropped.append((table, name, index))
+        except mysql.connector.Error as err:
+            if err.errno != errorcode.ER_DROP_INDEX_FK:
+                raise
+    return dropped
+
+def create_indexes(cursor, dropped):
+    """Re-creates dropped indexes with one ALTER TABLE per table."""
+    by_table = {}
+    for table, name, index in dropped:
+        kind = "FULLTEXT INDEX" if index["type"] == "FULLTEXT" else ("UNIQUE INDEX" if index["unique"] else "INDEX")
+        by_table.setdefault(table, []).append(f"ADD {kind} `{name}` ({', '.join(index['columns'])})")
+    for table, clauses in by_table.items():
+        start = time.perf_counter()
+        cursor.execute(f"ALTER TABLE {table} {', '.join(clauses)}")
+        logger.info("  %s: %d index(es) built in %.2fs", table, len(clauses), time.perf_counter() - start)
+
+
+# --- Database Import ---
+
+def load_table(cnx, cursor, table_name, fields, paths, method):
+    """Imports a table's CSV chunks, committing after each chunk."""
+    rows = 0
+    start = time.perf_counter()
+    for path in paths:
+        if method == "load":
+            cursor.execute(f"""
+                LOAD DATA LOCAL INFILE %s INTO TABLE {table_name}
+                CHARACTER SET utf8mb4
+                FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' ESCAPED BY ''
+                LINES TERMINATED BY '\\n'
+                ({', '.join(fields)})
+            """, (path,))
+            rows += cursor.rowcount
+        else:
+            query = f"INSERT INTO {table_name} ({', '.join(fields)}) VALUES ({', '.join(['%s'] * len(fields))})"
+            with open(path, newline="", encoding="utf-8") as f:
+                batch = []
+                for row in csv.reader(f):
+                    batch.append(row)
+                    if len(batch) >= INSERT_BATCH:
+                        cursor.executemany(query, batch)
+                        rows += len(batch)
+                        batch = []
+                if batch:
+                    cursor.executemany(query, batch)
+                    rows += len(batch)
+        cnx.commit()
+    elapsed = time.perf_counter() - start
+    logger.info("  loaded    %10d %-16s %8.2fs  %10.0f rows/s", rows, table_name, elapsed, rows / max(elapsed, 1e-9))
 
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier for every table size")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="rows per CSV file and commit")
+    parser.add_argument("--out-dir", default=None, help="where to write the CSV files (default: a temp dir)")
+    parser.add_argument("--keep-csv", action="store_true", help="don't delete the CSV files afterwards")
+    parser.add_argument("--generate-only", action="store_true", help="write the CSV files and stop")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="generator processes (output is the same for any value)")
+    parser.add_argument("--movie-skew", type=float, default=SKEW['movies'],
+                        help="Zipf exponent of movie popularity (0 = uniform)")
+    parser.add_argument("--user-skew", type=float, default=SKEW['users'],
+                        help="Zipf exponent of user activity (0 = uniform)")
+    parser.add_argument("--actor-skew", type=float, default=SKEW['actors'],
+                        help="Zipf exponent of actor casting (0 = uniform)")
+    parser.add_argument("--import-method", choices=["load", "insert"], default="load",
+                        help="LOAD DATA LOCAL INFILE (default) or batched INSERTs")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    counts = scaled_counts(args.scale)
+    out_dir = args.out_dir or tempfile.mkdtemp(prefix="movie_rec_data_")
+    os.makedirs(out_dir, exist_ok=True)
+    keep_csv = args.keep_csv or args.generate_only or args.out_dir is not None
+
+    logger.info("Generating synthetic data at scale %s into %s with %d worker(s)...", args.scale, out_dir, args.workers)
+    start = time.perf_counter()
+    skew = {'movies': args.movie_skew, 'users': args.user_skew, 'actors': args.actor_skew}
+    outputs = generate_all(out_dir, counts, args.chunk_rows, args.workers, skew)
+    elapsed = time.perf_counter() - start
+    total_rows = sum(rows for _, rows in outputs.values())
+    logger.info("Data generation complete: %d rows in %.2fs (%.0f rows/s).",
+                total_rows, elapsed, total_rows / max(elapsed, 1e-9))
+    if args.generate_only:
+        return
+
+    failed = False
+    logger.info("Connecting to database...")
     try:
         cnx = mysql.connector.connect(**DB_CONFIG)
         cursor = cnx.cursor()
-        print(f"Successfully connected to database '{DB_CONFIG['database']}'.")
+        logger.info("Successfully connected to database '%s'.", DB_CONFIG['database'])
 
         # Disable checks for fast import
         cursor.execute("SET FOREIGN_KEY_CHECKS = 0;")
         cursor.execute("SET UNIQUE_CHECKS = 0;")
 
+        logger.info("Dropping secondary indexes until the load is done...")
+        dropped = drop_secondary_indexes(cursor, list(TABLE_FIELDS))
+        logger.info("  %d index(es) deferred.", len(dropped))
+
         # Insert data in order of dependency
-        insert_data_to_db(cursor, 'users', users, ['user_id', 'username', 'email', 'password_hash', 'created_at'])
-        insert_data_to_db(cursor, 'movies', movies, ['movie_id', 'title', 'release_year', 'synopsis', 'duration_min'])
-        insert_data_to_db(cursor, 'genres', genres, ['genre_id', 'name'])
-        insert_data_to_db(cursor, 'actors', actors, ['actor_id', 'first_name', 'last_name', 'birthdate'])
-        insert_data_to_db(cursor, 'directors', directors, ['director_id', 'first_name', 'last_name', 'birthdate'])
-        
-        # Ratings and Reviews
-        insert_data_to_db(cursor, 'ratings', ratings, ['user_id', 'movie_id', 'rating', 'created_at'])
-        insert_data_to_db(cursor, 'reviews', reviews, ['review_id', 'user_id', 'movie_id', 'review_text', 'created_at'])
-        
-        # Watchlists
-        insert_data_to_db(cursor, 'watchlists', watchlists, ['watchlist_id', 'user_id', 'name', 'created_at'])
-        insert_data_to_db(cursor, 'watchlist_items', watchlist_items, ['watchlist_id', 'movie_id', 'added_at'])
-
-        # Junction Tables
-        insert_data_to_db(cursor, 'movie_genres', movie_genres, ['movie_id', 'genre_id'])
-        insert_data_to_db(cursor, 'movie_actors', movie_actors, ['movie_id', 'actor_id', 'role_name'])
-        insert_data_to_db(cursor, 'movie_directors', movie_directors, ['movie_id', 'director_id'])
+        logger.info("Importing with %s...", 'LOAD DATA LOCAL INFILE' if args.import_method == 'load' else 'batched INSERT')
+        load_start = time.perf_counter()
+        for table_name, fields in TABLE_FIELDS.items():
+            load_table(cnx, cursor, table_name, fields, outputs[table_name][0], args.import_method)
+        logger.info("Import complete in %.2fs.", time.perf_counter() - load_start)
+
+        logger.info("Re-creating secondary indexes...")
+        create_indexes(cursor, dropped)
 
         # Re-enable checks
         cursor.execute("SET FOREIGN_KEY_CHECKS = 1;")
         cursor.execute("SET UNIQUE_CHECKS = 1;")
 
+        # Derived tables
+        logger.info("Rebuilding movie_rating_stats from ratings...")
+        logger.info("Rating stats rebuilt for %d movies.", rebuild_rating_stats(cursor))
+        logger.info("Taste profiles rebuilt (%d rows).", rebuild_taste_profiles(cursor))
+        logger.info("Genre rankings rebuilt (%d rows).", rebuild_genre_rankings(cursor))
+        logger.info("Popularity leaderboard rebuilt (%d movies).", recompute_popularity(cnx, cursor))
+        logger.info("Trending buckets rebuilt (%d buckets).", rebuild_trending(cursor))
+
         # Commit all changes
-        print("Committing all transactions...")
+        logger.info("Committing all transactions...")
         cnx.commit()
-        print("All data successfully imported into the database!")
+        logger.info("All data successfully imported into the database!")
 
     except mysql.connector.Error as err:
         if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
-            print("Something is wrong with your user name or password")
+            logger.error("Something is wrong with your user name or password")
         elif err.errno == errorcode.ER_BAD_DB_ERROR:
-            print("Database does not exist")
+            logger.error("Database does not exist")
         else:
-            print(err)
+            logger.error("Import failed: %s", err)
+        failed = True
     finally:
         if 'cnx' in locals() and cnx.is_connected():
             cursor.close()
             cnx.close()
-            print("MySQL connection closed.")
+            logger.info("MySQL connection closed.")
+        if not keep_csv:
+            shutil.rmtree(out_dir, ignore_errors=True)
+    if failed:
+        raise SystemExit(1)
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,236 @@
+import os
+import threading
+import time
+from collections import deque
+
+import mysql.connector
+
+from sql_metrics import InstrumentedCursor
+
+# --- Pool Configuration ---
+# Every gunicorn worker gets its own pool, so the total number of MySQL
+# connections is roughly (workers x DB_POOL_SIZE).
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 5))            # seconds to wait for a free connection
+POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", 1800))  # recycle connections older than this
+POOL_VALIDATE_IDLE = float(os.getenv("DB_POOL_VALIDATE_IDLE", 5))   # ping connections idle longer than this
+
+
+class PoolExhaustedError(Exception):
+    """Raised when no connection became free within the checkout timeout."""
+
+
+class PooledConnection:
+    """
+    Wraps a real MySQL connection checked out of a ConnectionPool.
+    close() hands the connection back to the pool instead of closing the socket,
+    and cursors are instrumented (see sql_metrics).
+    """
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self.created_at = created_at
+        self.released = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._raw.cursor(*args, **kwargs), self._raw)
+
+    def close(self):
+        if not self.released:
+            self.released = True
+            self._pool.release(self)
+
+    def discard(self):
+        """Closes the underlying socket instead of returning it (e.g. mid-way through a result set)."""
+        if not self.released:
+            self.released = True
+            self._pool.release(self, discard=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class ConnectionPool:
+    """
+    A small thread-safe pool of mysql.connector connections.
+
+    - Connections are opened lazily up to `size`.
+    - Idle connections are pinged on checkout if they sat unused for
+      longer than `validate_idle` seconds; dead ones are replaced.
+    - Connections older than `max_lifetime` are closed instead of being
+      returned, so server-side timeouts and failovers never hit a request.
+    - Uncommitted work is rolled back when a connection is returned.
+    """
+
+    def __init__(self, config, size=POOL_SIZE, timeout=POOL_TIMEOUT,
+                 max_lifetime=POOL_MAX_LIFETIME, validate_idle=POOL_VALIDATE_IDLE):
+        self.config = dict(config)
+        self.size = size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.validate_idle = validate_idle
+
+        self._lock = threading.Condition()
+        self._idle = deque()  # (raw_connection, created_at, last_used)
+        self._open = 0
+
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_total_ms": 0.0,
+            "wait_time_max_ms": 0.0,
+            "exhausted": 0,
+            "created": 0,
+            "recycled": 0,
+            "validation_failures": 0,
+        }
+
+    def _connect(self):
+        raw = mysql.connector.connect(**self.config)
+        with self._lock:
+            self._stats["created"] += 1
+        return raw
+
+    def _discard(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            # close() can trip over an unread result set; the socket is gone either way
+            pass
+
+    def acquire(self):
+        """Checks out a connection, waiting up to `timeout` seconds for one to free up."""
+        start = time.monotonic()
+        waited = False
+
+        with self._lock:
+            while True:
+                if self._idle:
+                    raw, created_at, last_used = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    # Reserve the slot now and connect outside the lock
+                    self._open += 1
+                    raw = None
+                    created_at = None
+                    break
+
+                waited = True
+                remaining = self.timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    self._stats["exhausted"] += 1
+                    raise PoolExhaustedError(
+                        f"No database connection available after {self.timeout}s (pool size {self.size})"
+                    )
+                self._lock.wait(remaining)
+
+        now = time.monotonic()
+        try:
+            if raw is not None:
+                too_old = now - created_at > self.max_lifetime
+                if too_old:
+                    with self._lock:
+                        self._stats["recycled"] += 1
+                    self._discard(raw)
+                    raw = None
+                elif now - last_used > self.validate_idle and not raw.is_connected():
+                    with self._lock:
+                        self._stats["validation_failures"] += 1
+                    self._discard(raw)
+                    raw = None
+
+            if raw is None:
+                raw = self._connect()
+                created_at = time.monotonic()
+        except Exception:
+            # Give the reserved slot back so the pool doesn't shrink
+            with self._lock:
+                self._open -= 1
+                self._lock.notify()
+            raise
+
+        wait_ms = (time.monotonic() - start) * 1000
+        with self._lock:
+            self._stats["checkouts"] += 1
+            if waited:
+                self._stats["waits"] += 1
+            self._stats["wait_time_total_ms"] += wait_ms
+            self._stats["wait_time_max_ms"] = max(self._stats["wait_time_max_ms"], wait_ms)
+
+        return PooledConnection(self, raw, created_at)
+
+    def release(self, pooled, discard=False):
+        """Returns a connection to the pool (or closes it if it is broken, too old or discarded)."""
+        raw = pooled._raw
+        keep = not discard
+
+        try:
+            if keep and raw.in_transaction:
+                raw.rollback()
+        except mysql.connector.Error:
+            keep = False
+
+        recycle = keep and time.monotonic() - pooled.created_at > self.max_lifetime
+        if recycle:
+            keep = False
+
+        if not keep:
+            self._discard(raw)
+
+        with self._lock:
+            if recycle:
+                self._stats["recycled"] += 1
+            if keep:
+                self._idle.append((raw, pooled.created_at, time.monotonic()))
+            else:
+                self._open -= 1
+            self._lock.notify()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = self.size
+            stats["open"] = self._open
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._open - len(self._idle)
+        checkouts = stats["checkouts"] or 1
+        stats["wait_time_avg_ms"] = round(stats["wait_time_total_ms"] / checkouts, 3)
+        stats["wait_time_total_ms"] = round(stats["wait_time_total_ms"], 3)
+        stats["wait_time_max_ms"] = round(stats["wait_time_max_ms"], 3)
+        return stats
+
+    def close_all(self):
+        with self._lock:
+            while self._idle:
+                raw, _, _ = self._idle.pop()
+                self._discard(raw)
+                self._open -= 1
+
+
+# --- Per-Worker Pool ---
+# gunicorn forks workers after importing the app, so the pool is created
+# lazily and re-created if we notice we are running in a new process.
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(config):
+    """Returns this process's pool, creating it on first use."""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = ConnectionPool(config)
+                _pool_pid = pid
+    return _pool
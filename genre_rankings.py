@@ -0,0 +1,216 @@
+"""
+Per-genre ranked lists behind /api/movies?genre=...
+
+genre_movie_rankings holds one row per (genre, movie) with everything a
+genre page shows and sorts on: title, release year, average rating and the
+Bayesian weighted rating
+
+    weighted = v / (v + m) * R + m / (v + m) * C
+
+(v ratings averaging R, m = POPULAR_MIN_RATINGS, C = the prior mean).
+Every order has its own (genre_id, sort columns, movie_id) index, so a page
+is a single index range read with a keyset seek: no join to movie_genres and
+no aggregation at request time.
+
+C is frozen in rating_priors when the table is rebuilt, so incremental
+updates keep every row scored against the same prior and the order stays
+consistent. The app refreshes a movie's rows in the same transaction as a
+rating write or a new movie_genres link; rebuild_genre_rankings() (run by
+data_generator.py and `manage.py rebuild-genre-rankings`) reconciles the
+table and re-estimates C.
+
+Pages of two or more genres are their intersection, found by merging the
+genres' lists, which are all sorted the same way: each list is read
+MERGE_CHUNK rows at a time and skipped ahead with an index seek whenever
+another list is further along. Sort keys are compared in Python, so titles
+are sorted on title_key, a lowercased copy with a binary (code point)
+collation that orders the same way in MySQL and in Python.
+"""
+from bisect import bisect_left
+
+from queries import POPULAR_MIN_RATINGS
+
+PRIOR_NAME = "genre_rankings"
+MERGE_CHUNK = 200        # rows read per genre list while merging
+
+# sort -> (key columns, descending flags); movie_id always breaks ties
+GENRE_SORTS = {
+    "title": (("title_key", "movie_id"), (False, False)),
+    "recent": (("release_year", "title_key", "movie_id"), (True, False, False)),
+    "top_rated": (("weighted_rating", "movie_id"), (True, False)),
+}
+
+# Weighted rating of the movie joined as `s` against the prior joined as `p`
+WEIGHTED_RATING_SQL = f"""
+    (COALESCE(s.rating_count, 0) / (COALESCE(s.rating_count, 0) + {POPULAR_MIN_RATINGS}))
+        * COALESCE(s.rating_sum / NULLIF(s.rating_count, 0), 0)
+    + ({POPULAR_MIN_RATINGS} / (COALESCE(s.rating_count, 0) + {POPULAR_MIN_RATINGS})) * p.prior_mean
+"""
+
+
+# --- Maintenance ---
+
+def rebuild_genre_rankings(cursor):
+    """Re-estimates the prior mean and recomputes every (genre, movie) row. Returns the row count."""
+    cursor.execute("""
+        INSERT INTO rating_priors (name, prior_mean, computed_at)
+        SELECT %s, COALESCE(SUM(rating_sum) / NULLIF(SUM(rating_count), 0), 3.0), NOW()
+        FROM movie_rating_stats
+        ON DUPLICATE KEY UPDATE prior_mean = VALUES(prior_mean), computed_at = VALUES(computed_at);
+    """, (PRIOR_NAME,))
+    cursor.execute("DELETE FROM genre_movie_rankings")
+    cursor.execute(f"""
+        INSERT INTO genre_movie_rankings
+            (genre_id, movie_id, title, title_key, release_year, average_rating, weighted_rating)
+        SELECT
+            mg.genre_id, mg.movie_id, m.title, LOWER(m.title), m.release_year,
+            COALESCE(s.rating_sum / NULLIF(s.rating_count, 0), 0),
+            {WEIGHTED_RATING_SQL}
+        FROM movie_genres mg
+        JOIN movies m ON m.movie_id = mg.movie_id
+        LEFT JOIN movie_rating_stats s ON s.movie_id = mg.movie_id
+        JOIN rating_priors p ON p.name = %s;
+    """, (PRIOR_NAME,))
+    return cursor.rowcount
+
+
+def refresh_movie_rankings(cursor, movie_ids):
+    """Re-scores the rows of movies whose ratings changed (call after movie_rating_stats is updated)."""
+    movie_ids = sorted(set(movie_ids))
+    if not movie_ids:
+        return
+    placeholders = ", ".join(["%s"] * len(movie_ids))
+    cursor.execute(f"""
+        UPDATE genre_movie_rankings r
+        JOIN movie_rating_stats s ON s.movie_id = r.movie_id
+        JOIN rating_priors p ON p.name = %s
+        SET r.average_rating = COALESCE(s.rating_sum / NULLIF(s.rating_count, 0), 0),
+            r.weighted_rating = {WEIGHTED_RATING_SQL}
+        WHERE r.movie_id IN ({placeholders});
+    """, (PRIOR_NAME, *movie_ids))
+
+
+def add_genre_link(cursor, movie_id, genre_id):
+    """Adds (or refreshes) the row for a new movie_genres link."""
+    cursor.execute(f"""
+        INSERT INTO genre_movie_rankings
+            (genre_id, movie_id, title, title_key, release_year, average_rating, weighted_rating)
+        SELECT
+            %s, m.movie_id, m.title, LOWER(m.title), m.release_year,
+            COALESCE(s.rating_sum / NULLIF(s.rating_count, 0), 0),
+            {WEIGHTED_RATING_SQL}
+        FROM movies m
+        LEFT JOIN movie_rating_stats s ON s.movie_id = m.movie_id
+        JOIN rating_priors p ON p.name = %s
+        WHERE m.movie_id = %s
+        ON DUPLICATE KEY UPDATE
+            title = VALUES(title), title_key = VALUES(title_key), release_year = VALUES(release_year),
+            average_rating = VALUES(average_rating), weighted_rating = VALUES(weighted_rating);
+    """, (genre_id, PRIOR_NAME, movie_id))
+
+
+# --- Reading ---
+
+def _seek_clause(columns, descending, inclusive):
+    """Lexicographic 'sorts after the cursor' predicate, e.g. (a > %s OR (a = %s AND b > %s))."""
+    column, rest = columns[0], columns[1:]
+    op = "<" if descending[0] else ">"
+    if not rest:
+        return f"r.{column} {op}{'=' if inclusive else ''} %s"
+    return f"(r.{column} {op} %s OR (r.{column} = %s AND {_seek_clause(rest, descending[1:], inclusive)}))"
+
+
+def _seek_params(after):
+    """Parameters for _seek_clause: each value but the last appears twice."""
+    return [value for value in after[:-1] for _ in range(2)] + [after[-1]]
+
+
+def genre_page_query(genre_id, sort, after=None, limit=20, inclusive=False):
+    """
+    One genre's list in `sort` order, starting after (or at, when inclusive)
+    the key values in `after`. Returns (sql, params).
+    """
+    columns, descending = GENRE_SORTS[sort]
+    where, params = "r.genre_id = %s", [genre_id]
+    if after is not None:
+        where += f" AND {_seek_clause(columns, descending, inclusive)}"
+        params += _seek_params(after)
+    order_by = ", ".join(f"r.{column} {'DESC' if desc else 'ASC'}" for column, desc in zip(columns, descending))
+    sql = f"""
+        SELECT r.movie_id, r.title, r.release_year, r.average_rating, r.title_key, r.weighted_rating
+        FROM genre_movie_rankings r
+        WHERE {where}
+        ORDER BY {order_by}
+        LIMIT %s
+    """
+    return sql, (*params, limit)
+
+
+def sort_values(sort, row):
+    """The cursor values of a row (what `after` expects)."""
+    return [row[column] for column in GENRE_SORTS[sort][0]]
+
+
+def _merge_key(sort, values):
+    """Sort values as a tuple that compares ascending in Python."""
+    return tuple(-value if desc else value for value, desc in zip(values, GENRE_SORTS[sort][1]))
+
+
+class _GenreRun:
+    """One genre's list, read MERGE_CHUNK rows at a time from a keyset position."""
+
+    def __init__(self, cursor, genre_id, sort, after):
+        self.cursor = cursor
+        self.genre_id = genre_id
+        self.sort = sort
+        self._load(after, inclusive=False)
+
+    def _load(self, after, inclusive):
+        self.cursor.execute(*genre_page_query(self.genre_id, self.sort, after, MERGE_CHUNK, inclusive))
+        self.rows = self.cursor.fetchall()
+        self.keys = [_merge_key(self.sort, sort_values(self.sort, row)) for row in self.rows]
+        self.pos = 0
+        self.last_chunk = len(self.rows) < MERGE_CHUNK
+
+    def head(self):
+        return self.keys[self.pos] if self.pos < len(self.keys) else None
+
+    def seek(self, key):
+        """Moves to the first row whose key is >= key. Returns its key, or None at the end."""
+        pos = bisect_left(self.keys, key, self.pos)
+        if pos < len(self.keys) or self.last_chunk:
+            self.pos = pos
+        else:
+            # Past this chunk: jump there with an index seek instead of reading every row
+            # (_merge_key is its own inverse, so this turns the key back into values)
+            self._load(_merge_key(self.sort, key), inclusive=True)
+        return self.head()
+
+    def advance(self):
+        """Moves past the current row. Returns the next key, or None at the end."""
+        self.pos += 1
+        if self.pos == len(self.keys) and not self.last_chunk:
+            self._load(sort_values(self.sort, self.rows[-1]), inclusive=False)
+        return self.head()
+
+
+def intersect_genres(cursor, genre_ids, sort, after=None, limit=20):
+    """
+    Movies in every one of `genre_ids`, in `sort` order after `after`, up to
+    `limit` rows. `cursor` must return dictionary rows.
+    """
+    runs = [_GenreRun(cursor, genre_id, sort, after) for genre_id in genre_ids]
+    rows = []
+    target = runs[0].head()
+    while target is not None and len(rows) < limit:
+        for run in runs:
+            head = run.seek(target)
+            if head is None:
+                return rows
+            if head > target:
+                target = head
+                break
+        else:
+            rows.append(runs[0].rows[runs[0].pos])
+            target = runs[0].advance()
+    return rows
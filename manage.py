@@ -0,0 +1,341 @@
+"""
+Maintenance commands for the derived tables.
+
+Usage:
+    python manage.py migrate [--to 4] [--status] [--report] [--report-json FILE]
+    python manage.py rebuild-rating-stats
+    python manage.py rebuild-genre-rankings
+    python manage.py rebuild-popularity
+    python manage.py rebuild-trending
+    python manage.py rebuild-taste-profiles
+    python manage.py build-cooccurrence [--top-k 20] [--partition 3/8]
+    python manage.py build-content-index
+    python manage.py build-synopsis-index [--top-k 20] [--workers 8]
+    python manage.py build-user-neighbors [--neighbors 50] [--recall-sample 200]
+    python manage.py train-mf [--factors 32] [--iterations 10] [--reg 0.05]
+"""
+import argparse
+import logging
+import os
+import time
+
+import mysql.connector
+from dotenv import load_dotenv
+
+from rating_stats import rebuild_rating_stats
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- Database configuration (the "DB_CONFIG" equivalent) ---
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST"),
+    "port": os.getenv("DB_PORT"),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD"),
+    "database": os.getenv("DB_NAME")
+}
+
+
+def parse_partition(value):
+    """Parses 'INDEX/COUNT' (e.g. '3/8') into a tuple."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("partition must look like INDEX/COUNT, e.g. 3/8")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError("partition index must be in [0, COUNT)")
+    return index, count
+
+
+# --- Commands ---
+
+def add_migrate_args(parser):
+    parser.add_argument("--to", type=int, default=None, help="stop after this migration version")
+    parser.add_argument("--status", action="store_true", help="list migrations and whether they are applied")
+    parser.add_argument("--report", action="store_true",
+                        help="EXPLAIN and time the affected endpoint queries before and after")
+    parser.add_argument("--report-json", default=None, help="also write the report to this JSON file")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per query in the report")
+
+
+def cmd_migrate(cnx, args):
+    import json
+
+    from migrations import MIGRATIONS, applied_versions, migrate, pending_migrations, pick_sample, print_report, \
+        probe, probes_for
+
+    cursor = cnx.cursor()
+    try:
+        if args.status:
+            applied = applied_versions(cursor)
+            for version, name, _, _ in MIGRATIONS:
+                print(f"{version:04d} {name}: {'applied' if version in applied else 'pending'}")
+            return
+
+        pending = pending_migrations(cursor, args.to)
+        if not pending:
+            print("Schema is up to date.")
+            return
+        report = args.report or args.report_json
+        if report:
+            sample = pick_sample(cursor)
+            names = probes_for(pending)
+            print(f"Probing {', '.join(names)} with {sample}...")
+            before = probe(cursor, names, sample, args.repeat, before=True)
+    finally:
+        cursor.close()
+
+    print(f"Applying {len(pending)} migration(s):")
+    applied = migrate(cnx, target=args.to)
+    print(f"Now at version {max(applied)}." if applied else "Nothing applied (another runner got there first).")
+
+    if report:
+        cursor = cnx.cursor()
+        try:
+            cursor.execute("ANALYZE TABLE ratings, reviews, movie_genres, genre_movie_rankings, movie_popularity")
+            cursor.fetchall()
+            after = probe(cursor, names, sample, args.repeat)
+        finally:
+            cursor.close()
+        print_report(before, after)
+        if args.report_json:
+            with open(args.report_json, "w", encoding="utf-8") as f:
+                json.dump({"migrations": applied, "sample": sample, "before": before, "after": after}, f, indent=2)
+            print(f"\nReport written to {args.report_json}.")
+
+
+def cmd_rebuild_rating_stats(cnx, args):
+    cursor = cnx.cursor()
+    try:
+        movies = rebuild_rating_stats(cursor)
+        cnx.commit()
+        print(f"movie_rating_stats rebuilt for {movies} movies.")
+    finally:
+        cursor.close()
+
+
+def cmd_rebuild_genre_rankings(cnx, args):
+    from genre_rankings import rebuild_genre_rankings
+
+    cursor = cnx.cursor()
+    try:
+        rows = rebuild_genre_rankings(cursor)
+        cnx.commit()
+        print(f"genre_movie_rankings rebuilt ({rows} rows).")
+    finally:
+        cursor.close()
+
+
+def cmd_rebuild_popularity(cnx, args):
+    from popularity import recompute_popularity
+
+    cursor = cnx.cursor()
+    try:
+        ranked = recompute_popularity(cnx, cursor, reconcile_totals=True)
+        print(f"rating_totals reconciled, movie_popularity recomputed ({ranked} movies ranked).")
+    finally:
+        cursor.close()
+
+
+def cmd_rebuild_trending(cnx, args):
+    from trending import rebuild_trending
+
+    cursor = cnx.cursor()
+    try:
+        buckets = rebuild_trending(cursor)
+        cnx.commit()
+        print(f"movie_rating_buckets rebuilt from ratings ({buckets} buckets).")
+    finally:
+        cursor.close()
+
+
+def cmd_rebuild_taste_profiles(cnx, args):
+    from taste_profiles import rebuild_taste_profiles
+
+    cursor = cnx.cursor()
+    try:
+        profile_rows = rebuild_taste_profiles(cursor)
+        cnx.commit()
+        print(f"user_taste_profiles rebuilt ({profile_rows} rows).")
+    finally:
+        cursor.close()
+
+
+def add_cooccurrence_args(parser):
+    parser.add_argument("--top-k", type=int, default=20, help="neighbours kept per movie")
+    parser.add_argument("--min-co-likes", type=int, default=1, help="ignore pairs liked together fewer times")
+    parser.add_argument("--partition", type=parse_partition, default=None,
+                        help="only rebuild movies with movie_id %% COUNT == INDEX")
+
+
+def cmd_build_cooccurrence(cnx, args):
+    from cooccurrence import build_cooccurrence_index
+
+    summary = build_cooccurrence_index(cnx, top_k=args.top_k, partition=args.partition,
+                                       min_co_likes=args.min_co_likes)
+    print(f"movie_similar_movies rebuilt for {summary['movies_built']} movies "
+          f"(partition {summary['partition']}).")
+    print(f"Liked matrix: {summary['matrix_users']} users x {summary['matrix_movies']} movies, "
+          f"{summary['matrix_nnz']} non-zeros (loaded in {summary['load_ms']} ms).")
+    print(f"Build time: {summary['duration_ms']} ms.")
+
+
+def cmd_build_content_index(cnx, args):
+    from content_index import CONTENT_SNAPSHOT, ContentSimilarityIndex
+    from cooccurrence import record_build
+
+    started = time.time()
+    cursor = cnx.cursor()
+    try:
+        index = ContentSimilarityIndex()
+        movies = index.build(cursor)
+        index.save()
+        duration_ms = int((time.time() - started) * 1000)
+        shape = (index.movie_ids.size, index.feature_ids.size)
+        record_build(cursor, "content_index", started, duration_ms, shape, len(index.row_indices), movies, None)
+        cnx.commit()
+    finally:
+        cursor.close()
+    print(f"Content index: {shape[0]} movies x {shape[1]} features, {len(index.row_indices)} links "
+          f"in {duration_ms} ms; snapshot written to {CONTENT_SNAPSHOT}.")
+
+    sample = index.movie_ids.view[:1000]
+    if len(sample):
+        start = time.perf_counter()
+        for movie_id in sample:
+            index.similar(int(movie_id))
+        print(f"Average query time over {len(sample)} movies: "
+              f"{(time.perf_counter() - start) * 1000 / len(sample):.3f} ms.")
+
+
+def add_synopsis_args(parser):
+    parser.add_argument("--top-k", type=int, default=20, help="neighbours kept per movie")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+
+
+def cmd_build_synopsis_index(cnx, args):
+    from synopsis_index import build_synopsis_index
+
+    summary = build_synopsis_index(cnx, top_k=args.top_k, workers=args.workers)
+    print(f"movie_synopsis_neighbors rebuilt: {summary['neighbor_rows']} rows for {summary['movies']} movies "
+          f"with {summary['workers']} workers.")
+    print(f"Load {summary['load_s']}s, TF-IDF {summary['tfidf_s']}s, neighbours {summary['neighbors_s']}s; "
+          f"throughput {summary['movies_per_s']} movies/s.")
+
+
+def add_neighbor_args(parser):
+    parser.add_argument("--neighbors", type=int, default=50, help="neighbours kept per user")
+    parser.add_argument("--recall-sample", type=int, default=200,
+                        help="users to check against the exact SQL (0 to skip)")
+
+
+def cmd_build_user_neighbors(cnx, args):
+    from user_neighbors import build_user_neighbors, neighbor_recall
+
+    summary = build_user_neighbors(cnx, top_n=args.neighbors)
+    print(f"user_neighbors rebuilt: {summary['users_with_neighbors']} of {summary['users']} users "
+          f"have neighbours ({summary['neighbor_rows']} rows).")
+    print(f"Load {summary['load_ms']} ms, MinHash/LSH {summary['compute_ms']} ms, "
+          f"total {summary['duration_ms']} ms.")
+
+    if args.recall_sample:
+        cursor = cnx.cursor()
+        try:
+            cursor.execute("SELECT user_id FROM user_minhash ORDER BY RAND() LIMIT %s", (args.recall_sample,))
+            sample = [row[0] for row in cursor.fetchall()]
+            recall, evaluated = neighbor_recall(cursor, sample, top_n=args.neighbors)
+        finally:
+            cursor.close()
+        if recall is not None:
+            print(f"Neighbour recall vs exact SQL over {evaluated} users: {recall:.3f}")
+
+
+def add_mf_args(parser):
+    parser.add_argument("--factors", type=int, default=32, help="latent dimensions")
+    parser.add_argument("--iterations", type=int, default=10, help="ALS sweeps")
+    parser.add_argument("--reg", type=float, default=0.05, help="L2 regularization (scaled by rating count)")
+    parser.add_argument("--benchmark-users", type=int, default=1000, help="users to time scoring for")
+
+
+def cmd_train_mf(cnx, args):
+    import numpy as np
+
+    from cooccurrence import record_build
+    from mf_engine import MF_MODEL_DIR, load_ratings, train_als
+
+    started = time.time()
+    cursor = cnx.cursor()
+    try:
+        t0 = time.perf_counter()
+        user_ids, movie_ids, ratings = load_ratings(cursor)
+        print(f"Loaded {len(ratings)} ratings in {time.perf_counter() - t0:.2f}s.")
+
+        model = train_als(user_ids, movie_ids, ratings, factors=args.factors, reg=args.reg,
+                          iterations=args.iterations)
+        version = model.save()
+        meta = model.meta
+        print(f"Trained {meta['users']} users x {meta['movies']} movies, {meta['factors']} factors "
+              f"in {meta['train_seconds']}s (train RMSE {meta['train_rmse']}).")
+        print(f"Model saved to {MF_MODEL_DIR} as version {version}.")
+
+        duration_ms = int((time.time() - started) * 1000)
+        record_build(cursor, "mf_model", started, duration_ms, (meta["users"], meta["movies"]),
+                     meta["ratings"], meta["users"], None)
+        cnx.commit()
+    finally:
+        cursor.close()
+
+    # Scoring latency over a sample of users (exclusion set = their own ratings)
+    sample = np.unique(user_ids)[:args.benchmark_users]
+    if len(sample):
+        order = np.argsort(user_ids, kind="stable")
+        bounds = np.searchsorted(user_ids[order], sample), np.searchsorted(user_ids[order], sample, side="right")
+        timings = []
+        for user_id, lo, hi in zip(sample, *bounds):
+            rated = movie_ids[order[lo:hi]]
+            _, elapsed_ms = model.recommend(model.user_vector(int(user_id)), rated, limit=10)
+            timings.append(elapsed_ms)
+        timings.sort()
+        print(f"Scoring latency over {len(timings)} users: p50 {timings[len(timings) // 2]:.3f} ms, "
+              f"p99 {timings[int(len(timings) * 0.99)]:.3f} ms.")
+
+
+# name -> (handler, help text, argument configurer)
+COMMANDS = {
+    "migrate": (cmd_migrate, "Apply pending schema migrations", add_migrate_args),
+    "rebuild-rating-stats": (cmd_rebuild_rating_stats, "Recompute movie_rating_stats from ratings", None),
+    "rebuild-genre-rankings": (cmd_rebuild_genre_rankings, "Recompute the per-genre browse lists", None),
+    "rebuild-popularity": (cmd_rebuild_popularity, "Recompute the popularity leaderboard", None),
+    "rebuild-trending": (cmd_rebuild_trending, "Refill the trending rating buckets from ratings", None),
+    "rebuild-taste-profiles": (cmd_rebuild_taste_profiles, "Recompute the user taste profiles", None),
+    "build-cooccurrence": (cmd_build_cooccurrence, "Build the co-liked movies index", add_cooccurrence_args),
+    "build-content-index": (cmd_build_content_index, "Build the content-similarity snapshot", None),
+    "build-synopsis-index": (cmd_build_synopsis_index, "Build synopsis TF-IDF neighbours", add_synopsis_args),
+    "build-user-neighbors": (cmd_build_user_neighbors, "Build MinHash/LSH similar-user lists", add_neighbor_args),
+    "train-mf": (cmd_train_mf, "Train the matrix-factorization model", add_mf_args),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, (_, help_text, add_args) in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=help_text)
+        if add_args:
+            add_args(subparser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    handler, _, _ = COMMANDS[args.command]
+    cnx = mysql.connector.connect(**DB_CONFIG)
+    start = time.perf_counter()
+    try:
+        handler(cnx, args)
+    finally:
+        cnx.close()
+    print(f"Done in {time.perf_counter() - start:.2f}s.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+Latent-factor recommendation engine (explicit-feedback ALS, NumPy only).
+
+Training (python manage.py train-mf) loads the ratings table, centres the
+ratings on the global mean and alternates regularized least-squares solves
+for user and item factors (ALS-WR: lambda is scaled by each row's rating
+count). The normal equations for a chunk of rows are built with a single
+einsum + reduceat and solved with one batched np.linalg.solve.
+
+Each training run saves its float32 .npy arrays into a new version
+directory under MF_MODEL_DIR and then atomically replaces the CURRENT
+pointer file, so a worker never sees a half-written model or arrays from
+two different runs. Files of a version are never modified once written;
+workers memory-map them read-only and reload when CURRENT changes.
+
+Serving scores every movie with one matrix-vector product and picks the
+top-K with argpartition. The user's vector is fitted to their current
+ratings (least-squares fold-in, a single k x k solve) without retraining
+the items, so every worker derives the same vector from the database and
+new ratings count immediately. Each model keeps the last FOLD_CACHE_USERS
+folded vectors keyed on the user's ratings, so the solve only reruns after
+the user rated something.
+"""
+import json
+import os
+from collections import OrderedDict
+import shutil
+import threading
+import time
+import uuid
+
+import numpy as np
+from scipy import sparse
+
+MF_MODEL_DIR = os.getenv("MF_MODEL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "mf"))
+DEFAULT_FACTORS = 32
+DEFAULT_REG = 0.05
+DEFAULT_ITERATIONS = 10
+CHUNK_NNZ = 20000          # ratings per batched solve (bounds the einsum temporary)
+FETCH_BATCH = 100000
+KEEP_VERSIONS = 2          # model versions kept on disk (workers may still map the previous one)
+CURRENT_FILE = "CURRENT"
+FOLD_CACHE_USERS = int(os.getenv("MF_FOLD_CACHE_USERS", 10000))
+
+
+# --- Training ---
+
+def load_ratings(cursor):
+    """Returns (user_ids, movie_ids, ratings) arrays for the whole ratings table."""
+    cursor.execute("SELECT user_id, movie_id, rating FROM ratings")
+    parts = []
+    while True:
+        rows = cursor.fetchmany(FETCH_BATCH)
+        if not rows:
+            break
+        parts.append(np.asarray(rows, dtype=np.int64))
+    if not parts:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+    data = np.concatenate(parts)
+    return data[:, 0], data[:, 1], data[:, 2]
+
+
+def _solve_rows(matrix, other, reg):
+    """
+    Least-squares factors for every row of the CSR `matrix` given the
+    factors of the other side: (Y_r^T Y_r + reg * n_r * I) x_r = Y_r^T r_r.
+    Rows without ratings get a zero vector.
+    """
+    n_rows, k = matrix.shape[0], other.shape[1]
+    out = np.zeros((n_rows, k), dtype=np.float32)
+    eye = np.eye(k, dtype=np.float64)
+    indptr = matrix.indptr
+
+    row = 0
+    while row < n_rows:
+        end = int(np.searchsorted(indptr, indptr[row] + CHUNK_NNZ, side="right")) - 1
+        end = min(max(end, row + 1), n_rows)
+        lo, hi = indptr[row], indptr[end]
+        if hi > lo:
+            ys = other[matrix.indices[lo:hi]]
+            values = matrix.data[lo:hi]
+            # Per-row sums over the chunk's ratings as one sparse product
+            segments = sparse.csr_matrix(
+                (np.ones(hi - lo, dtype=np.float32), np.arange(hi - lo), indptr[row:end + 1] - lo),
+                shape=(end - row, hi - lo),
+            )
+            outer = np.einsum("nk,nl->nkl", ys, ys).reshape(hi - lo, k * k)
+            gram = (segments @ outer).reshape(end - row, k, k).astype(np.float64)
+            rhs = (segments @ (ys * values[:, None])).astype(np.float64)
+            counts = np.diff(indptr[row:end + 1])
+            gram += (reg * np.maximum(counts, 1))[:, None, None] * eye
+            out[row:end] = np.linalg.solve(gram, rhs[..., None])[..., 0]
+        row = end
+    return out
+
+
+def train_als(user_ids, movie_ids, ratings, factors=DEFAULT_FACTORS, reg=DEFAULT_REG,
+              iterations=DEFAULT_ITERATIONS, seed=0, log=print):
+    """Fits the model in memory and returns a MatrixFactorizationModel."""
+    start = time.perf_counter()
+    user_index, rows = np.unique(user_ids, return_inverse=True)
+    movie_index, cols = np.unique(movie_ids, return_inverse=True)
+    mean = float(ratings.mean()) if len(ratings) else 3.0
+    centred = (ratings - mean).astype(np.float32)
+
+    by_user = sparse.csr_matrix((centred, (rows, cols)), shape=(len(user_index), len(movie_index)))
+    by_movie = by_user.T.tocsr()
+
+    rng = np.random.default_rng(seed)
+    item_factors = (rng.standard_normal((len(movie_index), factors)) * 0.1).astype(np.float32)
+    user_factors = np.zeros((len(user_index), factors), dtype=np.float32)
+
+    rmse = None
+    for iteration in range(iterations):
+        user_factors = _solve_rows(by_user, item_factors, reg)
+        item_factors = _solve_rows(by_movie, user_factors, reg)
+        predicted = np.einsum("nk,nk->n", user_factors[rows], item_factors[cols])
+        rmse = float(np.sqrt(np.mean((predicted - centred) ** 2))) if len(centred) else 0.0
+        log(f"  iteration {iteration + 1}/{iterations}: train RMSE {rmse:.4f}")
+
+    meta = {
+        "factors": factors,
+        "reg": reg,
+        "iterations": iterations,
+        "mean": mean,
+        "users": int(len(user_index)),
+        "movies": int(len(movie_index)),
+        "ratings": int(len(ratings)),
+        "train_rmse": rmse,
+        "train_seconds": round(time.perf_counter() - start, 3),
+        "trained_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    return MatrixFactorizationModel(user_index, movie_index, user_factors, item_factors, meta)
+
+
+# --- Model ---
+
+class MatrixFactorizationModel:
+    def __init__(self, user_ids, movie_ids, user_factors, item_factors, meta):
+        self.user_ids = user_ids              # sorted int64, row -> user_id
+        self.movie_ids = movie_ids            # sorted int64, row -> movie_id
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.meta = meta
+        self.mean = meta["mean"]
+        self.reg = meta["reg"]
+        self.version = None                   # set by save() / load()
+        self._lock = threading.Lock()
+        self._folded = OrderedDict()          # user_id -> (ratings key, vector), LRU order
+        self.fold_ins = 0
+        self.fold_in_cache_hits = 0
+        self.scoring_ms_total = 0.0
+        self.scoring_requests = 0
+
+    def save(self, directory=MF_MODEL_DIR):
+        """Writes a new version directory, then points CURRENT at it. Returns the version."""
+        now = time.time()
+        version = f"{time.strftime('%Y%m%dT%H%M%S', time.localtime(now))}.{int(now * 1e6) % 1000000:06d}" \
+                  f"-{uuid.uuid4().hex[:8]}"  # sorts by creation time
+        path = os.path.join(directory, version)
+        os.makedirs(path)
+        for name, array in (("user_ids", self.user_ids), ("movie_ids", self.movie_ids),
+                            ("user_factors", self.user_factors), ("item_factors", self.item_factors)):
+            np.save(os.path.join(path, f"{name}.npy"), array)
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump(self.meta, f, indent=2)
+
+        pointer = os.path.join(directory, f"{CURRENT_FILE}.{version}.tmp")
+        with open(pointer, "w") as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(pointer, os.path.join(directory, CURRENT_FILE))
+        self.version = version
+        _prune_versions(directory, version)
+        return version
+
+    @classmethod
+    def load(cls, directory=MF_MODEL_DIR, version=None):
+        """Loads `version` (default: the current one). Raises OSError if there is none."""
+        version = version or current_version(directory)
+        if version is None:
+            raise FileNotFoundError(f"No model in {directory}")
+        path = os.path.join(directory, version)
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        model = cls(
+            np.load(os.path.join(path, "user_ids.npy")),
+            np.load(os.path.join(path, "movie_ids.npy")),
+            np.load(os.path.join(path, "user_factors.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, "item_factors.npy")),
+            meta,
+        )
+        model.version = version
+        return model
+
+    def _row(self, ids, value):
+        i = int(np.searchsorted(ids, value))
+        return i if i < len(ids) and ids[i] == value else None
+
+    def user_vector(self, user_id):
+        """The user's vector as trained, or None for users the model has not seen."""
+        row = self._row(self.user_ids, user_id)
+        return self.user_factors[row] if row is not None else None
+
+    def fold_in(self, rated):
+        """
+        Fits a user vector to their (movie_id, rating) pairs with the item
+        factors held fixed. Nothing is stored: the ratings in the database
+        are the state, so every worker computes the same vector.
+        """
+        rows, values = [], []
+        for movie_id, rating in rated:
+            row = self._row(self.movie_ids, movie_id)
+            if row is not None:
+                rows.append(row)
+                values.append(rating - self.mean)
+        k = self.item_factors.shape[1]
+        if not rows:
+            vector = np.zeros(k, dtype=np.float32)
+        else:
+            ys = self.item_factors[rows].astype(np.float64)
+            gram = ys.T @ ys + self.reg * len(rows) * np.eye(k)
+            vector = np.linalg.solve(gram, ys.T @ np.asarray(values)).astype(np.float32)
+        with self._lock:
+            self.fold_ins += 1
+        return vector
+
+    def folded_vector(self, user_id, rated):
+        """fold_in(rated), reused while the user's (movie_id, rating) pairs stay the same."""
+        key = (len(rated), hash(tuple(sorted(rated))))
+        with self._lock:
+            cached = self._folded.get(user_id)
+            if cached is not None and cached[0] == key:
+                self._folded.move_to_end(user_id)
+                self.fold_in_cache_hits += 1
+                return cached[1]
+        vector = self.fold_in(rated)
+        with self._lock:
+            self._folded[user_id] = (key, vector)
+            self._folded.move_to_end(user_id)
+            while len(self._folded) > FOLD_CACHE_USERS:
+                self._folded.popitem(last=False)
+        return vector
+
+    def recommend(self, vector, exclude_movie_ids=(), limit=10):
+        """Top-`limit` (movie_id, predicted_rating) pairs for a user vector."""
+        start = time.perf_counter()
+        scores = self.item_factors @ vector
+        if len(exclude_movie_ids):
+            excluded = np.asarray(list(exclude_movie_ids), dtype=np.int64)
+            rows = np.minimum(np.searchsorted(self.movie_ids, excluded), len(self.movie_ids) - 1)
+            scores[rows[self.movie_ids[rows] == excluded]] = -np.inf
+
+        limit = max(0, min(limit, len(scores)))
+        if limit < len(scores):
+            top = np.argpartition(-scores, limit)[:limit]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        top = top[np.isfinite(scores[top])]
+        result = [(int(self.movie_ids[i]), float(scores[i]) + self.mean) for i in top]
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.scoring_ms_total += elapsed_ms
+            self.scoring_requests += 1
+        return result, elapsed_ms
+
+
+def current_version(directory=MF_MODEL_DIR):
+    """The version CURRENT points at, or None before the first training run."""
+    try:
+        with open(os.path.join(directory, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _prune_versions(directory, current):
+    """Deletes all but the KEEP_VERSIONS newest version directories (never `current`)."""
+    versions = sorted(entry.name for entry in os.scandir(directory) if entry.is_dir())
+    for version in versions[:-KEEP_VERSIONS]:
+        if version != current:
+            # Workers still mapping these files keep them alive until they reload
+            shutil.rmtree(os.path.join(directory, version), ignore_errors=True)
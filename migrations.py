@@ -0,0 +1,606 @@
+"""
+Versioned schema migrations for a live database.
+
+schema.sql creates a fresh database; a database that already holds data
+(including one created from the original 12-table schema) is brought
+forward with `python manage.py migrate` instead. MIGRATIONS is an ordered
+list of numbered steps. The applied versions are
+recorded in schema_migrations, and every step checks information_schema
+before changing anything, so a migration that was interrupted (MySQL DDL
+commits on its own) or that schema.sql already covers is simply recorded
+on the next run.
+
+Indexes are added with ALGORITHM=INPLACE, LOCK=NONE, so reads and writes
+keep going while they build. Derived tables are created and then filled
+from the base tables if they are empty: the ones the rating paths update
+incrementally with the same rebuild the manage.py commands run, the
+offline indexes with their builder (default settings) once there is data
+to build them from.
+
+Each migration names the endpoint queries it is meant to speed up
+(PROBES). With --report the runner EXPLAINs and times those queries before
+and after applying the pending migrations.
+"""
+import statistics
+import time
+
+import queries
+from queries import MIN_RATING
+from rating_stats import AVERAGE_RATING_SQL
+from trending import trending_query
+
+MIGRATION_LOCK = "movie_rec_db.schema_migrations"
+LOCK_TIMEOUT = 10        # seconds to wait for another runner
+PROBE_REPEAT = 20        # timed executions per probe query
+
+VERSION_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INT PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        duration_ms INT NOT NULL
+    )
+"""
+
+
+# --- Steps ---
+
+def index_exists(cursor, table, name):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        LIMIT 1
+    """, (table, name))
+    return bool(cursor.fetchall())
+
+
+def add_index(table, name, columns):
+    """A step that adds INDEX name (columns) to table unless it is already there."""
+    def step(cnx, cursor):
+        if index_exists(cursor, table, name):
+            return f"{table}.{name} already exists"
+        cursor.execute(f"ALTER TABLE {table} ADD INDEX {name} ({columns}), ALGORITHM=INPLACE, LOCK=NONE")
+        return f"added {table}.{name} ({columns})"
+    return step
+
+
+def add_column(table, name, definition):
+    """A step that adds column `name` to table unless it is already there."""
+    def step(cnx, cursor):
+        cursor.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        """, (table, name))
+        if cursor.fetchall():
+            return f"{table}.{name} already exists"
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}, ALGORITHM=INPLACE, LOCK=NONE")
+        return f"added {table}.{name}"
+    return step
+
+
+def table_exists(cursor, name):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s
+    """, (name,))
+    return bool(cursor.fetchall())
+
+
+def create_table(name, ddl):
+    """A step that runs CREATE TABLE `ddl` unless the table is already there."""
+    def step(cnx, cursor):
+        if table_exists(cursor, name):
+            return f"{name} already exists"
+        cursor.execute(ddl)
+        return f"created {name}"
+    return step
+
+
+def drop_table(name):
+    """A step that drops a table that is no longer used."""
+    def step(cnx, cursor):
+        if not table_exists(cursor, name):
+            return f"{name} does not exist"
+        cursor.execute(f"DROP TABLE {name}")
+        return f"dropped {name}"
+    return step
+
+
+def table_empty(cursor, table):
+    cursor.execute(f"SELECT 1 FROM {table} LIMIT 1")
+    return not cursor.fetchall()
+
+
+def populate_rating_stats(cnx, cursor):
+    from rating_stats import rebuild_rating_stats
+
+    if not table_empty(cursor, "movie_rating_stats"):
+        return "movie_rating_stats already populated"
+    return f"movie_rating_stats built ({rebuild_rating_stats(cursor)} movies)"
+
+
+def populate_taste_profiles(cnx, cursor):
+    from taste_profiles import rebuild_taste_profiles
+
+    if not table_empty(cursor, "user_taste_profiles"):
+        return "user_taste_profiles already populated"
+    return f"user_taste_profiles built ({rebuild_taste_profiles(cursor)} rows)"
+
+
+def build_offline(table, source_sql, build, command):
+    """
+    A step that fills an empty offline index with build(cnx) once source_sql
+    finds rows to build it from; `command` rebuilds it with other settings.
+    """
+    def step(cnx, cursor):
+        if not table_empty(cursor, table):
+            return f"{table} already populated"
+        cursor.execute(source_sql)
+        if not cursor.fetchall():
+            return f"{table} left empty (nothing to build from yet; run manage.py {command} later)"
+        summary = build(cnx)
+        return f"{table} built in {summary['duration_ms']} ms (manage.py {command} rebuilds it)"
+    return step
+
+
+def _build_cooccurrence(cnx):
+    from cooccurrence import build_cooccurrence_index
+    return build_cooccurrence_index(cnx)
+
+
+def _build_user_neighbors(cnx):
+    from user_neighbors import build_user_neighbors
+    return build_user_neighbors(cnx)
+
+
+def _build_synopsis_index(cnx):
+    from synopsis_index import build_synopsis_index
+    return build_synopsis_index(cnx)
+
+
+def populate_popularity(cnx, cursor):
+    from popularity import recompute_popularity
+
+    if not table_exists(cursor, "movie_rating_stats"):
+        return "movie_popularity left empty (movie_rating_stats comes with migration 16)"
+    cursor.execute("SELECT 1 FROM movie_popularity LIMIT 1")
+    if cursor.fetchall():
+        return "movie_popularity already populated"
+    return f"movie_popularity built ({recompute_popularity(cnx, cursor, reconcile_totals=True)} movies)"
+
+
+def populate_trending(cnx, cursor):
+    from trending import rebuild_trending
+
+    cursor.execute("SELECT 1 FROM movie_rating_buckets LIMIT 1")
+    if cursor.fetchall():
+        return "movie_rating_buckets already populated"
+    return f"movie_rating_buckets backfilled ({rebuild_trending(cursor)} buckets)"
+
+
+def populate_genre_rankings(cnx, cursor):
+    from genre_rankings import rebuild_genre_rankings
+
+    if not table_exists(cursor, "movie_rating_stats"):
+        return "genre_movie_rankings left empty (movie_rating_stats comes with migration 16)"
+    cursor.execute("SELECT 1 FROM genre_movie_rankings LIMIT 1")
+    if cursor.fetchall():
+        return "genre_movie_rankings already populated"
+    return f"genre_movie_rankings built ({rebuild_genre_rankings(cursor)} rows)"
+
+
+# --- Migrations ---
+# (version, name, steps, probes). Versions only ever grow; never renumber or
+# edit a migration that has shipped, add a new one instead.
+
+MIGRATIONS = [
+    (1, "ratings_movie_rating_index",
+     [add_index("ratings", "idx_ratings_movie_rating", "movie_id, rating")],
+     ["movie_rating_aggregate", "similar_users_exact"]),
+    (2, "ratings_user_rating_movie_index",
+     [add_index("ratings", "idx_ratings_user_rating_movie", "user_id, rating, movie_id")],
+     ["personal_collaborative", "user_liked_movies", "similar_users_exact"]),
+    (3, "reviews_movie_created_index",
+     [add_index("reviews", "idx_reviews_movie_created", "movie_id, created_at")],
+     ["movie_detail"]),
+    (4, "movie_genres_genre_movie_index",
+     [add_index("movie_genres", "idx_movie_genres_genre_movie", "genre_id, movie_id")],
+     ["movies_genre"]),
+    (5, "genre_movie_rankings",
+     [create_table("rating_priors", """
+         CREATE TABLE rating_priors (
+             name VARCHAR(32) PRIMARY KEY,
+             prior_mean DOUBLE NOT NULL,
+             computed_at TIMESTAMP NOT NULL
+         )
+      """),
+      create_table("genre_movie_rankings", """
+         CREATE TABLE genre_movie_rankings (
+             genre_id INT NOT NULL,
+             movie_id INT NOT NULL,
+             title VARCHAR(255) NOT NULL,
+             title_key VARCHAR(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_bin NOT NULL,
+             release_year INT NOT NULL,
+             average_rating DECIMAL(8, 4) NOT NULL,
+             weighted_rating DOUBLE NOT NULL,
+             PRIMARY KEY (genre_id, movie_id),
+             INDEX idx_gmr_title (genre_id, title_key, movie_id),
+             INDEX idx_gmr_recent (genre_id, release_year DESC, title_key, movie_id),
+             INDEX idx_gmr_top_rated (genre_id, weighted_rating DESC, movie_id),
+             INDEX idx_gmr_movie (movie_id),
+             FOREIGN KEY (genre_id) REFERENCES genres(genre_id) ON DELETE CASCADE,
+             FOREIGN KEY (movie_id) REFERENCES movies(movie_id) ON DELETE CASCADE
+         )
+      """),
+      populate_genre_rankings],
+     ["movies_genre_ranked"]),
+    (6, "movie_popularity",
+     [create_table("rating_totals", """
+         CREATE TABLE rating_totals (
+             slot TINYINT PRIMARY KEY,
+             rating_count BIGINT NOT NULL DEFAULT 0,
+             rating_sum BIGINT NOT NULL DEFAULT 0
+         )
+      """),
+      create_table("movie_popularity", """
+         CREATE TABLE movie_popularity (
+             movie_id INT PRIMARY KEY,
+             rating_count INT NOT NULL,
+             average_rating DECIMAL(8, 4) NOT NULL,
+             weighted_rating DOUBLE NOT NULL,
+             INDEX idx_popularity_rank (weighted_rating DESC, movie_id),
+             FOREIGN KEY (movie_id) REFERENCES movies(movie_id) ON DELETE CASCADE
+         )
+      """),
+      populate_popularity],
+     ["popular"]),
+    (7, "movie_rating_buckets",
+     [create_table("movie_rating_buckets", """
+         CREATE TABLE movie_rating_buckets (
+             bucket_hours TINYINT NOT NULL,
+             bucket_start INT NOT NULL,
+             movie_id INT NOT NULL,
+             rating_count INT NOT NULL,
+             rating_sum INT NOT NULL,
+             PRIMARY KEY (bucket_hours, bucket_start, movie_id),
+             INDEX idx_buckets_movie (movie_id),
+             FOREIGN KEY (movie_id) REFERENCES movies(movie_id) ON DELETE CASCADE
+         )
+      """),
+      populate_trending],
+     ["trending"]),
+    (8, "movie_genres_linked_at",
+     [add_column("movie_genres", "linked_at", "TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6)"),
+      add_index("movie_genres", "idx_movie_genres_linked", "linked_at")],
+     []),
+    (9, "drop_genre_candidates",
+     [drop_table("genre_candidates")],
+     []),
+    (10, "movies_year_title_index",
+     [add_index("movies", "idx_year_title", "release_year DESC, title")],
+     []),
+    (11, "user_taste_profiles",
+     [create_table("user_taste_profiles", """
+         CREATE TABLE user_taste_profiles (
+             user_id INT NOT NULL,
+             feature_kind ENUM('genre', 'director') NOT NULL,
+             feature_id INT NOT NULL,
+             weight INT NOT NULL DEFAULT 0,
+             rating_count INT NOT NULL DEFAULT 0,
+             PRIMARY KEY (user_id, feature_kind, feature_id),
+             INDEX idx_taste_weight (user_id, feature_kind, weight),
+             FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+         )
+      """),
+      populate_taste_profiles],
+     []),
+    (12, "index_builds",
+     [create_table("index_builds", """
+         CREATE TABLE index_builds (
+             build_id INT AUTO_INCREMENT PRIMARY KEY,
+             index_name VARCHAR(64) NOT NULL,
+             started_at TIMESTAMP NOT NULL,
+             duration_ms INT NOT NULL,
+             matrix_rows INT NOT NULL,
+             matrix_cols INT NOT NULL,
+             matrix_nnz BIGINT NOT NULL,
+             items_built INT NOT NULL,
+             partition_label VARCHAR(32) NOT NULL DEFAULT 'all',
+             INDEX idx_index_builds_name (index_name, started_at)
+         )
+      """)],
+     []),
+    (13, "movie_similar_movies",
+     [create_table("movie_similar_movies", """
+         CREATE TABLE movie_similar_movies (
+             movie_id INT NOT NULL,
+             rank_pos SMALLINT NOT NULL,
+             similar_movie_id INT NOT NULL,
+             similarity FLOAT NOT NULL,
+             co_likes INT NOT NULL,
+             PRIMARY KEY (movie_id, rank_pos),
+             FOREIGN KEY (movie_id) REFERENCES movies(movie_id) ON DELETE CASCADE,
+             FOREIGN KEY (similar_movie_id) REFERENCES movies(movie_id) ON DELETE CASCADE
+         )
+      """),
+      build_offline("movie_similar_movies", f"SELECT 1 FROM ratings WHERE rating >= {MIN_RATING} LIMIT 1",
+                    _build_cooccurrence, "build-cooccurrence")],
+     []),
+    (14, "user_neighbors",
+     [create_table("user_minhash", """
+         CREATE TABLE user_minhash (
+             user_id INT PRIMARY KEY,
+             signature VARBINARY(256) NOT NULL,
+             FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+         )
+      """),
+      create_table("user_lsh_buckets", """
+         CREATE TABLE user_lsh_buckets (
+             band TINYINT NOT NULL,
+             bucket_key BIGINT NOT NULL,
+             user_id INT NOT NULL,
+             PRIMARY KEY (band, bucket_key, user_id),
+             INDEX idx_lsh_user (user_id),
+             FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+         )
+      """),
+      create_table("user_neighbors", """
+         CREATE TABLE user_neighbors (
+             user_id INT NOT NULL,
+             rank_pos SMALLINT NOT NULL,
+             neighbor_id INT NOT NULL,
+             shared_likes INT NOT NULL,
+             jaccard FLOAT NOT NULL,
+             PRIMARY KEY (user_id, rank_pos),
+             FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+             FOREIGN KEY (neighbor_id) REFERENCES users(user_id) ON DELETE CASCADE
+         )
+      """),
+      build_offline("user_neighbors", f"SELECT 1 FROM ratings WHERE rating >= {MIN_RATING} LIMIT 1",
+                    _build_user_neighbors, "build-user-neighbors")],
+     []),
+    (15, "movie_synopsis_neighbors",
+     [create_table("movie_synopsis_neighbors", """
+         CREATE TABLE movie_synopsis_neighbors (
+             movie_id INT NOT NULL,
+             rank_pos SMALLINT NOT NULL,
+             similar_movie_id INT NOT NULL,
+             similarity FLOAT NOT NULL,
+             PRIMARY KEY (movie_id, rank_pos),
+             FOREIGN KEY (movie_id) REFERENCES movies(movie_id) ON DELETE CASCADE,
+             FOREIGN KEY (similar_movie_id) REFERENCES movies(movie_id) ON DELETE CASCADE
+         )
+      """),
+      build_offline("movie_synopsis_neighbors", "SELECT 1 FROM movies WHERE synopsis IS NOT NULL LIMIT 1",
+                    _build_synopsis_index, "build-synopsis-index")],
+     []),
+    (16, "movie_rating_stats",
+     [create_table("movie_rating_stats", """
+         CREATE TABLE movie_rating_stats (
+             movie_id INT PRIMARY KEY,
+             rating_count INT NOT NULL DEFAULT 0,
+             rating_sum BIGINT NOT NULL DEFAULT 0,
+             rating_sum_sq BIGINT NOT NULL DEFAULT 0,
+             last_rated_at TIMESTAMP NULL,
+             FOREIGN KEY (movie_id) REFERENCES movies(movie_id) ON DELETE CASCADE
+         )
+      """),
+      populate_rating_stats,
+      populate_genre_rankings,
+      populate_popularity],
+     ["movies_genre_ranked", "popular"]),
+]
+
+
+def applied_versions(cursor):
+    cursor.execute(VERSION_TABLE_SQL)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def pending_migrations(cursor, target=None):
+    applied = applied_versions(cursor)
+    return [migration for migration in MIGRATIONS
+            if migration[0] not in applied and (target is None or migration[0] <= target)]
+
+
+def apply_migration(cnx, cursor, migration):
+    """Runs one migration's steps and records its version. Returns the step messages."""
+    version, name, steps, _ = migration
+    start = time.perf_counter()
+    messages = [step(cnx, cursor) for step in steps]
+    duration_ms = int((time.perf_counter() - start) * 1000)
+    cursor.execute(
+        "INSERT INTO schema_migrations (version, name, duration_ms) VALUES (%s, %s, %s)",
+        (version, name, duration_ms),
+    )
+    cnx.commit()
+    return messages
+
+
+def migrate(cnx, target=None, log=print):
+    """
+    Applies the pending migrations (up to `target`) in order, under a named
+    lock so two runners never race. Returns the versions applied.
+    """
+    cursor = cnx.cursor()
+    try:
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (MIGRATION_LOCK, LOCK_TIMEOUT))
+        if cursor.fetchall()[0][0] != 1:
+            raise RuntimeError("Another migration runner holds the lock")
+        try:
+            done = []
+            for migration in pending_migrations(cursor, target):
+                for message in apply_migration(cnx, cursor, migration):
+                    log(f"  {migration[0]:04d} {migration[1]}: {message}")
+                done.append(migration[0])
+            return done
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK,))
+            cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+# --- Probe Queries ---
+# name -> factory(sample) returning (sql, params); `sample` holds the ids
+# picked by pick_sample(). These are the statements the endpoints run.
+
+def _genre_page_query(genre_id):
+    # Same shape as /api/movies?genre=... (first page)
+    sql = f"""
+        SELECT m.movie_id, m.title, m.release_year, {AVERAGE_RATING_SQL} AS average_rating
+        FROM movies m
+        LEFT JOIN movie_rating_stats s ON m.movie_id = s.movie_id
+        JOIN movie_genres mg ON m.movie_id = mg.movie_id
+        WHERE mg.genre_id = %s
+        ORDER BY m.title ASC, m.movie_id ASC LIMIT %s
+    """
+    return sql, (genre_id, 21)
+
+
+def _popular_scan_query():
+    # /api/recommendations/popular before movie_popularity: C and the ranking
+    # computed over movie_rating_stats on every request
+    sql = """
+        SELECT
+            m.movie_id, m.title, m.release_year,
+            s.rating_count AS v, s.rating_sum / s.rating_count AS R,
+            ( (s.rating_count / (s.rating_count + %s)) * (s.rating_sum / s.rating_count) + ( %s / (s.rating_count + %s)) * g.C ) AS weighted_rating
+        FROM movie_rating_stats s
+        JOIN movies m ON m.movie_id = s.movie_id
+        CROSS JOIN (
+            SELECT COALESCE(SUM(rating_sum) / NULLIF(SUM(rating_count), 0), 3.0) AS C
+            FROM movie_rating_stats
+        ) g
+        WHERE s.rating_count >= %s
+        ORDER BY weighted_rating DESC
+        LIMIT 10
+    """
+    m = queries.POPULAR_MIN_RATINGS
+    return sql, (m, m, m, m)
+
+
+def _trending_scan_query():
+    # /api/recommendations/trending computed straight from ratings.created_at
+    # (what the buckets replace): the week's new ratings, decayed per rating
+    sql = """
+        SELECT m.movie_id, m.title, m.release_year, t.trend_score
+        FROM (
+            SELECT movie_id,
+                   SUM(POW(0.5, TIMESTAMPDIFF(SECOND, created_at, NOW()) / 3600 / 48)) AS trend_score
+            FROM ratings
+            WHERE created_at >= NOW() - INTERVAL 7 DAY
+            GROUP BY movie_id
+            ORDER BY trend_score DESC, movie_id
+            LIMIT 10
+        ) t
+        JOIN movies m ON m.movie_id = t.movie_id
+        ORDER BY t.trend_score DESC, t.movie_id
+    """
+    return sql, ()
+
+
+def _genre_ranked_query(genre_id):
+    # /api/movies?genre=... once genre_movie_rankings exists
+    from genre_rankings import genre_page_query
+
+    return genre_page_query(genre_id, "title", limit=21)
+
+
+PROBES = {
+    "movie_detail": lambda s: queries.movie_details_query(s["movie_id"], s["user_id"]),
+    "movies_genre": lambda s: _genre_page_query(s["genre_id"]),
+    "movies_genre_ranked": lambda s: _genre_ranked_query(s["genre_id"]),
+    "popular": lambda s: queries.popular_movies_query(),
+    "popular_scan": lambda s: _popular_scan_query(),
+    "trending": lambda s: trending_query("7d"),
+    "trending_scan": lambda s: _trending_scan_query(),
+    "personal_collaborative": lambda s: queries.personal_collaborative_query(s["user_id"]),
+    "user_liked_movies": lambda s: (
+        "SELECT movie_id FROM ratings WHERE user_id = %s AND rating >= %s", (s["user_id"], MIN_RATING)),
+    "movie_rating_aggregate": lambda s: (
+        "SELECT COUNT(*), SUM(rating), SUM(rating * rating) FROM ratings WHERE movie_id = %s", (s["movie_id"],)),
+    "similar_users_exact": lambda s: ("""
+        SELECT r.user_id, COUNT(r.movie_id) AS shared_likes
+        FROM ratings r
+        WHERE r.movie_id IN (SELECT movie_id FROM ratings WHERE user_id = %s AND rating >= %s)
+          AND r.user_id != %s AND r.rating >= %s
+        GROUP BY r.user_id
+        ORDER BY shared_likes DESC, r.user_id
+        LIMIT 50
+    """, (s["user_id"], MIN_RATING, s["user_id"], MIN_RATING)),
+}
+
+
+# Probes whose statement is new in their migration: "before" runs the
+# statement the endpoint used until then
+REPLACED_PROBES = {"movies_genre_ranked": "movies_genre", "popular": "popular_scan",
+                   "trending": "trending_scan"}
+
+
+def pick_sample(cursor):
+    """The heaviest ids (most-rated movie, most active user, biggest genre), where indexes matter most."""
+    sample = {}
+    for key, sql in (
+        ("movie_id", "SELECT movie_id FROM ratings GROUP BY movie_id ORDER BY COUNT(*) DESC LIMIT 1"),
+        ("user_id", "SELECT user_id FROM ratings GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1"),
+        ("genre_id", "SELECT genre_id FROM movie_genres GROUP BY genre_id ORDER BY COUNT(*) DESC LIMIT 1"),
+    ):
+        cursor.execute(sql)
+        rows = cursor.fetchall()
+        sample[key] = rows[0][0] if rows else 1
+    return sample
+
+
+def explain(cursor, sql, params):
+    """EXPLAIN rows reduced to what changes with an index: access type, key, row estimate, extras."""
+    cursor.execute("EXPLAIN " + sql.strip().rstrip(";"), params)
+    columns = [column[0] for column in cursor.description]
+    plan = []
+    for row in cursor.fetchall():
+        row = dict(zip(columns, row))
+        plan.append({key: row.get(key) for key in ("table", "type", "key", "rows", "Extra")})
+    return plan
+
+
+def measure(cursor, sql, params, repeat=PROBE_REPEAT):
+    """Median and worst latency in ms over `repeat` runs (after one warm-up)."""
+    timings = []
+    for i in range(repeat + 1):
+        start = time.perf_counter()
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        if i:
+            timings.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": round(statistics.median(timings), 3), "max_ms": round(max(timings), 3)}
+
+
+def probe(cursor, names, sample, repeat=PROBE_REPEAT, before=False):
+    """{probe name: {"plan": [...], "median_ms", "max_ms"}} for the given probes."""
+    results = {}
+    for name in names:
+        sql, params = PROBES[REPLACED_PROBES.get(name, name) if before else name](sample)
+        results[name] = {"plan": explain(cursor, sql, params), **measure(cursor, sql, params, repeat)}
+    return results
+
+
+def probes_for(migrations):
+    names = []
+    for _, _, _, probe_names in migrations:
+        names += [name for name in probe_names if name not in names]
+    return names
+
+
+def format_plan(plan):
+    return "; ".join(f"{step['table']}:{step['type']}/{step['key'] or '-'}"
+                     f"/{step['rows']}{' ' + step['Extra'] if step['Extra'] else ''}" for step in plan)
+
+
+def print_report(before, after):
+    for name in before:
+        b, a = before[name], after[name]
+        speedup = b["median_ms"] / a["median_ms"] if a["median_ms"] else float("inf")
+        print(f"\n{name}: {b['median_ms']:.2f} ms -> {a['median_ms']:.2f} ms median ({speedup:.1f}x), "
+              f"max {b['max_ms']:.2f} -> {a['max_ms']:.2f} ms")
+        print(f"  before: {format_plan(b['plan'])}")
+        print(f"  after:  {format_plan(a['plan'])}")
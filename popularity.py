@@ -0,0 +1,210 @@
+"""
+Incrementally maintained leaderboard behind /api/recommendations/popular.
+
+movie_popularity holds every movie with at least POPULAR_MIN_RATINGS ratings
+and its IMDb-style weighted rating (see genre_rankings.WEIGHTED_RATING_SQL),
+indexed by (weighted_rating DESC, movie_id). Any page of the top
+POPULAR_MAX_RANK is therefore a short index read, with no aggregation and no
+sort at request time.
+
+Rating writes re-score only the movies they touch, in the same transaction,
+against the prior mean C frozen in rating_priors. Between full recomputes C
+is held still, so the relative order of untouched movies never changes under
+the reader. recompute_popularity() takes the live global mean from the
+running totals in rating_totals, re-scores every row and drops movies that
+fell below the threshold. The app runs it from one worker (whichever gets
+the named lock) every POPULAR_RECOMPUTE_SECONDS, which bounds the drift.
+
+The recompute never locks what rating writes lock. It fills a shadow table,
+movie_popularity_next, in committed batches of RECOMPUTE_BATCH movies read
+without locks, publishes the new prior, copies in the movies rated since it
+started, and swaps the shadow in with one RENAME TABLE. A rating committed
+in the moment between that last catch-up and the swap is re-scored on the
+movie's next rating or the next recompute.
+"""
+from genre_rankings import WEIGHTED_RATING_SQL
+from queries import POPULAR_MIN_RATINGS
+from rating_stats import GLOBAL_MEAN_SQL, rebuild_rating_totals
+
+PRIOR_NAME = "popular"
+POPULAR_MAX_RANK = 1000          # deepest rank reachable with limit/offset
+RECOMPUTE_LOCK = "movie_rec_db.movie_popularity"
+RECOMPUTE_LOCK_WAIT = 60         # seconds manage.py & co. wait for a running recompute
+RECOMPUTE_BATCH = 5000           # movies scored per shadow-table transaction
+CATCH_UP_OVERLAP_SECONDS = 60    # last_rated_at is the rating transaction's start time
+SWAP_LOCK_WAIT_SECONDS = 5       # give up the swap rather than queue readers behind it
+CACHE_TAG = "popularity"         # response cache tag of the leaderboard pages
+
+SHADOW_TABLE = "movie_popularity_next"
+OLD_TABLE = "movie_popularity_old"
+
+
+def parse_popular_window(args, default_limit=10):
+    """(limit, offset) from request args; raises ValueError outside the top POPULAR_MAX_RANK."""
+    try:
+        limit = int(args.get('limit', default_limit))
+        offset = int(args.get('offset', 0))
+    except ValueError:
+        raise ValueError("limit and offset must be integers")
+    if limit < 1 or offset < 0 or offset + limit > POPULAR_MAX_RANK:
+        raise ValueError(f"limit must be >= 1, offset >= 0 and limit + offset <= {POPULAR_MAX_RANK}")
+    return limit, offset
+
+
+def refresh_popularity(cursor, movie_ids):
+    """
+    Re-scores the touched movies (call after movie_rating_stats is updated).
+    Returns True if any of them is, or was, inside the top POPULAR_MAX_RANK,
+    i.e. whether a cached /api/recommendations/popular page may have changed.
+    """
+    movie_ids = sorted(set(movie_ids))
+    if not movie_ids:
+        return False
+    placeholders = ", ".join(["%s"] * len(movie_ids))
+    cursor.execute(f"""
+        SELECT
+            (SELECT weighted_rating FROM movie_popularity
+             ORDER BY weighted_rating DESC, movie_id LIMIT 1 OFFSET %s),
+            (SELECT MAX(weighted_rating) FROM movie_popularity WHERE movie_id IN ({placeholders}))
+    """, (POPULAR_MAX_RANK - 1, *movie_ids))
+    cutoff, before = cursor.fetchall()[0]
+    cursor.execute(f"""
+        INSERT INTO movie_popularity (movie_id, rating_count, average_rating, weighted_rating)
+        SELECT s.movie_id, s.rating_count, s.rating_sum / s.rating_count, {WEIGHTED_RATING_SQL}
+        FROM movie_rating_stats s
+        JOIN rating_priors p ON p.name = %s
+        WHERE s.movie_id IN ({placeholders}) AND s.rating_count >= %s
+        ON DUPLICATE KEY UPDATE
+            rating_count = VALUES(rating_count),
+            average_rating = VALUES(average_rating),
+            weighted_rating = VALUES(weighted_rating);
+    """, (PRIOR_NAME, *movie_ids, POPULAR_MIN_RATINGS))
+    if cutoff is None:
+        return True         # fewer than POPULAR_MAX_RANK movies ranked: every one is shown
+    cursor.execute(f"SELECT MAX(weighted_rating) FROM movie_popularity WHERE movie_id IN ({placeholders})",
+                   movie_ids)
+    after = cursor.fetchall()[0][0]
+    return any(score is not None and score >= cutoff for score in (before, after))
+
+
+def _scored_rows(cursor, prior_mean, where, params, limit=None):
+    """(movie_id, rating_count, average_rating, weighted_rating) rows of movie_rating_stats, read without locks."""
+    cursor.execute(f"""
+        SELECT s.movie_id, s.rating_count, s.rating_sum / NULLIF(s.rating_count, 0), {WEIGHTED_RATING_SQL}
+        FROM movie_rating_stats s
+        CROSS JOIN (SELECT %s AS prior_mean) p
+        WHERE {where}
+        ORDER BY s.movie_id
+        {f"LIMIT {int(limit)}" if limit else ""}
+    """, (prior_mean, *params))
+    return cursor.fetchall()
+
+
+def _insert_shadow(cursor, rows):
+    cursor.executemany(f"""
+        INSERT INTO {SHADOW_TABLE} (movie_id, rating_count, average_rating, weighted_rating)
+        VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            rating_count = VALUES(rating_count),
+            average_rating = VALUES(average_rating),
+            weighted_rating = VALUES(weighted_rating);
+    """, rows)
+
+
+def recompute_popularity(cnx, cursor, reconcile_totals=False):
+    """
+    Re-estimates C from rating_totals (optionally rebuilding those from
+    movie_rating_stats first) and rebuilds movie_popularity through the
+    shadow table. Commits as it goes. Returns the number of ranked movies.
+    """
+    cursor.execute("SELECT GET_LOCK(%s, %s)", (RECOMPUTE_LOCK, RECOMPUTE_LOCK_WAIT))
+    if cursor.fetchall()[0][0] != 1:
+        raise RuntimeError("Another popularity recompute holds the lock")
+    try:
+        if reconcile_totals:
+            rebuild_rating_totals(cursor)
+            cnx.commit()
+        cursor.execute(f"SELECT ({GLOBAL_MEAN_SQL}), NOW()")
+        prior_mean, started = cursor.fetchall()[0]
+        cnx.commit()
+
+        cursor.execute(f"DROP TABLE IF EXISTS {SHADOW_TABLE}")
+        cursor.execute(f"CREATE TABLE {SHADOW_TABLE} LIKE movie_popularity")
+        # LIKE copies the indexes but not the foreign key
+        cursor.execute(f"ALTER TABLE {SHADOW_TABLE} ADD FOREIGN KEY (movie_id) "
+                       "REFERENCES movies(movie_id) ON DELETE CASCADE")
+
+        last_id = -1
+        while True:
+            rows = _scored_rows(cursor, prior_mean, "s.movie_id > %s AND s.rating_count >= %s",
+                                (last_id, POPULAR_MIN_RATINGS), RECOMPUTE_BATCH)
+            if not rows:
+                break
+            _insert_shadow(cursor, rows)
+            cnx.commit()
+            last_id = rows[-1][0]
+
+        # From here on rating writes score the live table with the new C
+        cursor.execute("""
+            INSERT INTO rating_priors (name, prior_mean, computed_at) VALUES (%s, %s, NOW())
+            ON DUPLICATE KEY UPDATE prior_mean = VALUES(prior_mean), computed_at = VALUES(computed_at);
+        """, (PRIOR_NAME, prior_mean))
+        cnx.commit()
+
+        # Movies rated while the shadow was filled
+        rows = _scored_rows(cursor, prior_mean, "s.last_rated_at >= %s - INTERVAL %s SECOND",
+                            (started, CATCH_UP_OVERLAP_SECONDS))
+        ranked_rows = [row for row in rows if row[1] >= POPULAR_MIN_RATINGS]
+        if ranked_rows:
+            _insert_shadow(cursor, ranked_rows)
+        dropped = [row[0] for row in rows if row[1] < POPULAR_MIN_RATINGS]
+        if dropped:
+            cursor.execute(f"DELETE FROM {SHADOW_TABLE} WHERE movie_id IN ({', '.join(['%s'] * len(dropped))})",
+                           dropped)
+        cnx.commit()
+
+        cursor.execute("SELECT @@SESSION.lock_wait_timeout")
+        lock_wait = cursor.fetchall()[0][0]
+        cursor.execute("SET SESSION lock_wait_timeout = %s", (SWAP_LOCK_WAIT_SECONDS,))
+        try:
+            cursor.execute(f"DROP TABLE IF EXISTS {OLD_TABLE}")
+            cursor.execute(f"RENAME TABLE movie_popularity TO {OLD_TABLE}, {SHADOW_TABLE} TO movie_popularity")
+        finally:
+            cursor.execute("SET SESSION lock_wait_timeout = %s", (lock_wait,))
+        cursor.execute(f"DROP TABLE {OLD_TABLE}")
+
+        cursor.execute("SELECT COUNT(*) FROM movie_popularity")
+        ranked = cursor.fetchall()[0][0]
+        cnx.commit()
+        return ranked
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (RECOMPUTE_LOCK,))
+        cursor.fetchall()
+
+
+def recompute_popularity_if_due(cnx, max_age_seconds):
+    """
+    Recomputes and commits if the leaderboard is older than max_age_seconds,
+    unless another process is already doing it. Returns the ranked movie
+    count, or None if nothing was done.
+    """
+    cursor = cnx.cursor()
+    try:
+        cursor.execute("SELECT GET_LOCK(%s, 0)", (RECOMPUTE_LOCK,))
+        if cursor.fetchall()[0][0] != 1:
+            return None
+        try:
+            cursor.execute(
+                "SELECT TIMESTAMPDIFF(SECOND, computed_at, NOW()) FROM rating_priors WHERE name = %s",
+                (PRIOR_NAME,)
+            )
+            rows = cursor.fetchall()
+            if rows and rows[0][0] < max_age_seconds:
+                return None
+            cnx.commit()
+            return recompute_popularity(cnx, cursor)
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (RECOMPUTE_LOCK,))
+            cursor.fetchall()
+    finally:
+        cursor.close()
@@ -0,0 +1,281 @@
+"""
+SQL for the read endpoints, shared by the Flask app (app.py) and the
+async app (asgi_app.py) so both serving modes run identical statements.
+
+Each *_query() function returns a (sql, params) pair ready for
+cursor.execute(). Both mysql.connector and aiomysql use %s placeholders.
+"""
+from rating_stats import AVERAGE_RATING_SQL
+
+MIN_RATING = 4                # a rating >= this counts as a "like"
+POPULAR_MIN_RATINGS = 5       # m in the IMDb weighted rating
+SIMILARITY_THRESHOLD = 3      # shared likes needed to count as a similar user
+
+
+def genres_query():
+    return "SELECT genre_id, name FROM genres ORDER BY name ASC", ()
+
+
+# --- Movie Details ---
+
+# The whole detail payload is assembled by MySQL as one JSON document, so a
+# detail page costs a single round trip and the text is sent to the client
+# as-is (no fetch -> dict -> json.dumps copy). Takes (user_id, user_id) params.
+# JSON_ARRAYAGG does not promise element order, so the reviews are put back
+# in created_at order by app.movie_details_text().
+MOVIE_DETAILS_JSON_SQL = f"""
+    JSON_OBJECT(
+        'movie_id', m.movie_id,
+        'title', m.title,
+        'release_year', m.release_year,
+        'synopsis', m.synopsis,
+        'duration_min', m.duration_min,
+        'average_rating', {AVERAGE_RATING_SQL},
+        'total_ratings', COALESCE(s.rating_count, 0),
+        'actors', COALESCE((
+            SELECT JSON_ARRAYAGG(JSON_OBJECT('name', CONCAT(a.first_name, ' ', a.last_name), 'role', ma.role_name))
+            FROM movie_actors ma
+            JOIN actors a ON a.actor_id = ma.actor_id
+            WHERE ma.movie_id = m.movie_id
+        ), JSON_ARRAY()),
+        'directors', COALESCE((
+            SELECT JSON_ARRAYAGG(JSON_OBJECT('name', CONCAT(d.first_name, ' ', d.last_name)))
+            FROM movie_directors md
+            JOIN directors d ON d.director_id = md.director_id
+            WHERE md.movie_id = m.movie_id
+        ), JSON_ARRAY()),
+        'reviews', COALESCE((
+            SELECT JSON_ARRAYAGG(JSON_OBJECT(
+                'review_id', rv.review_id,
+                'review_text', rv.review_text,
+                'created_at', DATE_FORMAT(rv.created_at, '%%Y-%%m-%%dT%%T'),
+                'username', rv.username
+            ))
+            FROM (
+                SELECT r.review_id, r.review_text, r.created_at, u.username
+                FROM reviews r
+                JOIN users u ON r.user_id = u.user_id
+                WHERE r.movie_id = m.movie_id
+                ORDER BY r.created_at DESC
+                LIMIT 10
+            ) rv
+        ), JSON_ARRAY()),
+        'user_rating', COALESCE((
+            SELECT ur.rating FROM ratings ur
+            WHERE ur.movie_id = m.movie_id AND ur.user_id = %s
+        ), 0),
+        'on_watchlist', IF(EXISTS(
+            SELECT 1
+            FROM watchlist_items wi
+            JOIN watchlists w ON wi.watchlist_id = w.watchlist_id
+            WHERE wi.movie_id = m.movie_id AND w.user_id = %s
+        ), CAST('true' AS JSON), CAST('false' AS JSON))
+    )
+"""
+
+
+def movie_details_query(movie_id, user_id=None):
+    sql = f"""
+        SELECT {MOVIE_DETAILS_JSON_SQL}
+        FROM movies m
+        LEFT JOIN movie_rating_stats s ON m.movie_id = s.movie_id
+        WHERE m.movie_id = %s;
+    """
+    return sql, (user_id, user_id, movie_id)
+
+
+def movie_details_batch_query(movie_ids, user_id=None):
+    placeholders = ", ".join(["%s"] * len(movie_ids))
+    sql = f"""
+        SELECT {MOVIE_DETAILS_JSON_SQL}
+        FROM movies m
+        LEFT JOIN movie_rating_stats s ON m.movie_id = s.movie_id
+        WHERE m.movie_id IN ({placeholders})
+        ORDER BY FIELD(m.movie_id, {placeholders});
+    """
+    return sql, (user_id, user_id, *movie_ids, *movie_ids)
+
+
+def movies_by_ids_query(movie_ids):
+    """Summary rows for a ranked list of movie ids, keeping their order."""
+    placeholders = ", ".join(["%s"] * len(movie_ids))
+    sql = f"""
+        SELECT m.movie_id, m.title, m.release_year, {AVERAGE_RATING_SQL} AS average_rating
+        FROM movies m
+        LEFT JOIN movie_rating_stats s ON m.movie_id = s.movie_id
+        WHERE m.movie_id IN ({placeholders})
+        ORDER BY FIELD(m.movie_id, {placeholders});
+    """
+    return sql, (*movie_ids, *movie_ids)
+
+
+# --- Recommendations ---
+
+def popular_movies_query(limit=10, offset=0):
+    """
+    IMDb-style weighted rating, read from the movie_popularity leaderboard
+    (see popularity.py): an index range read, no aggregation.
+    """
+    sql = """
+        SELECT
+            m.movie_id, m.title, m.release_year,
+            p.rating_count AS v, p.average_rating AS R, p.weighted_rating
+        FROM movie_popularity p
+        JOIN movies m ON m.movie_id = p.movie_id
+        ORDER BY p.weighted_rating DESC, p.movie_id ASC
+        LIMIT %s OFFSET %s;
+    """
+    return sql, (limit, offset)
+
+
+def collaborative_recommendations_query(movie_id):
+    # Neighbours are precomputed by `manage.py build-cooccurrence`,
+    # so this is a primary-key range read on movie_similar_movies.
+    sql = f"""
+        SELECT
+            m.movie_id, m.title, m.release_year,
+            {AVERAGE_RATING_SQL} AS average_rating,
+            sm.co_likes AS similar_user_likes,
+            sm.similarity
+        FROM movie_similar_movies sm
+        JOIN movies m ON m.movie_id = sm.similar_movie_id
+        LEFT JOIN movie_rating_stats s ON m.movie_id = s.movie_id
+        WHERE sm.movie_id = %s
+        ORDER BY sm.rank_pos ASC
+        LIMIT 10;
+    """
+    return sql, (movie_id,)
+
+
+def synopsis_recommendations_query(movie_id):
+    # Precomputed by `manage.py build-synopsis-index` (see synopsis_index.py)
+    sql = f"""
+        SELECT
+            m.movie_id, m.title, m.release_year,
+            {AVERAGE_RATING_SQL} AS average_rating,
+            sn.similarity
+        FROM movie_synopsis_neighbors sn
+        JOIN movies m ON m.movie_id = sn.similar_movie_id
+        LEFT JOIN movie_rating_stats s ON m.movie_id = s.movie_id
+        WHERE sn.movie_id = %s
+        ORDER BY sn.rank_pos ASC
+        LIMIT 10;
+    """
+    return sql, (movie_id,)
+
+
+PROFILE_TOP_GENRES = 5        # strongest genres taken from a user's taste profile
+PROFILE_TOP_DIRECTORS = 10    # strongest directors taken from a user's taste profile
+PROFILE_GENRE_CANDIDATES = 500  # best-ranked movies taken from each of those genres
+
+
+def personal_content_query(user_id):
+    """
+    Ranks candidates against the user's taste profile (see taste_profiles.py):
+    the best-ranked movies of their top genres (genre_movie_rankings) plus the
+    movies of their top directors, scored by the summed weight of the features
+    they share.
+    Only bounded index reads, so the cost doesn't grow with rating history.
+    """
+    sql = f"""
+        WITH Profile AS (
+            (SELECT feature_kind, feature_id, weight FROM user_taste_profiles
+             WHERE user_id = %s AND feature_kind = 'genre' AND weight > 0
+             ORDER BY weight DESC LIMIT %s)
+            UNION ALL
+            (SELECT feature_kind, feature_id, weight FROM user_taste_profiles
+             WHERE user_id = %s AND feature_kind = 'director' AND weight > 0
+             ORDER BY weight DESC LIMIT %s)
+        ),
+        Candidates AS (
+            SELECT gc.movie_id
+            FROM Profile p, LATERAL (
+                SELECT r.movie_id FROM genre_movie_rankings r
+                WHERE r.genre_id = p.feature_id
+                ORDER BY r.weighted_rating DESC, r.movie_id
+                LIMIT {PROFILE_GENRE_CANDIDATES}
+            ) gc
+            WHERE p.feature_kind = 'genre'
+            UNION
+            SELECT md.movie_id FROM Profile p
+            JOIN movie_directors md ON p.feature_kind = 'director' AND md.director_id = p.feature_id
+        ),
+        Scored AS (
+            SELECT
+                c.movie_id,
+                (SELECT COUNT(*) FROM movie_genres mg
+                 JOIN Profile p ON p.feature_kind = 'genre' AND p.feature_id = mg.genre_id
+                 WHERE mg.movie_id = c.movie_id) AS genre_matches,
+                COALESCE((SELECT SUM(p.weight) FROM movie_genres mg
+                          JOIN Profile p ON p.feature_kind = 'genre' AND p.feature_id = mg.genre_id
+                          WHERE mg.movie_id = c.movie_id), 0)
+                + COALESCE((SELECT SUM(p.weight) FROM movie_directors md
+                            JOIN Profile p ON p.feature_kind = 'director' AND p.feature_id = md.director_id
+                            WHERE md.movie_id = c.movie_id), 0) AS affinity
+            FROM Candidates c
+            WHERE NOT EXISTS (SELECT 1 FROM ratings r WHERE r.user_id = %s AND r.movie_id = c.movie_id)
+        )
+        SELECT
+            m.movie_id,
+            m.title,
+            m.release_year,
+            sc.genre_matches,
+            sc.affinity,
+            {AVERAGE_RATING_SQL} AS average_rating
+        FROM Scored sc
+        JOIN movies m ON m.movie_id = sc.movie_id
+        LEFT JOIN movie_rating_stats s ON m.movie_id = s.movie_id
+        ORDER BY
+            sc.affinity DESC,
+            average_rating DESC,
+            m.movie_id
+        LIMIT 10;
+    """
+    return sql, (user_id, PROFILE_TOP_GENRES, user_id, PROFILE_TOP_DIRECTORS, user_id)
+
+
+def personal_collaborative_query(user_id):
+    # Similar users come from user_neighbors (MinHash/LSH, see user_neighbors.py),
+    # so only the neighbours' likes are aggregated instead of self-joining ratings.
+    sql = f"""
+        WITH TargetUserRatings AS (
+            SELECT movie_id FROM ratings WHERE user_id = %s AND rating >= %s
+        ),
+        SimilarUsers AS (
+            SELECT neighbor_id AS user_id FROM user_neighbors WHERE user_id = %s
+        ),
+        RecommendedMovies AS (
+            SELECT
+                r.movie_id,
+                COUNT(DISTINCT r.user_id) AS similar_user_likes
+            FROM ratings r
+            WHERE
+                r.user_id IN (SELECT user_id FROM SimilarUsers)
+                AND r.rating >= %s
+                AND r.movie_id NOT IN (SELECT movie_id FROM TargetUserRatings)
+            GROUP BY r.movie_id
+        )
+        SELECT
+            m.movie_id,
+            m.title,
+            m.release_year,
+            rm.similar_user_likes,
+            {AVERAGE_RATING_SQL} AS average_rating
+        FROM RecommendedMovies rm
+        JOIN movies m ON rm.movie_id = m.movie_id
+        LEFT JOIN movie_rating_stats s ON m.movie_id = s.movie_id
+        ORDER BY
+            rm.similar_user_likes DESC,
+            average_rating DESC
+        LIMIT 10;
+    """
+    return sql, (user_id, MIN_RATING, user_id, MIN_RATING)
+
+
+def recommendation_rails(user_id=None):
+    """The independent rails shown on the home page: name -> (sql, params)."""
+    rails = {"popular": popular_movies_query()}
+    if user_id:
+        rails["personal_content"] = personal_content_query(user_id)
+        rails["personal_collaborative"] = personal_collaborative_query(user_id)
+    return rails
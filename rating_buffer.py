@@ -0,0 +1,356 @@
+"""
+Optional write-behind buffer for /api/rate (RATING_WRITE_BEHIND=on).
+
+Validated ratings are appended to a local spill file and an in-process
+queue, and acknowledged right away. A background flusher wakes when
+RATING_FLUSH_ROWS ratings are queued or RATING_FLUSH_INTERVAL seconds have
+passed. It keeps only the last rating per (user_id, movie_id) and hands the
+batch to the app's write function, which stores it with multi-row upserts
+in a few transactions (group commit) instead of one fsync per rating.
+
+Durability: each accepted rating is written to the spill file before the
+request is acknowledged, so it survives a worker crash; the file is
+fsync'ed every RATING_SPILL_FSYNC_INTERVAL seconds (0 = on every rating),
+which bounds what a power loss can take. On every flush the active file is
+rotated into a segment, and segments are deleted only once their ratings
+are committed.
+
+Spill files are named after the buffer instance (pid plus a random token),
+never just the pid, and each instance holds an flock on its
+ratings-<instance>.lock file while it runs. At startup a buffer replays
+every spill file whose instance lock is free or gone: the kernel drops the
+lock when a worker dies, so a restarted worker that got the same pid still
+recovers its predecessor's ratings. Replaying a rating that was already
+stored is harmless: the upsert and the stats deltas are idempotent for an
+unchanged rating.
+
+Failed flushes are retried with backoff, RATING_FLUSH_MAX_RETRIES times.
+After that the batch's segments are renamed to dead-<...>.segment and
+counted in rows_dead_lettered; renaming such a file back to
+ratings-<anything>.segment has the next worker to start replay it.
+
+Backpressure: at most RATING_BUFFER_MAX ratings are queued. submit() waits
+up to RATING_BUFFER_BLOCK_SECONDS for space, then raises BufferFullError so
+the endpoint can answer 503.
+
+Reads see a rating once it is flushed, i.e. after at most about
+RATING_FLUSH_INTERVAL seconds.
+"""
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from sql_metrics import Histogram, LATENCY_BUCKETS, register
+
+RATING_WRITE_BEHIND = os.getenv("RATING_WRITE_BEHIND", "off") == "on"
+RATING_BUFFER_MAX = int(os.getenv("RATING_BUFFER_MAX", 50000))
+RATING_BUFFER_BLOCK_SECONDS = float(os.getenv("RATING_BUFFER_BLOCK_SECONDS", 0.5))
+RATING_FLUSH_ROWS = int(os.getenv("RATING_FLUSH_ROWS", 2000))
+RATING_FLUSH_INTERVAL = float(os.getenv("RATING_FLUSH_INTERVAL", 0.5))
+RATING_SPILL_DIR = os.getenv("RATING_SPILL_DIR", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "spill"))
+RATING_SPILL_FSYNC_INTERVAL = float(os.getenv("RATING_SPILL_FSYNC_INTERVAL", 0.05))
+RATING_FLUSH_MAX_RETRIES = int(os.getenv("RATING_FLUSH_MAX_RETRIES", 8))
+RETRY_DELAY_SECONDS = 1.0           # doubled on every consecutive failure
+RETRY_MAX_DELAY_SECONDS = 60.0
+
+logger = logging.getLogger(__name__)
+
+FLUSH_ROWS = Histogram("rating_buffer_flush_rows", "Distinct ratings written per flush.", (),
+                       (1, 10, 100, 500, 1000, 2000, 5000, 10000, 50000))
+FLUSH_SECONDS = Histogram("rating_buffer_flush_duration_seconds", "Time to write one flush.", (), LATENCY_BUCKETS)
+FLUSH_LAG = Histogram("rating_buffer_lag_seconds", "Age of the oldest rating in a flush when it was committed.",
+                      (), LATENCY_BUCKETS)
+for _metric in (FLUSH_ROWS, FLUSH_SECONDS, FLUSH_LAG):
+    register(_metric)
+
+
+class BufferFullError(Exception):
+    """Raised when the queue stayed full for RATING_BUFFER_BLOCK_SECONDS."""
+
+
+class RatingBuffer:
+    """
+    Per-worker write-behind queue. `write_rows(rows)` is called from the
+    flusher thread with sorted, de-duplicated (user_id, movie_id, rating)
+    rows; it must commit them and return how many it had to drop (e.g.
+    unknown ids), or raise to have the batch retried (and eventually
+    dead-lettered).
+    """
+
+    def __init__(self, write_rows, spill_dir=RATING_SPILL_DIR, max_rows=RATING_BUFFER_MAX,
+                 flush_rows=RATING_FLUSH_ROWS, flush_interval=RATING_FLUSH_INTERVAL):
+        self.write_rows = write_rows
+        self.spill_dir = spill_dir
+        self.max_rows = max_rows
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Condition()
+        self._queue = []               # (user_id, movie_id, rating, accepted_at)
+        self._segments = []            # spill segments holding the queued ratings
+        self._segment_seq = 0
+        self._spill = None
+        self._last_fsync = 0.0
+        self._stopping = False
+        self._failed_attempts = 0      # consecutive failed flushes
+        self._instance = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+
+        self._stats = {
+            "accepted": 0,
+            "rejected": 0,
+            "flushes": 0,
+            "flush_failures": 0,
+            "rows_flushed": 0,
+            "rows_merged": 0,
+            "rows_dropped": 0,
+            "rows_replayed": 0,
+            "rows_dead_lettered": 0,
+            "last_flush_rows": 0,
+            "last_flush_ms": 0.0,
+            "last_lag_ms": 0.0,
+        }
+
+        os.makedirs(spill_dir, exist_ok=True)
+        self._instance_lock = open(self._lock_path(self._instance), "a")
+        fcntl.flock(self._instance_lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._replay_orphans()
+        self._open_spill()
+        self._thread = threading.Thread(target=self._run, name="rating-flusher", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # --- Spill File ---
+
+    def _spill_path(self):
+        return os.path.join(self.spill_dir, f"ratings-{self._instance}.log")
+
+    def _lock_path(self, instance):
+        return os.path.join(self.spill_dir, f"ratings-{instance}.lock")
+
+    def _open_spill(self):
+        self._spill = open(self._spill_path(), "a", encoding="utf-8")
+
+    def _rotate_spill(self):
+        """Turns the active spill file into a segment. Called with the lock held."""
+        if self._spill.tell() == 0:
+            return                      # only re-queued ratings, already in their segments
+        self._spill.flush()
+        os.fsync(self._spill.fileno())
+        self._spill.close()
+        self._segment_seq += 1
+        segment = os.path.join(self.spill_dir, f"ratings-{self._instance}.{self._segment_seq:06d}.segment")
+        os.replace(self._spill_path(), segment)
+        self._segments.append(segment)
+        self._open_spill()
+
+    def _replay_orphans(self):
+        """Queues ratings from spill files of every buffer instance that is not running."""
+        by_owner = {}
+        for path in sorted(glob.glob(os.path.join(self.spill_dir, "ratings-*"))):
+            if path.endswith(".lock"):
+                continue
+            owner = os.path.basename(path)[len("ratings-"):].split(".", 1)[0]
+            if owner != self._instance:
+                by_owner.setdefault(owner, []).append(path)
+
+        for owner, paths in sorted(by_owner.items()):
+            owner_lock = self._claim_owner(owner)
+            if owner_lock is False:
+                continue                    # still running
+            try:
+                for path in paths:
+                    self._replay_file(path)
+                if owner_lock is not None:
+                    os.remove(self._lock_path(owner))
+            finally:
+                if owner_lock is not None:
+                    owner_lock.close()
+        if self._stats["rows_replayed"]:
+            logger.warning("Rating buffer: replaying %d spilled ratings.", self._stats["rows_replayed"])
+
+    def _claim_owner(self, owner):
+        """
+        Locks a dead instance's lock file. Returns the open file (None if the
+        instance left no lock file), or False while that instance is alive.
+        """
+        try:
+            owner_lock = open(self._lock_path(owner), "r")
+        except FileNotFoundError:
+            return None
+        try:
+            fcntl.flock(owner_lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            owner_lock.close()
+            return False
+        return owner_lock
+
+    def _replay_file(self, path):
+        claimed = os.path.join(self.spill_dir, f"ratings-{self._instance}.replay-{os.path.basename(path)}.segment")
+        try:
+            os.rename(path, claimed)        # only one worker wins the rename
+        except OSError:
+            return
+        with open(claimed, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    user_id, movie_id, rating, accepted_at = json.loads(line)
+                except ValueError:
+                    continue                # torn last line of a crashed write
+                self._queue.append((user_id, movie_id, rating, accepted_at))
+                self._stats["rows_replayed"] += 1
+        self._segments.append(claimed)
+
+    # --- Producer ---
+
+    def submit(self, user_id, movie_id, rating):
+        """Durably queues one validated rating. Raises BufferFullError under sustained overload."""
+        deadline = time.monotonic() + RATING_BUFFER_BLOCK_SECONDS
+        with self._lock:
+            while len(self._queue) >= self.max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["rejected"] += 1
+                    raise BufferFullError(f"Rating buffer is full ({self.max_rows} ratings queued)")
+                self._lock.notify_all()
+                self._lock.wait(remaining)
+
+            accepted_at = time.time()
+            self._spill.write(json.dumps([user_id, movie_id, rating, accepted_at]) + "\n")
+            self._spill.flush()
+            if time.monotonic() - self._last_fsync >= RATING_SPILL_FSYNC_INTERVAL:
+                os.fsync(self._spill.fileno())
+                self._last_fsync = time.monotonic()
+            self._queue.append((user_id, movie_id, rating, accepted_at))
+            self._stats["accepted"] += 1
+            if len(self._queue) >= self.flush_rows:
+                self._lock.notify_all()
+
+    # --- Flusher ---
+
+    def _take_batch(self):
+        """Swaps out the queue and its spill segments. Called with the lock held."""
+        if self._queue:
+            self._rotate_spill()
+        batch, segments = self._queue, self._segments
+        self._queue, self._segments = [], []
+        self._lock.notify_all()         # wake producers waiting for space
+        return batch, segments
+
+    def _run(self):
+        while True:
+            with self._lock:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._stopping and len(self._queue) < self.flush_rows:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._lock.wait(remaining)
+                if self._stopping:
+                    return
+                batch, segments = self._take_batch()
+            if batch:
+                self._flush(batch, segments)
+
+    def _flush(self, batch, segments):
+        """
+        Writes one batch; on failure puts it back in front of newer ratings,
+        or dead-letters it after RATING_FLUSH_MAX_RETRIES failures in a row.
+        """
+        merged = {}
+        for user_id, movie_id, rating, _ in batch:
+            merged[(user_id, movie_id)] = rating
+        rows = sorted((user_id, movie_id, rating) for (user_id, movie_id), rating in merged.items())
+        oldest = min(accepted_at for _, _, _, accepted_at in batch)
+
+        start = time.perf_counter()
+        try:
+            dropped = self.write_rows(rows)
+        except Exception:
+            self._failed_attempts += 1
+            with self._lock:
+                self._stats["flush_failures"] += 1
+            if self._failed_attempts > RATING_FLUSH_MAX_RETRIES:
+                self._dead_letter(batch, segments)
+                return
+            logger.exception("Rating buffer flush of %d ratings failed (attempt %d of %d), retrying",
+                             len(rows), self._failed_attempts, RATING_FLUSH_MAX_RETRIES + 1)
+            with self._lock:
+                self._queue[:0] = batch
+                self._segments[:0] = segments
+            if not self._stopping:
+                time.sleep(min(RETRY_DELAY_SECONDS * 2 ** (self._failed_attempts - 1), RETRY_MAX_DELAY_SECONDS))
+            return
+        self._failed_attempts = 0
+        elapsed = time.perf_counter() - start
+        lag = time.time() - oldest
+
+        for segment in segments:
+            try:
+                os.remove(segment)
+            except OSError:
+                pass
+        FLUSH_ROWS.observe((), len(rows))
+        FLUSH_SECONDS.observe((), elapsed)
+        FLUSH_LAG.observe((), lag)
+        with self._lock:
+            self._stats["flushes"] += 1
+            self._stats["rows_flushed"] += len(rows) - dropped
+            self._stats["rows_merged"] += len(batch) - len(rows)
+            self._stats["rows_dropped"] += dropped
+            self._stats["last_flush_rows"] = len(rows)
+            self._stats["last_flush_ms"] = round(elapsed * 1000, 2)
+            self._stats["last_lag_ms"] = round(lag * 1000, 2)
+
+    def _dead_letter(self, batch, segments):
+        """Moves a batch that keeps failing out of the spill rotation."""
+        self._failed_attempts = 0
+        kept = []
+        for segment in segments:
+            dead = os.path.join(self.spill_dir, "dead-" + os.path.basename(segment)[len("ratings-"):])
+            try:
+                os.replace(segment, dead)
+                kept.append(dead)
+            except OSError:
+                logger.exception("Could not move %s to the dead-letter files", segment)
+        with self._lock:
+            self._stats["rows_dead_lettered"] += len(batch)
+        logger.error("Rating buffer gave up on %d ratings after %d failed flushes; they are kept in %s",
+                     len(batch), RATING_FLUSH_MAX_RETRIES + 1, ", ".join(kept) or "no file")
+
+    def close(self):
+        """Stops the flusher and writes whatever is queued (at process exit)."""
+        with self._lock:
+            if self._stopping:
+                return
+            self._stopping = True
+            self._lock.notify_all()
+        self._thread.join(timeout=5)
+        with self._lock:
+            batch, segments = self._take_batch()
+        if batch:
+            self._flush(batch, segments)
+        with self._lock:
+            self._spill.close()
+            if not self._queue and os.path.getsize(self._spill_path()) == 0:
+                os.remove(self._spill_path())
+            if not self._queue and not self._segments:
+                os.remove(self._lock_path(self._instance))
+            self._instance_lock.close()     # anything left is replayed by the next worker
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["queued"] = len(self._queue)
+            stats["oldest_queued_s"] = round(time.time() - self._queue[0][3], 3) if self._queue else 0.0
+            stats["pending_segments"] = len(self._segments)
+        stats.update(max_rows=self.max_rows, flush_rows=self.flush_rows,
+                     flush_interval_s=self.flush_interval, max_retries=RATING_FLUSH_MAX_RETRIES,
+                     instance=self._instance, pid=os.getpid())
+        return stats
@@ -0,0 +1,156 @@
+"""
+Maintenance of the movie_rating_stats table.
+
+movie_rating_stats keeps a running (count, sum, sum of squares, last_rated_at)
+per movie so read endpoints never have to AVG() over the raw ratings table.
+rating_totals keeps the same running count and sum over all movies, spread
+over TOTAL_SLOTS rows (slot = movie_id % TOTAL_SLOTS) so concurrent rating
+writes don't all queue on one row; the global mean is SUM over the slots.
+The app applies deltas in the same transaction as the rating write, and
+rebuild_rating_stats() reconciles both tables from scratch after bulk loads.
+"""
+
+TOTAL_SLOTS = 16
+
+# SQL snippet for the average rating of a movie joined as `s`
+AVERAGE_RATING_SQL = "COALESCE(s.rating_sum / NULLIF(s.rating_count, 0), 0)"
+
+# The global mean rating, from the running totals (3.0 before any rating)
+GLOBAL_MEAN_SQL = "SELECT COALESCE(SUM(rating_sum) / NULLIF(SUM(rating_count), 0), 3.0) FROM rating_totals"
+
+
+def rating_delta(old_rating, new_rating):
+    """
+    Returns the (count, sum, sum_sq) change caused by replacing old_rating
+    with new_rating. old_rating is None for a brand new rating.
+    """
+    if old_rating is None:
+        return 1, new_rating, new_rating * new_rating
+    return 0, new_rating - old_rating, new_rating * new_rating - old_rating * old_rating
+
+
+def apply_rating_deltas(cursor, changes):
+    """
+    Folds a list of (movie_id, old_rating, new_rating) changes into movie_rating_stats.
+    Changes for the same movie are merged first so each movie is touched once.
+    """
+    merged = {}
+    for movie_id, old_rating, new_rating in changes:
+        movie_id = int(movie_id)
+        d_count, d_sum, d_sq = rating_delta(old_rating, new_rating)
+        count, total, sq = merged.get(movie_id, (0, 0, 0))
+        merged[movie_id] = (count + d_count, total + d_sum, sq + d_sq)
+
+    if not merged:
+        return
+
+    cursor.executemany("""
+        INSERT INTO movie_rating_stats (movie_id, rating_count, rating_sum, rating_sum_sq, last_rated_at)
+        VALUES (%s, %s, %s, %s, NOW())
+        ON DUPLICATE KEY UPDATE
+            rating_count = rating_count + VALUES(rating_count),
+            rating_sum = rating_sum + VALUES(rating_sum),
+            rating_sum_sq = rating_sum_sq + VALUES(rating_sum_sq),
+            last_rated_at = VALUES(last_rated_at);
+    """, [(movie_id, c, s, q) for movie_id, (c, s, q) in sorted(merged.items())])
+
+    # Global totals last and in slot order, so every transaction takes its
+    # locks in the same order (movies ascending, then slots ascending)
+    slots = {}
+    for movie_id, (count, total, _) in merged.items():
+        slot_count, slot_total = slots.get(movie_id % TOTAL_SLOTS, (0, 0))
+        slots[movie_id % TOTAL_SLOTS] = (slot_count + count, slot_total + total)
+    slots = sorted((slot, c, s) for slot, (c, s) in slots.items() if c or s)
+    if slots:
+        cursor.execute(f"""
+            INSERT INTO rating_totals (slot, rating_count, rating_sum)
+            VALUES {", ".join(["(%s, %s, %s)"] * len(slots))}
+            ON DUPLICATE KEY UPDATE
+                rating_count = rating_count + VALUES(rating_count),
+                rating_sum = rating_sum + VALUES(rating_sum);
+        """, [value for row in slots for value in row])
+
+
+def record_rating(cursor, user_id, movie_id, rating):
+    """
+    Inserts or updates one rating and its movie's aggregates.
+    Must run inside the caller's transaction; the caller commits.
+    Returns (status, old_rating) where status is 'created' or 'updated'.
+    """
+    # Lock the existing row (if any) so concurrent updates can't lose a delta
+    cursor.execute(
+        "SELECT rating FROM ratings WHERE user_id = %s AND movie_id = %s FOR UPDATE",
+        (user_id, movie_id)
+    )
+    row = cursor.fetchone()
+    old_rating = None
+    if row:
+        old_rating = row['rating'] if isinstance(row, dict) else row[0]
+
+    cursor.execute("""
+        INSERT INTO ratings (user_id, movie_id, rating)
+        VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE rating = VALUES(rating);
+    """, (user_id, movie_id, rating))
+
+    apply_rating_deltas(cursor, [(movie_id, old_rating, rating)])
+
+    return ("created" if old_rating is None else "updated"), old_rating
+
+
+def record_ratings(cursor, ratings):
+    """
+    Batch version of record_rating() for distinct (user_id, movie_id, rating)
+    rows: one locking read, one multi-row upsert and one stats upsert for
+    the whole batch. Must run inside the caller's transaction; the caller
+    commits. Returns the old rating of every row (None for new ones).
+    """
+    if not ratings:
+        return []
+    pairs = ", ".join(["(%s, %s)"] * len(ratings))
+    cursor.execute(
+        f"SELECT user_id, movie_id, rating FROM ratings WHERE (user_id, movie_id) IN ({pairs}) FOR UPDATE",
+        [value for user_id, movie_id, _ in ratings for value in (user_id, movie_id)]
+    )
+    existing = {}
+    for row in cursor.fetchall():
+        if isinstance(row, dict):
+            row = (row['user_id'], row['movie_id'], row['rating'])
+        existing[(row[0], row[1])] = row[2]
+
+    values = ", ".join(["(%s, %s, %s)"] * len(ratings))
+    cursor.execute(f"""
+        INSERT INTO ratings (user_id, movie_id, rating)
+        VALUES {values}
+        ON DUPLICATE KEY UPDATE rating = VALUES(rating);
+    """, [value for row in ratings for value in row])
+
+    old_ratings = [existing.get((user_id, movie_id)) for user_id, movie_id, _ in ratings]
+    apply_rating_deltas(cursor, [(movie_id, old, rating)
+                                 for (_, movie_id, rating), old in zip(ratings, old_ratings)])
+    return old_ratings
+
+
+def rebuild_rating_stats(cursor):
+    """Recomputes movie_rating_stats and rating_totals from the ratings table. Returns the number of movies."""
+    cursor.execute("DELETE FROM movie_rating_stats")
+    cursor.execute("""
+        INSERT INTO movie_rating_stats (movie_id, rating_count, rating_sum, rating_sum_sq, last_rated_at)
+        SELECT movie_id, COUNT(*), SUM(rating), SUM(rating * rating), MAX(created_at)
+        FROM ratings
+        GROUP BY movie_id;
+    """)
+    movies = cursor.rowcount
+    rebuild_rating_totals(cursor)
+    return movies
+
+
+def rebuild_rating_totals(cursor):
+    """Recomputes rating_totals from movie_rating_stats."""
+    cursor.execute("DELETE FROM rating_totals")
+    cursor.execute("""
+        INSERT INTO rating_totals (slot, rating_count, rating_sum)
+        SELECT movie_id %% %s, SUM(rating_count), SUM(rating_sum)
+        FROM movie_rating_stats
+        GROUP BY movie_id %% %s;
+    """, (TOTAL_SLOTS, TOTAL_SLOTS))
@@ -0,0 +1,279 @@
+"""
+Read-through cache for hot GET endpoints.
+
+Entries are JSON response bodies keyed by endpoint + parameters, with a TTL
+and a set of tags such as "movie:42", "user:7" or "table:genres". Writes
+invalidate tags instead of individual keys: every tag has a version
+counter, each entry remembers the versions it was computed under, and an
+entry whose tag versions have moved on is treated as a miss. Because the
+versions are read *before* the database is queried, a write that lands
+while a response is being computed cannot leave a stale entry behind in
+any cache that sees the invalidation.
+
+Two backends are available:
+- MemoryCache: per-process LRU bounded by entry count and total bytes.
+  Invalidations only reach the worker that made the write; every other
+  worker keeps serving its copy until the TTL runs out.
+- SqliteCache: a file-backed store (put it on /dev/shm) shared by every
+  gunicorn worker on the host, so hits and invalidations are shared too.
+
+Without CACHE_BACKEND, the shared backend is used under a multi-process
+server (gunicorn/uvicorn) and the memory backend otherwise; forcing
+"memory" under such a server logs a warning at startup.
+"""
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+MULTI_PROCESS_SERVER = os.path.basename(sys.argv[0]) in ("gunicorn", "uvicorn")
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "sqlite" if MULTI_PROCESS_SERVER else "memory")  # memory | sqlite | off
+CACHE_PATH = os.getenv("CACHE_PATH", "/dev/shm/movie_rec_cache.sqlite3")
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 10000))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", 64 * 1024 * 1024))
+CACHE_DEFAULT_TTL = float(os.getenv("CACHE_DEFAULT_TTL", 60))
+EVICT_CHECK_EVERY = 50   # SqliteCache: sets between bound checks
+
+
+class _Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values = {"hits": 0, "misses": 0, "stale": 0, "sets": 0, "evictions": 0, "invalidations": 0}
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.values[name] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.values)
+
+
+class MemoryCache:
+    """Per-process LRU cache with TTL and tag versions."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (body, expires_at, {tag: version})
+        self._tag_versions = {}
+        self._bytes = 0
+        self.counters = _Counters()
+
+    def versions(self, tags):
+        with self._lock:
+            return {tag: self._tag_versions.get(tag, 0) for tag in tags}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.counters.incr("misses")
+                return None
+            body, expires_at, versions = entry
+            if expires_at < time.monotonic() or any(
+                    self._tag_versions.get(tag, 0) != version for tag, version in versions.items()):
+                self._drop(key)
+                self.counters.incr("stale")
+                self.counters.incr("misses")
+                return None
+            self._entries.move_to_end(key)
+        self.counters.incr("hits")
+        return body
+
+    def set(self, key, body, ttl, versions):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (body, time.monotonic() + ttl, versions)
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.counters.incr("evictions")
+        self.counters.incr("sets")
+
+    def _drop(self, key):
+        body, _, _ = self._entries.pop(key)
+        self._bytes -= len(body)
+
+    def invalidate(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._tag_versions[tag] = self._tag_versions.get(tag, 0) + 1
+        self.counters.incr("invalidations", len(tags))
+
+    def stats(self):
+        stats = self.counters.snapshot()
+        with self._lock:
+            stats.update(backend="memory", entries=len(self._entries), bytes=self._bytes,
+                         max_entries=self.max_entries, max_bytes=self.max_bytes, pid=os.getpid())
+        return stats
+
+
+class SqliteCache:
+    """
+    Cache stored in a SQLite file shared by all workers on the host.
+    Each thread keeps its own sqlite3 connection; WAL mode lets readers
+    run alongside the single writer.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._evict_lock = threading.Lock()
+        self._sets_since_evict = 0
+        self.counters = _Counters()
+
+        db = self._db()
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                expires_at REAL NOT NULL,
+                versions TEXT NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries (last_access);
+            CREATE TABLE IF NOT EXISTS tag_versions (
+                tag TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            );
+        """)
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None or getattr(self._local, "pid", None) != os.getpid():
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=OFF")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def _current_versions(self, db, tags):
+        if not tags:
+            return {}
+        placeholders = ", ".join("?" * len(tags))
+        rows = db.execute(f"SELECT tag, version FROM tag_versions WHERE tag IN ({placeholders})", list(tags))
+        current = {tag: 0 for tag in tags}
+        current.update(rows.fetchall())
+        return current
+
+    def versions(self, tags):
+        return self._current_versions(self._db(), list(tags))
+
+    def get(self, key):
+        db = self._db()
+        row = db.execute("SELECT body, expires_at, versions FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.counters.incr("misses")
+            return None
+        body, expires_at, versions = row
+        versions = json.loads(versions)
+        if expires_at < time.time() or self._current_versions(db, list(versions)) != versions:
+            db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.counters.incr("stale")
+            self.counters.incr("misses")
+            return None
+        db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+        self.counters.incr("hits")
+        return body
+
+    def set(self, key, body, ttl, versions):
+        if len(body) > self.max_bytes:
+            return
+        db = self._db()
+        now = time.time()
+        db.execute(
+            "INSERT OR REPLACE INTO entries (key, body, expires_at, versions, last_access) VALUES (?, ?, ?, ?, ?)",
+            (key, body, now + ttl, json.dumps(versions), now)
+        )
+        self.counters.incr("sets")
+        # Counting the table is not free, so only check the bounds every so often
+        with self._evict_lock:
+            self._sets_since_evict += 1
+            due = self._sets_since_evict >= EVICT_CHECK_EVERY
+            if due:
+                self._sets_since_evict = 0
+        if due:
+            self._evict(db)
+
+    def _evict(self, db):
+        count, total = db.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM entries").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        db.execute("DELETE FROM entries WHERE expires_at < ?", (time.time(),))
+        while True:
+            count, total = db.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM entries").fetchone()
+            if count <= self.max_entries and total <= self.max_bytes:
+                return
+            # Drop the least recently used tenth (at least one entry) per pass
+            batch = max(1, count // 10)
+            cur = db.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_access LIMIT ?)", (batch,)
+            )
+            self.counters.incr("evictions", cur.rowcount)
+
+    def invalidate(self, tags):
+        db = self._db()
+        db.executemany(
+            "INSERT INTO tag_versions (tag, version) VALUES (?, 1) "
+            "ON CONFLICT(tag) DO UPDATE SET version = version + 1",
+            [(tag,) for tag in tags]
+        )
+        self.counters.incr("invalidations", len(tags))
+
+    def stats(self):
+        stats = self.counters.snapshot()
+        count, total = self._db().execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM entries").fetchone()
+        stats.update(backend="sqlite", path=self.path, entries=count, bytes=total,
+                     max_entries=self.max_entries, max_bytes=self.max_bytes, pid=os.getpid())
+        return stats
+
+
+class NullCache:
+    """Used when CACHE_BACKEND=off."""
+
+    def __init__(self):
+        self.counters = _Counters()
+
+    def versions(self, tags):
+        return {}
+
+    def get(self, key):
+        self.counters.incr("misses")
+        return None
+
+    def set(self, key, body, ttl, versions):
+        pass
+
+    def invalidate(self, tags):
+        pass
+
+    def stats(self):
+        stats = self.counters.snapshot()
+        stats.update(backend="off", pid=os.getpid())
+        return stats
+
+
+def make_cache(backend=CACHE_BACKEND):
+    if backend == "sqlite":
+        return SqliteCache()
+    if backend == "off":
+        return NullCache()
+    if MULTI_PROCESS_SERVER:
+        logger.warning("CACHE_BACKEND=memory under %s: invalidations stay in the writing worker, "
+                       "other workers serve stale responses for up to their TTL", os.path.basename(sys.argv[0]))
+    return MemoryCache()
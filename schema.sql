@@ -20,12 +20,31 @@
 -- 10. movie_actors    (Junction table: links movies to actors)
 -- 11. movie_directors (Junction table: links movies to directors)
 -- 12. watchlist_items (Junction table: links watchlists to movies)
+--
+-- Derived tables (maintained by the app, rebuildable with manage.py):
+-- 13. movie_rating_stats (Running rating aggregates per movie)
+-- 14. movie_similar_movies (Precomputed co-liked movies per movie)
+-- 15. index_builds       (Build log for the precomputed indexes)
+-- 16. user_taste_profiles (Per-user genre/director affinity)
+-- 17. user_minhash       (MinHash signature of each user's liked set)
+-- 18. user_lsh_buckets   (LSH band buckets of those signatures)
+-- 19. user_neighbors     (Top similar users per user)
+-- 20. movie_synopsis_neighbors (Top TF-IDF synopsis neighbours per movie)
+-- 21. schema_migrations  (Applied migration versions, see migrations.py)
+-- 22. rating_priors      (Prior mean rating used by a ranked table)
+-- 23. genre_movie_rankings (Per-genre browse lists by title, year and weighted rating)
+-- 24. rating_totals      (Running global rating count and sum, in slots)
+-- 25. movie_popularity   (Weighted-rating leaderboard for /api/recommendations/popular)
+-- 26. movie_rating_buckets (Hourly/daily new-rating counts per movie, for trending)
+--
+-- FRESH INSTALLS ONLY. This script no longer drops an existing database:
+-- CREATE DATABASE fails if movie_rec_db is already there. Bring a live
+-- database forward with `python manage.py migrate` instead (migrations.py
+-- creates and fills every table and index below that the original schema
+-- lacked). To really start over, DROP DATABASE movie_rec_db by hand first.
 -- =============================================================================
 */
 
--- Drop the database if it already exists to start fresh
-DROP DATABASE IF EXISTS movie_rec_db;
-
 -- Create the new database
 CREATE DATABASE movie_rec_db;
 
@@ -49,7 +68,9 @@ CREATE TABLE movies (
     synopsis TEXT,
     duration_min INT,
     -- Index on title for faster searching
-    INDEX idx_title (title)
+    INDEX idx_title (title),
+    -- Keyset pagination of the 'recent' list: (release_year DESC, title, movie_id)
+    INDEX idx_year_title (release_year DESC, title)
 );
 
 -- 3. genres Table
@@ -90,7 +111,11 @@ CREATE TABLE ratings (
     FOREIGN KEY (movie_id) REFERENCES movies(movie_id) ON DELETE CASCADE,
     
     -- A user can only rate a specific movie once
-    UNIQUE KEY uk_user_movie_rating (user_id, movie_id)
+    UNIQUE KEY uk_user_movie_rating (user_id, movie_id),
+
+    -- Per-movie aggregates and a user's liked set, both index-only
+    INDEX idx_ratings_movie_rating (movie_id, rating),
+    INDEX idx_ratings_user_rating_movie (user_id, rating, movie_id)
 );
 
 -- 7. reviews Table
@@ -105,7 +130,10 @@ CREATE TABLE reviews (
     FOREIGN KEY (movie_id) REFERENCES movies(movie_id) ON DELETE CASCADE,
     
     -- A user can only review a specific movie once
-    UNIQUE KEY uk_user_movie_review (user_id, movie_id)
+    UNIQUE KEY uk_user_movie_review (user_id, movie_id),
+
+    -- Latest reviews of a movie without a filesort
+    INDEX idx_reviews_movie_created (movie_id, created_at)
 );
 
 -- 8. watchlists Table
@@ -129,8 +157,13 @@ CREATE TABLE watchlists (
 CREATE TABLE movie_genres (
     movie_id INT NOT NULL,
     genre_id INT NOT NULL,
+    linked_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
     
     PRIMARY KEY (movie_id, genre_id),
+    -- Reverse lookup for genre browsing
+    INDEX idx_movie_genres_genre_movie (genre_id, movie_id),
+    -- New links, for the search index's catch-up (see search_index.py)
+    INDEX idx_movie_genres_linked (linked_at),
     FOREIGN KEY (movie_id) REFERENCES movies(movie_id) ON DELETE CASCADE,
     FOREIGN KEY (genre_id) REFERENCES genres(genre_id) ON DELETE CASCADE
 );
@@ -171,6 +204,190 @@ CREATE TABLE watchlist_items (
     UNIQUE KEY uk_watchlist_movie (watchlist_id, movie_id) 
 );
 
+-- =============================================================================
+-- DERIVED TABLES (Maintained incrementally by the app)
+-- =============================================================================
+
+-- 13. movie_rating_stats (Running rating aggregates per movie)
+-- Updated in the same transaction as every rating write so read endpoints
+-- never AVG() over the whole ratings table.
+-- Rebuild after bulk loads with: python manage.py rebuild-rating-stats
+CREATE TABLE movie_rating_stats (
+    movie_id INT PRIMARY KEY,
+    rating_count INT NOT NULL DEFAULT 0,
+    rating_sum BIGINT NOT NULL DEFAULT 0,
+    rating_sum_sq BIGINT NOT NULL DEFAULT 0,
+    last_rated_at TIMESTAMP NULL,
+
+    FOREIGN KEY (movie_id) REFERENCES movies(movie_id) ON DELETE CASCADE
+);
+
+-- 14. movie_similar_movies (Top-K co-liked movies per movie, cosine similarity)
+-- Built offline by: python manage.py build-cooccurrence
+CREATE TABLE movie_similar_movies (
+    movie_id INT NOT NULL,
+    rank_pos SMALLINT NOT NULL,
+    similar_movie_id INT NOT NULL,
+    similarity FLOAT NOT NULL,
+    co_likes INT NOT NULL,
+
+    PRIMARY KEY (movie_id, rank_pos),
+    FOREIGN KEY (movie_id) REFERENCES movies(movie_id) ON DELETE CASCADE,
+    FOREIGN KEY (similar_movie_id) REFERENCES movies(movie_id) ON DELETE CASCADE
+);
+
+-- 15. index_builds (One row per build of a precomputed index)
+CREATE TABLE index_builds (
+    build_id INT AUTO_INCREMENT PRIMARY KEY,
+    index_name VARCHAR(64) NOT NULL,
+    started_at TIMESTAMP NOT NULL,
+    duration_ms INT NOT NULL,
+    matrix_rows INT NOT NULL,
+    matrix_cols INT NOT NULL,
+    matrix_nnz BIGINT NOT NULL,
+    items_built INT NOT NULL,
+    partition_label VARCHAR(32) NOT NULL DEFAULT 'all',
+
+    INDEX idx_index_builds_name (index_name, started_at)
+);
+
+-- 16. user_taste_profiles (Per-user genre/director affinity)
+-- weight = SUM(rating - 3) over the user's ratings of movies with the feature.
+-- Updated in the same transaction as every rating write.
+-- Rebuild after bulk loads with: python manage.py rebuild-taste-profiles
+CREATE TABLE user_taste_profiles (
+    user_id INT NOT NULL,
+    feature_kind ENUM('genre', 'director') NOT NULL,
+    feature_id INT NOT NULL,
+    weight INT NOT NULL DEFAULT 0,
+    rating_count INT NOT NULL DEFAULT 0,
+
+    PRIMARY KEY (user_id, feature_kind, feature_id),
+    INDEX idx_taste_weight (user_id, feature_kind, weight),
+    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+);
+
+-- 17. user_minhash (64 x uint32 MinHash signature of the movies a user liked)
+-- 18. user_lsh_buckets (One row per user and LSH band)
+-- 19. user_neighbors (Top similar users by shared likes, found through the buckets)
+-- Built by: python manage.py build-user-neighbors; rating writes queue a refresh of the
+-- rater and the lists they appear in (NeighborRefresher, after the commit).
+CREATE TABLE user_minhash (
+    user_id INT PRIMARY KEY,
+    signature VARBINARY(256) NOT NULL,
+
+    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+);
+
+CREATE TABLE user_lsh_buckets (
+    band TINYINT NOT NULL,
+    bucket_key BIGINT NOT NULL,
+    user_id INT NOT NULL,
+
+    PRIMARY KEY (band, bucket_key, user_id),
+    INDEX idx_lsh_user (user_id),
+    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+);
+
+CREATE TABLE user_neighbors (
+    user_id INT NOT NULL,
+    rank_pos SMALLINT NOT NULL,
+    neighbor_id INT NOT NULL,
+    shared_likes INT NOT NULL,
+    jaccard FLOAT NOT NULL,
+
+    PRIMARY KEY (user_id, rank_pos),
+    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+    FOREIGN KEY (neighbor_id) REFERENCES users(user_id) ON DELETE CASCADE
+);
+
+-- 20. movie_synopsis_neighbors (Top-K cosine neighbours of each movie's synopsis TF-IDF vector)
+-- Built offline by: python manage.py build-synopsis-index
+CREATE TABLE movie_synopsis_neighbors (
+    movie_id INT NOT NULL,
+    rank_pos SMALLINT NOT NULL,
+    similar_movie_id INT NOT NULL,
+    similarity FLOAT NOT NULL,
+
+    PRIMARY KEY (movie_id, rank_pos),
+    FOREIGN KEY (movie_id) REFERENCES movies(movie_id) ON DELETE CASCADE,
+    FOREIGN KEY (similar_movie_id) REFERENCES movies(movie_id) ON DELETE CASCADE
+);
+
+-- 21. schema_migrations (Versions applied by `python manage.py migrate`)
+-- A database created from this file already has every migration's changes;
+-- the first migrate run finds them in place and records the versions (it
+-- also builds the offline neighbour tables if they are still empty).
+CREATE TABLE schema_migrations (
+    version INT PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    duration_ms INT NOT NULL
+);
+
+-- 22. rating_priors (Prior mean C of a Bayesian weighted rating, frozen at rebuild time)
+-- 23. genre_movie_rankings (One row per movie_genres link, sortable without joins)
+-- Built by: python manage.py rebuild-genre-rankings; the app keeps it current (see genre_rankings.py).
+-- title_key is LOWER(title) with a binary collation, so MySQL and Python agree on its order.
+CREATE TABLE rating_priors (
+    name VARCHAR(32) PRIMARY KEY,
+    prior_mean DOUBLE NOT NULL,
+    computed_at TIMESTAMP NOT NULL
+);
+
+CREATE TABLE genre_movie_rankings (
+    genre_id INT NOT NULL,
+    movie_id INT NOT NULL,
+    title VARCHAR(255) NOT NULL,
+    title_key VARCHAR(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_bin NOT NULL,
+    release_year INT NOT NULL,
+    average_rating DECIMAL(8, 4) NOT NULL,
+    weighted_rating DOUBLE NOT NULL,
+
+    PRIMARY KEY (genre_id, movie_id),
+    INDEX idx_gmr_title (genre_id, title_key, movie_id),
+    INDEX idx_gmr_recent (genre_id, release_year DESC, title_key, movie_id),
+    INDEX idx_gmr_top_rated (genre_id, weighted_rating DESC, movie_id),
+    INDEX idx_gmr_movie (movie_id),
+    FOREIGN KEY (genre_id) REFERENCES genres(genre_id) ON DELETE CASCADE,
+    FOREIGN KEY (movie_id) REFERENCES movies(movie_id) ON DELETE CASCADE
+);
+
+-- 24. rating_totals (Running count/sum over all ratings; slot = movie_id % 16 spreads the row locks)
+-- Updated with movie_rating_stats; rebuilt by: python manage.py rebuild-rating-stats
+CREATE TABLE rating_totals (
+    slot TINYINT PRIMARY KEY,
+    rating_count BIGINT NOT NULL DEFAULT 0,
+    rating_sum BIGINT NOT NULL DEFAULT 0
+);
+
+-- 25. movie_popularity (Movies with enough ratings, by weighted rating)
+-- Re-scored per movie on every rating write, recomputed periodically into a shadow table
+-- (movie_popularity_next) that is swapped in with RENAME TABLE (see popularity.py).
+CREATE TABLE movie_popularity (
+    movie_id INT PRIMARY KEY,
+    rating_count INT NOT NULL,
+    average_rating DECIMAL(8, 4) NOT NULL,
+    weighted_rating DOUBLE NOT NULL,
+
+    INDEX idx_popularity_rank (weighted_rating DESC, movie_id),
+    FOREIGN KEY (movie_id) REFERENCES movies(movie_id) ON DELETE CASCADE
+);
+
+-- 26. movie_rating_buckets (New ratings per movie per hour, or per day once compacted)
+-- bucket_start is in hours since the epoch; updated on every rating write (see trending.py).
+CREATE TABLE movie_rating_buckets (
+    bucket_hours TINYINT NOT NULL,
+    bucket_start INT NOT NULL,
+    movie_id INT NOT NULL,
+    rating_count INT NOT NULL,
+    rating_sum INT NOT NULL,
+
+    PRIMARY KEY (bucket_hours, bucket_start, movie_id),
+    INDEX idx_buckets_movie (movie_id),
+    FOREIGN KEY (movie_id) REFERENCES movies(movie_id) ON DELETE CASCADE
+);
+
 /*
 -- =============================================================================
 -- End of Schema
@@ -0,0 +1,324 @@
+"""
+In-process full-text index over movie titles for /api/movies?search=...
+
+- Titles are case- and diacritic-folded and split into word tokens.
+- Every query term must match (AND); the last term also matches as a
+  prefix so results update while the user is still typing.
+- Matches are ranked with BM25. The genre filter and the 'recent'
+  ordering are applied on the index's own arrays, so MySQL only has to
+  fetch the final page of rows by primary key.
+
+The index is built once per worker from the movies table and then kept up
+to date by add_movie()/add_genre_link() (called from /api/insert) plus a
+periodic catch-up for rows inserted through other workers: new movies by
+movie_id, new genre links by movie_genres.linked_at.
+
+BM25 scores depend on corpus statistics (document count, total length,
+document frequencies) that differ between workers and move with every
+insert. search() therefore returns the statistics it ranked with, and a
+keyset cursor carries them: the next page is scored with exactly the same
+numbers, so it neither skips nor repeats rows whichever worker serves it.
+"""
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+
+import numpy as np
+
+from array_utils import GrowableArray
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_PREFIX_EXPANSIONS = 64   # cap on vocabulary terms a partial last word can expand to
+MIN_PREFIX_LENGTH = 3        # shorter last words only match whole terms
+FETCH_BATCH = 50000
+LINK_OVERLAP_SECONDS = 300   # genre links re-read per refresh, covering transactions still open
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def fold(text):
+    """Lowercases and strips accents: 'Amélie' -> 'amelie'."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(fold(text or ""))
+
+
+class TitleSearchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.movie_ids = GrowableArray(np.int64)
+        self.years = GrowableArray(np.int32)
+        self.lengths = GrowableArray(np.int32)
+        self.doc_of_movie = {}            # movie_id -> doc index
+        self.total_length = 0
+
+        # term -> (doc indexes, term frequencies), both sorted by doc index
+        self.postings = {}
+        self.pending = {}                 # term -> list of (doc, tf) added since the last freeze
+        self.vocabulary = []              # sorted terms, for prefix expansion
+
+        self.genre_docs = {}              # genre_id -> sorted np.int32 doc indexes
+
+        self.max_movie_id = 0
+        self.links_since = None           # DB time genre links were last read up to
+        self.last_refresh = 0.0
+
+    # --- Building ---
+
+    def _add_doc(self, movie_id, title, release_year):
+        if movie_id in self.doc_of_movie:
+            return None
+        doc = self.movie_ids.size
+        tokens = tokenize(title)
+        self.movie_ids.append(movie_id)
+        self.years.append(release_year or 0)
+        self.lengths.append(len(tokens))
+        self.doc_of_movie[movie_id] = doc
+        self.total_length += len(tokens)
+        self.max_movie_id = max(self.max_movie_id, movie_id)
+
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, tf in counts.items():
+            self.pending.setdefault(token, []).append((doc, tf))
+        return doc
+
+    def _freeze(self):
+        """Folds pending postings into the numpy arrays and refreshes the vocabulary."""
+        new_terms = False
+        for term, entries in self.pending.items():
+            docs = np.fromiter((d for d, _ in entries), dtype=np.int32, count=len(entries))
+            tfs = np.fromiter((t for _, t in entries), dtype=np.int16, count=len(entries))
+            if term in self.postings:
+                old_docs, old_tfs = self.postings[term]
+                docs = np.concatenate([old_docs, docs])
+                tfs = np.concatenate([old_tfs, tfs])
+            else:
+                new_terms = True
+            self.postings[term] = (docs, tfs)
+        self.pending = {}
+        if new_terms:
+            self.vocabulary = sorted(self.postings)
+
+    def _add_genre_links(self, pairs):
+        grouped = {}
+        for movie_id, genre_id in pairs:
+            doc = self.doc_of_movie.get(movie_id)
+            if doc is not None:
+                grouped.setdefault(genre_id, []).append(doc)
+        for genre_id, docs in grouped.items():
+            docs = np.asarray(docs, dtype=np.int32)
+            if genre_id in self.genre_docs:
+                docs = np.concatenate([self.genre_docs[genre_id], docs])
+            self.genre_docs[genre_id] = np.unique(docs)
+
+    def build(self, cursor):
+        """Loads every movie and genre link. Returns the number of documents."""
+        with self._lock:
+            cursor.execute("SELECT NOW(6)")
+            self.links_since = cursor.fetchall()[0][0]
+            cursor.execute("SELECT movie_id, title, release_year FROM movies ORDER BY movie_id")
+            while True:
+                rows = cursor.fetchmany(FETCH_BATCH)
+                if not rows:
+                    break
+                for movie_id, title, release_year in rows:
+                    self._add_doc(movie_id, title, release_year)
+            self._freeze()
+
+            cursor.execute("SELECT movie_id, genre_id FROM movie_genres")
+            while True:
+                rows = cursor.fetchmany(FETCH_BATCH)
+                if not rows:
+                    break
+                self._add_genre_links(rows)
+
+            self.last_refresh = time.monotonic()
+            return self.movie_ids.size
+
+    def refresh(self, cursor):
+        """
+        Picks up movies and genre links inserted (e.g. by another worker)
+        since the index last saw them. Returns the number of new movies.
+        """
+        with self._lock:
+            since = self.max_movie_id
+            cursor.execute("SELECT NOW(6)")
+            now = cursor.fetchall()[0][0]
+            cursor.execute(
+                "SELECT movie_id, title, release_year FROM movies WHERE movie_id > %s ORDER BY movie_id",
+                (since,)
+            )
+            added = [row for row in cursor.fetchall() if self._add_doc(*row) is not None]
+            if added:
+                cursor.execute("SELECT movie_id, genre_id FROM movie_genres WHERE movie_id > %s", (since,))
+                self._add_genre_links(cursor.fetchall())
+            # Links added to movies the index already has; re-reading a link is harmless
+            cursor.execute(
+                "SELECT movie_id, genre_id FROM movie_genres "
+                "WHERE linked_at >= %s - INTERVAL %s SECOND AND movie_id <= %s",
+                (self.links_since, LINK_OVERLAP_SECONDS, since)
+            )
+            self._add_genre_links(cursor.fetchall())
+            self.links_since = now
+            self.last_refresh = time.monotonic()
+            return len(added)
+
+    def add_movie(self, movie_id, title, release_year):
+        with self._lock:
+            self._add_doc(movie_id, title, release_year)
+
+    def add_genre_link(self, movie_id, genre_id):
+        with self._lock:
+            self._add_genre_links([(movie_id, genre_id)])
+
+    # --- Querying ---
+
+    def _term_postings(self, term):
+        docs, tfs = self.postings.get(term, (None, None))
+        extra = self.pending.get(term)
+        if extra:
+            extra_docs = np.asarray([d for d, _ in extra], dtype=np.int32)
+            extra_tfs = np.asarray([t for _, t in extra], dtype=np.int16)
+            if docs is None:
+                return extra_docs, extra_tfs
+            return np.concatenate([docs, extra_docs]), np.concatenate([tfs, extra_tfs])
+        return docs, tfs
+
+    def _prefix_terms(self, prefix):
+        terms = []
+        i = bisect_left(self.vocabulary, prefix)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(prefix):
+            terms.append(self.vocabulary[i])
+            if len(terms) >= MAX_PREFIX_EXPANSIONS:
+                break
+            i += 1
+        # Terms added since the last freeze are not in the sorted vocabulary yet
+        terms.extend(t for t in self.pending if t.startswith(prefix) and t not in self.postings)
+        return terms
+
+    def _bm25(self, docs, tfs, df, n_docs, total_length):
+        avg_len = total_length / n_docs if n_docs else 1.0
+        idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+        lengths = self.lengths.view[docs]
+        tf = tfs.astype(np.float32)
+        return idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * lengths / avg_len))
+
+    def _corpus_stats(self, terms):
+        """Document count, total length and, per query term, its [candidate, df] pairs."""
+        expansions = []
+        for i, term in enumerate(terms):
+            candidates = [term]
+            if i == len(terms) - 1 and len(term) >= MIN_PREFIX_LENGTH:
+                candidates = self._prefix_terms(term) or [term]
+            expansion = []
+            for candidate in candidates:
+                docs, _ = self._term_postings(candidate)
+                expansion.append([candidate, 0 if docs is None else len(docs)])
+            expansions.append(expansion)
+        return {"docs": self.movie_ids.size, "length": self.total_length, "terms": expansions}
+
+    def search(self, query, genre_id=None, recent=False, limit=50, after=None, stats=None):
+        """
+        Returns (hits, stats): up to `limit` (movie_id, sort_key) pairs, best
+        match first (or newest first, then best match, when recent=True), and
+        the corpus statistics they were scored with.
+
+        sort_key is (score,) or (release_year, score) and ties are broken
+        by movie_id. Passing the last row's (*sort_key, movie_id) as `after`
+        together with `stats` returns the next page (keyset pagination),
+        ranked exactly like the first. Raises ValueError for stats that do
+        not belong to this query.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return [], None
+
+        with self._lock:
+            if len(self.pending) > 1000:
+                self._freeze()
+
+            if stats is None:
+                stats = self._corpus_stats(terms)
+            elif (not isinstance(stats, dict) or len(stats.get("terms", ())) != len(terms)
+                  or not all(isinstance(stats.get(key), int) for key in ("docs", "length"))):
+                raise ValueError("Invalid cursor")
+
+            # Each query term -> (docs, scores). The last term may be a prefix.
+            per_term = []
+            for expansion in stats["terms"]:
+                doc_parts, score_parts = [], []
+                for candidate, df in expansion:
+                    docs, tfs = self._term_postings(candidate)
+                    if docs is None or len(docs) == 0:
+                        continue
+                    doc_parts.append(docs)
+                    score_parts.append(self._bm25(docs, tfs, df, stats["docs"], stats["length"]))
+                if not doc_parts:
+                    return [], stats
+
+                docs = np.concatenate(doc_parts)
+                scores = np.concatenate(score_parts)
+                if len(doc_parts) > 1:
+                    # A title can match several expansions of a prefix; keep its best score
+                    order = np.lexsort((-scores, docs))
+                    docs, scores = docs[order], scores[order]
+                    first = np.ones(len(docs), dtype=bool)
+                    first[1:] = docs[1:] != docs[:-1]
+                    docs, scores = docs[first], scores[first]
+                per_term.append((docs, scores))
+
+            # AND: intersect, starting from the rarest term
+            docs = min((term_docs for term_docs, _ in per_term), key=len)
+            for other_docs, _ in per_term:
+                docs = np.intersect1d(docs, other_docs, assume_unique=True)
+                if len(docs) == 0:
+                    return [], stats
+
+            if genre_id is not None:
+                genre_docs = self.genre_docs.get(genre_id)
+                if genre_docs is None:
+                    return [], stats
+                docs = np.intersect1d(docs, genre_docs, assume_unique=True)
+
+            # Sum in query-term order, so the same stats always give the same floats
+            scores = 0
+            for term_docs, term_scores in per_term:
+                scores = scores + term_scores[np.searchsorted(term_docs, docs)]
+
+            ids = self.movie_ids.view[docs]
+            years = self.years.view[docs]
+
+            if after is not None:
+                # Keep only rows that sort strictly after the cursor
+                if recent:
+                    year, score, movie_id = after
+                    keep = (years < year) | ((years == year) & (
+                        (scores < score) | ((scores == score) & (ids > movie_id))))
+                else:
+                    score, movie_id = after
+                    keep = (scores < score) | ((scores == score) & (ids > movie_id))
+                ids, years, scores = ids[keep], years[keep], scores[keep]
+
+            if len(ids) == 0:
+                return [], stats
+
+            if recent:
+                order = np.lexsort((ids, -scores, -years))[:limit]
+                return [(int(ids[i]), (int(years[i]), float(scores[i]))) for i in order], stats
+
+            if len(ids) > limit:
+                # Everything scoring at least the limit-th best score, so ties
+                # at the cut are resolved by movie_id rather than arbitrarily
+                threshold = -np.partition(-scores, limit - 1)[limit - 1]
+                top = scores >= threshold
+                ids, scores = ids[top], scores[top]
+            order = np.lexsort((ids, -scores))[:limit]
+            return [(int(ids[i]), (float(scores[i]),)) for i in order], stats
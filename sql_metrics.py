@@ -0,0 +1,366 @@
+"""
+Per-query SQL instrumentation and Prometheus metrics.
+
+Every cursor handed out by the connection pool is an InstrumentedCursor.
+It records, per statement fingerprint (the SQL with literals and
+placeholders replaced by ?, IN lists and VALUES tuples collapsed):
+
+- wall time from execute() until the last row was fetched,
+- rows returned (or affected, for writes),
+- errors.
+
+Statements slower than SQL_EXPLAIN_THRESHOLD_MS get their EXPLAIN plan
+captured on the same connection, at most once per fingerprint every
+SQL_EXPLAIN_INTERVAL seconds, and kept in a small in-memory list.
+
+The app times every request by URL rule. render_prometheus() writes all of
+it in the Prometheus text format for /api/metrics. Metrics are kept per
+worker process (like the pool and cache stats), so scrape each worker or
+run a single worker per port.
+
+The hot path is a cached fingerprint lookup, two perf_counter() calls and
+one locked histogram update, so it is meant to stay on in production; set
+SQL_METRICS=off to disable it.
+"""
+import bisect
+import functools
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import mysql.connector
+
+SQL_METRICS_ENABLED = os.getenv("SQL_METRICS", "on") != "off"
+SQL_EXPLAIN_THRESHOLD_MS = float(os.getenv("SQL_EXPLAIN_THRESHOLD_MS", 200))
+SQL_EXPLAIN_INTERVAL = float(os.getenv("SQL_EXPLAIN_INTERVAL", 300))
+MAX_CAPTURED_PLANS = 100
+MAX_FINGERPRINTS = 2000     # distinct statements tracked; the rest count as "other"
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+EXPLAINABLE = ("select", "insert", "update", "delete", "replace", "with", "table")
+
+
+# --- Fingerprints ---
+
+_COMMENTS = re.compile(r"/\*.*?\*/|--[^\n]*|#[^\n]*", re.S)
+_STRINGS = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"")
+_PLACEHOLDERS = re.compile(r"%\(\w+\)s|%s|\b\d+(?:\.\d+)?(?:e[+-]?\d+)?\b", re.I)
+_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_VALUE_TUPLES = re.compile(r"(\(\?\+\)|\(\?\))(?:\s*,\s*(?:\(\?\+\)|\(\?\)))+")
+_SPACES = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=4096)
+def fingerprint(sql):
+    """Normalized statement text: literals and placeholders become ?, lists collapse to (?+)."""
+    text = _STRINGS.sub("?", sql)
+    text = _COMMENTS.sub(" ", text)
+    text = _PLACEHOLDERS.sub("?", text)
+    text = _IN_LISTS.sub("(?+)", text)
+    text = _VALUE_TUPLES.sub(r"\1+", text)
+    return _SPACES.sub(" ", text).strip().rstrip(";").strip()
+
+
+@functools.lru_cache(maxsize=4096)
+def query_id(fingerprint_text):
+    return hashlib.sha1(fingerprint_text.encode("utf-8")).hexdigest()[:12]
+
+
+# --- Metric Types ---
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values."""
+
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}   # labels -> [bucket counts..., sum, count]
+
+    def observe(self, labels, value):
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[slot] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: list(series) for labels, series in self._series.items()}
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} histogram")
+        for labels, series in sorted(self.snapshot().items()):
+            base = _label_text(self.label_names, labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{{{base}{',' if base else ''}le=\"{le}\"}} {cumulative}")
+            labels_text = f"{{{base}}}" if base else ""
+            lines.append(f"{self.name}_sum{labels_text} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{labels_text} {series[-1]}")
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def incr(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} counter")
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{{{_label_text(self.label_names, labels)}}} {value}")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names, values):
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+# --- Registry ---
+
+QUERY_SECONDS = Histogram("sql_query_duration_seconds", "Statement time from execute to the last fetched row.",
+                          ("query_id",), LATENCY_BUCKETS)
+QUERY_ROWS = Histogram("sql_query_rows", "Rows returned (reads) or affected (writes) per statement.",
+                       ("query_id",), ROW_BUCKETS)
+QUERY_ERRORS = Counter("sql_query_errors_total", "Statements that raised a MySQL error.", ("query_id",))
+SLOW_QUERIES = Counter("sql_slow_queries_total",
+                       f"Statements slower than {SQL_EXPLAIN_THRESHOLD_MS:g} ms.", ("query_id",))
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Request handling time by route and status.",
+                            ("method", "route", "status"), LATENCY_BUCKETS)
+
+_registered = []            # metrics of other modules, rendered after the built-in ones
+_fingerprints = {}          # query_id -> fingerprint, for the sql_query_info series
+_fingerprints_lock = threading.Lock()
+_plans = OrderedDict()      # query_id -> last captured plan
+_plans_lock = threading.Lock()
+_process_started = time.time()
+
+
+def _register(sql):
+    text = fingerprint(sql)
+    qid = query_id(text)
+    if qid not in _fingerprints:
+        with _fingerprints_lock:
+            if qid not in _fingerprints:
+                if len(_fingerprints) >= MAX_FINGERPRINTS:
+                    return "other"
+                _fingerprints[qid] = text
+    return qid
+
+
+def record_query(sql, seconds, rows, error=False):
+    """
+    Records one statement. Returns its query_id if an EXPLAIN should be
+    captured for it now (slow and not explained recently), else None.
+    """
+    qid = _register(sql)
+    QUERY_SECONDS.observe((qid,), seconds)
+    if error:
+        QUERY_ERRORS.incr((qid,))
+        return None
+    if rows is not None and rows >= 0:
+        QUERY_ROWS.observe((qid,), rows)
+    if seconds * 1000 < SQL_EXPLAIN_THRESHOLD_MS:
+        return None
+    SLOW_QUERIES.incr((qid,))
+    if qid == "other" or not sql.lstrip(" (\n\t").lower().startswith(EXPLAINABLE):
+        return None
+    with _plans_lock:
+        previous = _plans.get(qid)
+        if previous and time.time() - previous["captured_at"] < SQL_EXPLAIN_INTERVAL:
+            return None
+        # Claim the slot so concurrent slow runs don't all explain
+        _plans[qid] = {"captured_at": time.time(), "pending": True}
+    return qid
+
+
+def store_plan(qid, seconds, columns, rows):
+    plan = {
+        "query_id": qid,
+        "fingerprint": _fingerprints.get(qid),
+        "duration_ms": round(seconds * 1000, 2),
+        "captured_at": time.time(),
+        "plan": [dict(zip(columns, row)) for row in rows],
+    }
+    with _plans_lock:
+        _plans[qid] = plan
+        _plans.move_to_end(qid)
+        while len(_plans) > MAX_CAPTURED_PLANS:
+            _plans.popitem(last=False)
+    logger.warning("Slow query %s (%s ms): %s", qid, plan['duration_ms'], plan['fingerprint'])
+
+
+def captured_plans():
+    """Captured EXPLAIN plans, most recent first."""
+    with _plans_lock:
+        return [plan for plan in reversed(_plans.values()) if not plan.get("pending")]
+
+
+def register(metric):
+    """Adds another module's Histogram or Counter to /api/metrics."""
+    _registered.append(metric)
+
+
+def record_request(method, route, status, seconds):
+    REQUEST_SECONDS.observe((method, route, str(status)), seconds)
+
+
+def render_prometheus(extra_metrics=()):
+    """
+    All metrics in the Prometheus text exposition format (version 0.0.4).
+    `extra_metrics` adds single-value series as (name, type, help, value).
+    """
+    lines = []
+    REQUEST_SECONDS.render(lines)
+    QUERY_SECONDS.render(lines)
+    QUERY_ROWS.render(lines)
+    QUERY_ERRORS.render(lines)
+    SLOW_QUERIES.render(lines)
+    for metric in _registered:
+        metric.render(lines)
+
+    lines.append("# HELP sql_query_info Normalized statement text of each query_id.")
+    lines.append("# TYPE sql_query_info gauge")
+    with _fingerprints_lock:
+        fingerprints = sorted(_fingerprints.items())
+    for qid, text in fingerprints:
+        lines.append(f'sql_query_info{{query_id="{qid}",statement="{_escape(text)}"}} 1')
+
+    started = ("process_start_time_seconds", "gauge", "Start time of this worker.", _process_started)
+    for name, kind, help_text, value in (started,) + tuple(extra_metrics):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# --- Cursor Wrapper ---
+
+class InstrumentedCursor:
+    """
+    Wraps a mysql.connector cursor. A statement's sample is completed when
+    the next statement runs or the cursor is closed, so time spent fetching
+    an unbuffered result counts towards the statement that produced it.
+    """
+
+    def __init__(self, raw_cursor, raw_connection):
+        self._raw = raw_cursor
+        self._connection = raw_connection
+        self._sql = None
+        self._params = None
+        self._explainable = False
+        self._seconds = 0.0
+        self._rows = 0
+        self._reads = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def _finish(self):
+        if self._sql is None:
+            return
+        sql, params, seconds, rows = self._sql, self._params, self._seconds, self._rows
+        self._sql = None
+        if not SQL_METRICS_ENABLED:
+            return
+        qid = record_query(sql, seconds, rows)
+        if qid and self._explainable:
+            self._explain(qid, sql, params, seconds)
+
+    def _explain(self, qid, sql, params, seconds):
+        try:
+            explain = self._connection.cursor()
+            try:
+                explain.execute("EXPLAIN " + sql, params)
+                store_plan(qid, seconds, explain.column_names, explain.fetchall())
+            finally:
+                explain.close()
+        except mysql.connector.Error as err:
+            # e.g. an unread result left on the connection; try again next interval
+            logger.warning("Could not EXPLAIN query %s: %s", qid, err)
+
+    def _run(self, method, sql, params, explainable):
+        self._finish()
+        start = time.perf_counter()
+        try:
+            result = method(sql, params)
+        except mysql.connector.Error:
+            if SQL_METRICS_ENABLED:
+                record_query(sql, time.perf_counter() - start, None, error=True)
+            raise
+        self._sql, self._params, self._explainable = sql, params, explainable
+        self._seconds = time.perf_counter() - start
+        # Reads count fetched rows; writes (and buffered reads) report rowcount up front
+        self._rows = self._raw.rowcount if not self._raw.with_rows or self._raw.rowcount > 0 else 0
+        self._reads = self._raw.with_rows and self._rows == 0
+        return result
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        if args or kwargs:
+            return self._raw.execute(operation, params, *args, **kwargs)
+        return self._run(self._raw.execute, operation, params, True)
+
+    def executemany(self, operation, seq_params):
+        return self._run(self._raw.executemany, operation, seq_params, False)
+
+    def _timed_fetch(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._seconds += time.perf_counter() - start
+
+    def fetchone(self):
+        row = self._timed_fetch(self._raw.fetchone)
+        if row is not None and self._reads:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=1):
+        rows = self._timed_fetch(self._raw.fetchmany, size)
+        if self._reads:
+            self._rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed_fetch(self._raw.fetchall)
+        if self._reads:
+            self._rows += len(rows)
+        return rows
+
+    def close(self):
+        try:
+            return self._raw.close()
+        finally:
+            self._finish()
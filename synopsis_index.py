@@ -0,0 +1,240 @@
+"""
+Synopsis "more like this" index for /api/recommendations/synopsis/<id>.
+
+Offline pipeline (python manage.py build-synopsis-index):
+
+1. Synopses are tokenized in worker processes. Tokens are hashed into
+   NUM_FEATURES columns, so workers never have to agree on a vocabulary and
+   each one sends back plain CSR arrays.
+2. The merged counts become a TF-IDF matrix (sublinear tf, terms in fewer
+   than MIN_DF or more than MAX_DF_RATIO of the synopses dropped) with
+   L2-normalized rows.
+3. Workers compute cosine top-K neighbours for row chunks sized so the
+   sparse product of one chunk stays under MAX_PRODUCT_NNZ entries. Each
+   query row keeps its QUERY_TERMS heaviest terms, which bounds the work
+   per movie at a small cost in exactness.
+4. Neighbours are written to movie_synopsis_neighbors chunk by chunk, so
+   the endpoint is a primary-key range read.
+"""
+import logging
+import multiprocessing
+import os
+import time
+import zlib
+
+import numpy as np
+from scipy import sparse
+
+from cooccurrence import record_build
+from search_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+NUM_FEATURES = 1 << 20
+DEFAULT_TOP_K = 20
+MIN_DF = 2
+MAX_DF_RATIO = 0.1
+MIN_TOKEN_LENGTH = 3
+QUERY_TERMS = 32
+MAX_PRODUCT_NNZ = 20_000_000   # bound on one chunk's similarity matrix
+MAX_CHUNK_ROWS = 2000
+TOKENIZE_BATCH = 20000
+FETCH_BATCH = 50000
+WRITE_BATCH = 20000
+
+STOPWORDS = frozenset("""
+    the and for with that this from into their they them his her its are was were has have had
+    who whom which when where what while will would can could about after before over under
+    than then there these those one two out not but all any each more most other some such
+    only own same very just also been being our your him she you film movie story
+""".split())
+
+
+# --- Tokenizing (worker processes) ---
+
+def _feature(token):
+    return zlib.crc32(token.encode("utf-8")) & (NUM_FEATURES - 1)
+
+
+def _hash_batch(synopses):
+    """Hashed term counts of a batch of synopses as (indptr, indices, counts)."""
+    indptr, indices, counts = [0], [], []
+    for text in synopses:
+        row = {}
+        for token in tokenize(text):
+            if len(token) >= MIN_TOKEN_LENGTH and token not in STOPWORDS:
+                feature = _feature(token)
+                row[feature] = row.get(feature, 0) + 1
+        indices.extend(row.keys())
+        counts.extend(row.values())
+        indptr.append(len(indices))
+    return (np.asarray(indptr, dtype=np.int64), np.asarray(indices, dtype=np.int32),
+            np.asarray(counts, dtype=np.float32))
+
+
+def tfidf_matrix(pieces):
+    """Stacks hashed count pieces and turns them into an L2-normalized TF-IDF CSR matrix."""
+    counts = sparse.vstack([
+        sparse.csr_matrix((data, indices, indptr), shape=(len(indptr) - 1, NUM_FEATURES))
+        for indptr, indices, data in pieces
+    ]).tocsr() if pieces else sparse.csr_matrix((0, NUM_FEATURES), dtype=np.float32)
+
+    n_docs = counts.shape[0]
+    df = np.bincount(counts.indices, minlength=NUM_FEATURES)
+    useful = (df >= MIN_DF) & (df <= max(MIN_DF, MAX_DF_RATIO * n_docs))
+    idf = np.where(useful, np.log((1 + n_docs) / (1 + df)) + 1, 0).astype(np.float32)
+
+    counts.data = (1 + np.log(counts.data)) * idf[counts.indices]
+    counts.eliminate_zeros()
+    norms = np.sqrt(np.asarray(counts.multiply(counts).sum(axis=1)).ravel())
+    return sparse.diags(1 / np.maximum(norms, 1e-12)).dot(counts).astype(np.float32).tocsr()
+
+
+# --- Neighbour Search (worker processes) ---
+# Set in the parent before the pool is forked; workers share the pages.
+_matrix = None
+_matrix_t = None
+
+
+def _prune_rows(rows):
+    """Keeps the QUERY_TERMS heaviest terms of every row."""
+    lengths = np.diff(rows.indptr)
+    if lengths.max(initial=0) <= QUERY_TERMS:
+        return rows
+    rows = rows.tocsr(copy=True)
+    keep = np.ones(len(rows.data), dtype=bool)
+    for i in np.flatnonzero(lengths > QUERY_TERMS):
+        lo, hi = rows.indptr[i], rows.indptr[i + 1]
+        weights = rows.data[lo:hi]
+        keep[lo + np.argpartition(-weights, QUERY_TERMS)[QUERY_TERMS:]] = False
+    rows.data = rows.data * keep
+    rows.eliminate_zeros()
+    return rows
+
+
+def _neighbors_chunk(bounds):
+    """Top-K neighbours for matrix rows [lo, hi): (rows, neighbour rows, similarities)."""
+    lo, hi, top_k = bounds
+    scores = (_prune_rows(_matrix[lo:hi]) @ _matrix_t).tocsr()
+    out_rows, out_cols, out_sims = [], [], []
+    for i in range(hi - lo):
+        start, end = scores.indptr[i], scores.indptr[i + 1]
+        cols, sims = scores.indices[start:end], scores.data[start:end]
+        keep = cols != lo + i
+        cols, sims = cols[keep], sims[keep]
+        if len(sims) > top_k:
+            best = np.argpartition(-sims, top_k - 1)[:top_k]
+            cols, sims = cols[best], sims[best]
+        order = np.lexsort((cols, -sims))
+        out_rows.append(np.full(len(order), lo + i, dtype=np.int64))
+        out_cols.append(cols[order])
+        out_sims.append(sims[order])
+    if not out_rows:
+        empty = np.empty(0)
+        return lo, hi, empty.astype(np.int64), empty.astype(np.int64), empty.astype(np.float32)
+    return lo, hi, np.concatenate(out_rows), np.concatenate(out_cols), np.concatenate(out_sims)
+
+
+def plan_chunks(matrix, top_k):
+    """Row ranges whose similarity products stay under MAX_PRODUCT_NNZ (upper bound from df)."""
+    df = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    pruned = _prune_rows(matrix)
+    cost = np.asarray(sparse.csr_matrix((df[pruned.indices].astype(np.float64), pruned.indices, pruned.indptr),
+                                        shape=pruned.shape).sum(axis=1)).ravel()
+    bounds, lo, total = [], 0, 0
+    for row, row_cost in enumerate(np.minimum(cost, matrix.shape[0])):
+        if row > lo and (total + row_cost > MAX_PRODUCT_NNZ or row - lo >= MAX_CHUNK_ROWS):
+            bounds.append((lo, row, top_k))
+            lo, total = row, 0
+        total += row_cost
+    if lo < matrix.shape[0]:
+        bounds.append((lo, matrix.shape[0], top_k))
+    return bounds
+
+
+# --- Build ---
+
+def load_synopses(cursor):
+    cursor.execute("SELECT movie_id, synopsis FROM movies ORDER BY movie_id")
+    movie_ids, synopses = [], []
+    while True:
+        rows = cursor.fetchmany(FETCH_BATCH)
+        if not rows:
+            break
+        for movie_id, synopsis in rows:
+            movie_ids.append(movie_id)
+            synopses.append(synopsis or "")
+    return np.asarray(movie_ids, dtype=np.int64), synopses
+
+
+def build_synopsis_index(cnx, top_k=DEFAULT_TOP_K, workers=None):
+    """Rebuilds movie_synopsis_neighbors. Returns a summary dict with per-phase throughput."""
+    global _matrix, _matrix_t
+
+    workers = workers or os.cpu_count() or 1
+    started = time.time()
+    cursor = cnx.cursor()
+    try:
+        t0 = time.perf_counter()
+        movie_ids, synopses = load_synopses(cursor)
+        load_s = time.perf_counter() - t0
+
+        context = multiprocessing.get_context("fork")
+        t0 = time.perf_counter()
+        batches = [synopses[i:i + TOKENIZE_BATCH] for i in range(0, len(synopses), TOKENIZE_BATCH)]
+        with context.Pool(workers) as pool:
+            pieces = pool.map(_hash_batch, batches)
+        del synopses, batches
+        _matrix = tfidf_matrix(pieces)
+        _matrix_t = _matrix.T.tocsr()
+        tfidf_s = time.perf_counter() - t0
+        logger.info("TF-IDF: %d synopses, %d non-zeros in %.1fs (%.0f docs/s).", _matrix.shape[0], _matrix.nnz,
+                    tfidf_s, _matrix.shape[0] / max(tfidf_s, 1e-9))
+
+        t0 = time.perf_counter()
+        insert_sql = """
+            INSERT INTO movie_synopsis_neighbors (movie_id, rank_pos, similar_movie_id, similarity)
+            VALUES (%s, %s, %s, %s)
+        """
+        chunks = plan_chunks(_matrix, top_k)
+        written = 0
+        with context.Pool(workers) as pool:
+            for lo, hi, rows, cols, sims in pool.imap(_neighbors_chunk, chunks):
+                ranks = np.arange(len(rows)) - np.searchsorted(rows, rows, side="left")
+                chunk_ids = movie_ids[lo:hi].tolist()
+                placeholders = ", ".join(["%s"] * len(chunk_ids))
+                cursor.execute(f"DELETE FROM movie_synopsis_neighbors WHERE movie_id IN ({placeholders})", chunk_ids)
+                values = list(zip(movie_ids[rows].tolist(), ranks.tolist(), movie_ids[cols].tolist(),
+                                  sims.astype(float).tolist()))
+                for start in range(0, len(values), WRITE_BATCH):
+                    cursor.executemany(insert_sql, values[start:start + WRITE_BATCH])
+                cnx.commit()
+                written += len(values)
+        neighbors_s = time.perf_counter() - t0
+        logger.info("Neighbours: %d chunks, %d rows in %.1fs (%.0f movies/s).", len(chunks), written,
+                    neighbors_s, _matrix.shape[0] / max(neighbors_s, 1e-9))
+
+        duration_ms = int((time.time() - started) * 1000)
+        record_build(cursor, "movie_synopsis_neighbors", started, duration_ms, _matrix.shape, _matrix.nnz,
+                     _matrix.shape[0], "all")
+        cnx.commit()
+        shape, nnz = _matrix.shape, _matrix.nnz
+    except Exception:
+        logger.exception("Synopsis index build failed")
+        raise
+    finally:
+        cursor.close()
+        _matrix = _matrix_t = None
+
+    return {
+        "movies": shape[0],
+        "features": shape[1],
+        "nnz": int(nnz),
+        "neighbor_rows": written,
+        "workers": workers,
+        "load_s": round(load_s, 2),
+        "tfidf_s": round(tfidf_s, 2),
+        "neighbors_s": round(neighbors_s, 2),
+        "duration_ms": duration_ms,
+        "movies_per_s": round(shape[0] / max(duration_ms / 1000, 1e-9), 1),
+    }
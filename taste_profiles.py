@@ -0,0 +1,74 @@
+"""
+Maintenance of the user taste profiles behind personal content recommendations.
+
+user_taste_profiles holds one row per (user, genre) and (user, director) the
+user has rated, with weight = SUM(rating - NEUTRAL_RATING): liked movies push
+a feature up, disliked ones push it down. The app applies deltas in the same
+transaction as the rating write; rebuild_taste_profiles() reconciles the
+table from scratch after bulk loads (or after movies gain new genres).
+
+The candidates of a user's top genres are read from genre_movie_rankings
+(see genre_rankings.py), which every rating write and genre link already
+keeps current, so new movies and new ratings count right away.
+"""
+NEUTRAL_RATING = 3
+DELTA_BATCH = 500          # (user, movie) changes per upsert statement
+
+# profile kind -> (junction table, feature column)
+PROFILE_FEATURES = {
+    "genre": ("movie_genres", "genre_id"),
+    "director": ("movie_directors", "director_id"),
+}
+
+
+def taste_delta(old_rating, new_rating):
+    """Returns the (weight, count) change caused by replacing old_rating with new_rating."""
+    if old_rating is None:
+        return new_rating - NEUTRAL_RATING, 1
+    return new_rating - old_rating, 0
+
+
+def apply_taste_deltas(cursor, changes):
+    """
+    Folds a list of (user_id, movie_id, old_rating, new_rating) changes into
+    user_taste_profiles, one upsert per feature kind and DELTA_BATCH changes.
+    """
+    merged = {}
+    for user_id, movie_id, old_rating, new_rating in changes:
+        d_weight, d_count = taste_delta(old_rating, new_rating)
+        weight, count = merged.get((user_id, movie_id), (0, 0))
+        merged[(user_id, movie_id)] = (weight + d_weight, count + d_count)
+
+    rows = [(user_id, movie_id, w, c) for (user_id, movie_id), (w, c) in sorted(merged.items()) if w or c]
+    for kind, (table, column) in PROFILE_FEATURES.items():
+        for start in range(0, len(rows), DELTA_BATCH):
+            batch = rows[start:start + DELTA_BATCH]
+            deltas = " UNION ALL ".join(
+                ["SELECT %s AS d_user_id, %s AS d_movie_id, %s AS d_weight, %s AS d_count"] * len(batch))
+            cursor.execute(f"""
+                INSERT INTO user_taste_profiles (user_id, feature_kind, feature_id, weight, rating_count)
+                SELECT d.d_user_id, '{kind}', f.{column}, SUM(d.d_weight), SUM(d.d_count)
+                FROM ({deltas}) d
+                JOIN {table} f ON f.movie_id = d.d_movie_id
+                GROUP BY d.d_user_id, f.{column}
+                ON DUPLICATE KEY UPDATE
+                    weight = weight + VALUES(weight),
+                    rating_count = rating_count + VALUES(rating_count);
+            """, [value for row in batch for value in row])
+
+
+def rebuild_taste_profiles(cursor):
+    """Recomputes user_taste_profiles from the ratings table. Returns the number of rows."""
+    cursor.execute("DELETE FROM user_taste_profiles")
+    rows = 0
+    for kind, (table, column) in PROFILE_FEATURES.items():
+        cursor.execute(f"""
+            INSERT INTO user_taste_profiles (user_id, feature_kind, feature_id, weight, rating_count)
+            SELECT r.user_id, '{kind}', f.{column}, SUM(r.rating - %s), COUNT(*)
+            FROM ratings r
+            JOIN {table} f ON f.movie_id = r.movie_id
+            GROUP BY r.user_id, f.{column};
+        """, (NEUTRAL_RATING,))
+        rows += cursor.rowcount
+    return rows
+
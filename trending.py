@@ -0,0 +1,175 @@
+"""
+Time-bucketed rating counters behind /api/recommendations/trending.
+
+movie_rating_buckets counts the new ratings each movie received per hour
+(bucket_hours = 1, bucket_start in hours since the epoch). Rating writes
+upsert the current hour's bucket in the same transaction, so trending
+queries never touch the raw ratings table.
+
+compact_buckets() rolls hourly buckets older than HOURLY_RETENTION_HOURS
+into daily ones (bucket_hours = 24) and drops buckets older than the longest
+window, so the table holds at most about movies x (48 hourly + 31 daily)
+rows however many ratings come in. The app runs it from one worker at a time
+every TRENDING_COMPACT_SECONDS.
+
+A movie's trend score over a window is its bucket counts with exponential
+decay, each bucket weighted by 0.5 ** (age of its midpoint / half-life), so
+recent activity counts most while the window still caps what is considered.
+"""
+import time
+
+HOURLY_RETENTION_HOURS = 48      # older hourly buckets are compacted into days
+COMPACT_LOCK = "movie_rec_db.movie_rating_buckets"
+TRENDING_MAX_RESULTS = 100
+
+# window -> (length in hours, decay half-life in hours)
+TRENDING_WINDOWS = {
+    "24h": (24, 6),
+    "7d": (7 * 24, 48),
+    "30d": (30 * 24, 7 * 24),
+}
+RETENTION_HOURS = max(hours for hours, _ in TRENDING_WINDOWS.values())
+
+
+def current_hour(now=None):
+    return int(now if now is not None else time.time()) // 3600
+
+
+def parse_trending_args(args):
+    """(window, limit) from request args; raises ValueError for anything else."""
+    window = args.get('window', '7d')
+    if window not in TRENDING_WINDOWS:
+        raise ValueError(f"window must be one of: {', '.join(TRENDING_WINDOWS)}")
+    try:
+        limit = int(args.get('limit', 10))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if not 1 <= limit <= TRENDING_MAX_RESULTS:
+        raise ValueError(f"limit must be between 1 and {TRENDING_MAX_RESULTS}")
+    return window, limit
+
+
+# --- Maintenance ---
+
+def record_rating_activity(cursor, changes, now=None):
+    """
+    Counts (movie_id, old_rating, new_rating) changes into the current hour's
+    buckets. Only new ratings count; re-rating a movie is not new activity.
+    """
+    merged = {}
+    for movie_id, old_rating, new_rating in changes:
+        if old_rating is None:
+            count, total = merged.get(movie_id, (0, 0))
+            merged[movie_id] = (count + 1, total + new_rating)
+    if not merged:
+        return
+    hour = current_hour(now)
+    rows = [(hour, movie_id, count, total) for movie_id, (count, total) in sorted(merged.items())]
+    cursor.execute(f"""
+        INSERT INTO movie_rating_buckets (bucket_hours, bucket_start, movie_id, rating_count, rating_sum)
+        VALUES {", ".join(["(1, %s, %s, %s, %s)"] * len(rows))}
+        ON DUPLICATE KEY UPDATE
+            rating_count = rating_count + VALUES(rating_count),
+            rating_sum = rating_sum + VALUES(rating_sum);
+    """, [value for row in rows for value in row])
+
+
+def compact_buckets(cursor, now=None):
+    """
+    Rolls whole days of hourly buckets older than HOURLY_RETENTION_HOURS into
+    daily buckets and deletes buckets past RETENTION_HOURS. Must run inside
+    the caller's transaction. Returns (hourly rows compacted, rows expired).
+    """
+    hour = current_hour(now)
+    cutoff = (hour - HOURLY_RETENTION_HOURS) // 24 * 24
+    cursor.execute("""
+        INSERT INTO movie_rating_buckets (bucket_hours, bucket_start, movie_id, rating_count, rating_sum)
+        SELECT 24, day_start, movie_id, day_count, day_sum
+        FROM (
+            SELECT bucket_start DIV 24 * 24 AS day_start, movie_id,
+                   SUM(rating_count) AS day_count, SUM(rating_sum) AS day_sum
+            FROM movie_rating_buckets
+            WHERE bucket_hours = 1 AND bucket_start < %s
+            GROUP BY day_start, movie_id
+        ) hourly
+        ON DUPLICATE KEY UPDATE
+            rating_count = movie_rating_buckets.rating_count + hourly.day_count,
+            rating_sum = movie_rating_buckets.rating_sum + hourly.day_sum;
+    """, (cutoff,))
+    cursor.execute("DELETE FROM movie_rating_buckets WHERE bucket_hours = 1 AND bucket_start < %s", (cutoff,))
+    compacted = cursor.rowcount
+    cursor.execute("DELETE FROM movie_rating_buckets WHERE bucket_hours = 24 AND bucket_start <= %s",
+                   (hour - RETENTION_HOURS - 24,))
+    return compacted, cursor.rowcount
+
+
+def compact_buckets_if_free(cnx, now=None):
+    """Runs compact_buckets() and commits unless another process holds the lock. Returns its result or None."""
+    cursor = cnx.cursor()
+    try:
+        cursor.execute("SELECT GET_LOCK(%s, 0)", (COMPACT_LOCK,))
+        if cursor.fetchall()[0][0] != 1:
+            return None
+        try:
+            result = compact_buckets(cursor, now)
+            cnx.commit()
+            return result
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (COMPACT_LOCK,))
+            cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def rebuild_trending(cursor, now=None):
+    """
+    Refills the buckets from ratings.created_at (a one-off scan, for bulk
+    loads and the migration). Returns the number of bucket rows.
+    """
+    hour = current_hour(now)
+    cutoff = (hour - HOURLY_RETENTION_HOURS) // 24 * 24
+    cursor.execute("DELETE FROM movie_rating_buckets")
+    cursor.execute("""
+        INSERT INTO movie_rating_buckets (bucket_hours, bucket_start, movie_id, rating_count, rating_sum)
+        SELECT
+            IF(h >= %s, 1, 24) AS b_hours, IF(h >= %s, h, h DIV 24 * 24) AS b_start, movie_id,
+            COUNT(*), SUM(rating)
+        FROM (
+            SELECT UNIX_TIMESTAMP(created_at) DIV 3600 AS h, movie_id, rating
+            FROM ratings
+            WHERE created_at >= FROM_UNIXTIME(%s)
+        ) r
+        GROUP BY b_hours, b_start, movie_id;
+    """, (cutoff, cutoff, (hour - RETENTION_HOURS - 24) * 3600))
+    return cursor.rowcount
+
+
+# --- Reading ---
+
+def trending_query(window, limit=10, now=None):
+    """Top movies by decayed new-rating count over `window`. Returns (sql, params)."""
+    hours, half_life = TRENDING_WINDOWS[window]
+    hour = current_hour(now)
+    start = hour - hours + 1
+    # Daily buckets count when any part of their day is inside the window
+    sql = """
+        SELECT
+            m.movie_id, m.title, m.release_year,
+            t.window_ratings, t.window_average, t.trend_score
+        FROM (
+            SELECT
+                b.movie_id,
+                SUM(b.rating_count) AS window_ratings,
+                SUM(b.rating_sum) / SUM(b.rating_count) AS window_average,
+                SUM(b.rating_count * POW(0.5, (%s - b.bucket_start - b.bucket_hours / 2) / %s)) AS trend_score
+            FROM movie_rating_buckets b
+            WHERE (b.bucket_hours = 1 AND b.bucket_start >= %s)
+               OR (b.bucket_hours = 24 AND b.bucket_start > %s)
+            GROUP BY b.movie_id
+            ORDER BY trend_score DESC, b.movie_id
+            LIMIT %s
+        ) t
+        JOIN movies m ON m.movie_id = t.movie_id
+        ORDER BY t.trend_score DESC, t.movie_id;
+    """
+    return sql, (hour + 1, half_life, start, start - 24, limit)
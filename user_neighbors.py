@@ -0,0 +1,426 @@
+"""
+Similar-user neighbourhoods for personal collaborative recommendations.
+
+Every user's liked set (rating >= MIN_RATING) is summarized by a MinHash
+signature of NUM_HASHES values. Signatures are cut into LSH_BANDS bands;
+users whose band hashes collide land in the same bucket and become
+candidate neighbours, so finding a user's neighbours only looks at their
+buckets instead of every other user. Candidates are then scored by their
+exact number of shared likes (as the old SQL did) and the best
+NEIGHBORS_PER_USER are stored in user_neighbors.
+
+`manage.py build-user-neighbors` builds all three tables (user_minhash,
+user_lsh_buckets, user_neighbors) from scratch and reports neighbour recall
+against the exact SQL. Whenever a rating moves a movie into or out of a
+user's liked set, the rating paths queue that user on the worker's
+NeighborRefresher after their commit; it rewrites the user's own list and
+their entry in the lists of the users they are similar to.
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+from scipy import sparse
+
+from cooccurrence import record_build
+from queries import MIN_RATING, SIMILARITY_THRESHOLD
+
+NUM_HASHES = 64
+LSH_BANDS = 32                  # 32 bands x 2 rows: pairs with Jaccard 0.2 collide with p ~0.73
+ROWS_PER_BAND = NUM_HASHES // LSH_BANDS
+NEIGHBORS_PER_USER = 50
+MAX_BUCKET_SIZE = 100           # candidates taken from one bucket (huge buckets are truncated)
+MINHASH_SEED = 20240601         # fixed so every process hashes identically
+FETCH_BATCH = 50000
+WRITE_BATCH = 5000
+PAIR_BATCH = 200000
+REFRESH_QUEUE_MAX = 10000       # users waiting for a background neighbour refresh, per worker
+RETRY_DELAY_SECONDS = 2.0
+DEADLOCK_RETRIES = 2            # another worker refreshing an overlapping neighbourhood
+ER_LOCK_DEADLOCK = 1213
+
+logger = logging.getLogger(__name__)
+
+_PRIME = np.uint64((1 << 31) - 1)
+_EMPTY = np.uint32((1 << 31) - 1)         # signature value of an empty liked set
+_KEY_MASK = np.uint64((1 << 63) - 1)      # bucket keys are stored as signed BIGINT
+
+_rng = np.random.default_rng(MINHASH_SEED)
+_HASH_A = _rng.integers(1, (1 << 31) - 1, NUM_HASHES, dtype=np.uint64)
+_HASH_B = _rng.integers(0, (1 << 31) - 1, NUM_HASHES, dtype=np.uint64)
+_BAND_MULTIPLIERS = _rng.integers(1, 1 << 62, ROWS_PER_BAND, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+
+
+# --- MinHash / LSH ---
+
+def hash_movies(movie_ids):
+    """(len(movie_ids), NUM_HASHES) uint32 hash values."""
+    x = np.asarray(movie_ids, dtype=np.uint64)[:, None]
+    return ((_HASH_A * x + _HASH_B) % _PRIME).astype(np.uint32)
+
+
+def minhash_signature(movie_ids):
+    if len(movie_ids) == 0:
+        return np.full(NUM_HASHES, _EMPTY, dtype=np.uint32)
+    return hash_movies(movie_ids).min(axis=0)
+
+
+def band_keys(signatures):
+    """(n, NUM_HASHES) signatures -> (n, LSH_BANDS) int64 bucket keys."""
+    bands = signatures.astype(np.uint64).reshape(len(signatures), LSH_BANDS, ROWS_PER_BAND)
+    return ((bands * _BAND_MULTIPLIERS).sum(axis=2) & _KEY_MASK).astype(np.int64)
+
+
+def _signatures_for(liked):
+    """MinHash signature of every row of the CSR liked matrix (rows must be non-empty)."""
+    signatures = np.empty((liked.shape[0], NUM_HASHES), dtype=np.uint32)
+    indptr = liked.indptr
+    row = 0
+    while row < liked.shape[0]:
+        end = int(np.searchsorted(indptr, indptr[row] + FETCH_BATCH, side="right")) - 1
+        end = min(max(end, row + 1), liked.shape[0])
+        hashes = hash_movies(liked.indices[indptr[row]:indptr[end]])
+        signatures[row:end] = np.minimum.reduceat(hashes, indptr[row:end] - indptr[row], axis=0)
+        row = end
+    return signatures
+
+
+def _candidate_pairs(keys):
+    """Distinct (i, j) row pairs, i < j, sharing at least one bucket."""
+    found = []
+    for band in range(keys.shape[1]):
+        order = np.argsort(keys[:, band], kind="stable")
+        sorted_keys = keys[order, band]
+        # Compare every row with the next 1..MAX_BUCKET_SIZE-1 rows of its bucket
+        for distance in range(1, MAX_BUCKET_SIZE):
+            same = sorted_keys[distance:] == sorted_keys[:-distance]
+            if not same.any():
+                break
+            first, second = order[:-distance][same], order[distance:][same]
+            found.append(np.minimum(first, second).astype(np.int64) << 32 | np.maximum(first, second))
+    if not found:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    packed = np.unique(np.concatenate(found))
+    return packed >> 32, packed & 0xFFFFFFFF
+
+
+# --- Full Build ---
+
+def load_likes(cursor):
+    """Returns (user_ids, liked) where liked is a binary CSR matrix over movie ids."""
+    cursor.execute("SELECT user_id, movie_id FROM ratings WHERE rating >= %s", (MIN_RATING,))
+    parts = []
+    while True:
+        rows = cursor.fetchmany(FETCH_BATCH)
+        if not rows:
+            break
+        parts.append(np.asarray(rows, dtype=np.int64))
+    pairs = np.concatenate(parts) if parts else np.empty((0, 2), dtype=np.int64)
+    user_ids, rows = np.unique(pairs[:, 0], return_inverse=True)
+    n_movies = int(pairs[:, 1].max()) + 1 if len(pairs) else 0
+    liked = sparse.csr_matrix((np.ones(len(pairs), dtype=np.float32), (rows, pairs[:, 1])),
+                              shape=(len(user_ids), n_movies))
+    liked.sum_duplicates()
+    liked.sort_indices()
+    return user_ids, liked
+
+
+def compute_neighbors(liked, top_n=NEIGHBORS_PER_USER, min_shared=SIMILARITY_THRESHOLD):
+    """
+    Returns (signatures, keys, neighbors) for every row of `liked`, where
+    neighbors is (rows, neighbor_rows, shared_likes, jaccard), sorted by row
+    then rank.
+    """
+    signatures = _signatures_for(liked)
+    keys = band_keys(signatures)
+    first, second = _candidate_pairs(keys)
+
+    degree = np.diff(liked.indptr)
+    shared = np.empty(len(first), dtype=np.int64)
+    for start in range(0, len(first), PAIR_BATCH):
+        a, b = first[start:start + PAIR_BATCH], second[start:start + PAIR_BATCH]
+        shared[start:start + PAIR_BATCH] = np.asarray(liked[a].multiply(liked[b]).sum(axis=1)).ravel()
+
+    keep = shared >= min_shared
+    first, second, shared = first[keep], second[keep], shared[keep]
+    jaccard = shared / (degree[first] + degree[second] - shared)
+
+    # Both directions, then the best top_n per user (ties: higher Jaccard, lower id)
+    rows = np.concatenate([first, second])
+    neighbor_rows = np.concatenate([second, first])
+    shared = np.concatenate([shared, shared])
+    jaccard = np.concatenate([jaccard, jaccard])
+    order = np.lexsort((neighbor_rows, -jaccard, -shared, rows))
+    rows, neighbor_rows, shared, jaccard = rows[order], neighbor_rows[order], shared[order], jaccard[order]
+    group_start = np.searchsorted(rows, rows, side="left")
+    rank = np.arange(len(rows)) - group_start
+    keep = rank < top_n
+    return signatures, keys, (rows[keep], neighbor_rows[keep], shared[keep], jaccard[keep])
+
+
+def _write_batches(cursor, sql, rows):
+    for start in range(0, len(rows), WRITE_BATCH):
+        cursor.executemany(sql, rows[start:start + WRITE_BATCH])
+
+
+def build_user_neighbors(cnx, top_n=NEIGHBORS_PER_USER):
+    """Rebuilds user_minhash, user_lsh_buckets and user_neighbors. Returns a summary dict."""
+    started = time.time()
+    t0 = time.perf_counter()
+    cursor = cnx.cursor()
+    try:
+        user_ids, liked = load_likes(cursor)
+        load_ms = int((time.perf_counter() - t0) * 1000)
+        signatures, keys, (rows, neighbor_rows, shared, jaccard) = compute_neighbors(liked, top_n)
+        compute_ms = int((time.perf_counter() - t0) * 1000) - load_ms
+
+        for table in ("user_neighbors", "user_lsh_buckets", "user_minhash"):
+            cursor.execute(f"DELETE FROM {table}")
+        _write_batches(cursor, "INSERT INTO user_minhash (user_id, signature) VALUES (%s, %s)",
+                       [(int(u), sig.astype("<u4").tobytes()) for u, sig in zip(user_ids, signatures)])
+        _write_batches(cursor, "INSERT INTO user_lsh_buckets (band, bucket_key, user_id) VALUES (%s, %s, %s)",
+                       [(band, int(key), int(u)) for u, user_keys in zip(user_ids, keys)
+                        for band, key in enumerate(user_keys)])
+        ranks = np.arange(len(rows)) - np.searchsorted(rows, rows, side="left")
+        _write_batches(cursor, """
+            INSERT INTO user_neighbors (user_id, rank_pos, neighbor_id, shared_likes, jaccard)
+            VALUES (%s, %s, %s, %s, %s)
+        """, [(int(user_ids[r]), int(rank), int(user_ids[n]), int(s), float(j))
+              for r, rank, n, s, j in zip(rows, ranks, neighbor_rows, shared, jaccard)])
+
+        duration_ms = int((time.time() - started) * 1000)
+        record_build(cursor, "user_neighbors", started, duration_ms, liked.shape, liked.nnz,
+                     len(np.unique(rows)), "all")
+        cnx.commit()
+    finally:
+        cursor.close()
+
+    return {
+        "users": len(user_ids),
+        "users_with_neighbors": int(len(np.unique(rows))),
+        "neighbor_rows": int(len(rows)),
+        "load_ms": load_ms,
+        "compute_ms": compute_ms,
+        "duration_ms": duration_ms,
+    }
+
+
+# --- Online Updates ---
+
+def likes_changed(old_rating, new_rating):
+    """True if a rating change moves the movie into or out of the user's liked set."""
+    was_liked = old_rating is not None and old_rating >= MIN_RATING
+    return was_liked != (new_rating >= MIN_RATING)
+
+
+def refresh_user_neighbors(cursor, user_id, top_n=NEIGHBORS_PER_USER):
+    """
+    Rewrites one user's signature, buckets and neighbour list from their
+    current likes, then moves them to their place in the lists of the users
+    they are (or were) a neighbour of. Returns the number of other lists
+    rewritten.
+    """
+    cursor.execute("SELECT movie_id FROM ratings WHERE user_id = %s AND rating >= %s", (user_id, MIN_RATING))
+    liked = [row['movie_id'] if isinstance(row, dict) else row[0] for row in cursor.fetchall()]
+    signature = minhash_signature(liked)
+
+    cursor.execute("""
+        INSERT INTO user_minhash (user_id, signature) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE signature = VALUES(signature);
+    """, (user_id, signature.astype("<u4").tobytes()))
+    cursor.execute("DELETE FROM user_lsh_buckets WHERE user_id = %s", (user_id,))
+
+    # Users listing this one must be re-scored whatever the buckets say
+    cursor.execute("SELECT user_id FROM user_neighbors WHERE neighbor_id = %s", (user_id,))
+    listed_by = sorted({row['user_id'] if isinstance(row, dict) else row[0] for row in cursor.fetchall()})
+
+    candidates = set(listed_by)
+    if liked:
+        keys = band_keys(signature[None, :])[0]
+        cursor.executemany("INSERT INTO user_lsh_buckets (band, bucket_key, user_id) VALUES (%s, %s, %s)",
+                           [(band, int(key), user_id) for band, key in enumerate(keys)])
+
+        # Candidates: users sharing any bucket, at most MAX_BUCKET_SIZE per band
+        bucket_sql = " UNION ".join(
+            "(SELECT user_id FROM user_lsh_buckets WHERE band = %s AND bucket_key = %s AND user_id != %s LIMIT %s)"
+            for _ in keys
+        )
+        params = []
+        for band, key in enumerate(keys):
+            params += [band, int(key), user_id, MAX_BUCKET_SIZE]
+        cursor.execute(bucket_sql, params)
+        candidates.update(row['user_id'] if isinstance(row, dict) else row[0] for row in cursor.fetchall())
+
+    scored = []
+    if liked and candidates:
+        candidates = sorted(candidates)
+        placeholders = ", ".join(["%s"] * len(candidates))
+        cursor.execute(f"""
+            SELECT r.user_id,
+                   SUM(r.movie_id IN (SELECT movie_id FROM ratings WHERE user_id = %s AND rating >= %s)) AS shared_likes,
+                   COUNT(*) AS liked
+            FROM ratings r
+            WHERE r.user_id IN ({placeholders}) AND r.rating >= %s
+            GROUP BY r.user_id
+        """, (user_id, MIN_RATING, *candidates, MIN_RATING))
+        for row in cursor.fetchall():
+            neighbor_id, shared, other = (row['user_id'], row['shared_likes'], row['liked']) \
+                if isinstance(row, dict) else row
+            shared, other = int(shared), int(other)
+            if shared >= SIMILARITY_THRESHOLD:
+                scored.append((neighbor_id, shared, shared / (len(liked) + other - shared)))
+
+    # Shared likes are symmetric, so this user also moves in the candidates'
+    # lists. Lists are locked in user_id order, the same in every refresh.
+    scores = {neighbor_id: (shared, jaccard) for neighbor_id, shared, jaccard in scored}
+    rewritten = 0
+    for owner in sorted(set(listed_by) | set(scores) | {user_id}):
+        if owner == user_id:
+            _write_list(cursor, user_id, scored, top_n)
+        else:
+            rewritten += _place_in_list(cursor, owner, user_id, scores.get(owner), top_n)
+    return rewritten
+
+
+def _write_list(cursor, owner, entries, top_n):
+    """Replaces owner's list with the best top_n (neighbor_id, shared_likes, jaccard) entries."""
+    best = sorted(entries, key=lambda n: (-n[1], -n[2], n[0]))[:top_n]
+    cursor.execute("DELETE FROM user_neighbors WHERE user_id = %s", (owner,))
+    cursor.executemany("""
+        INSERT INTO user_neighbors (user_id, rank_pos, neighbor_id, shared_likes, jaccard)
+        VALUES (%s, %s, %s, %s, %s)
+    """, [(owner, rank, neighbor_id, shared, jaccard) for rank, (neighbor_id, shared, jaccard) in enumerate(best)])
+    return best
+
+
+def _place_in_list(cursor, owner, user_id, score, top_n):
+    """Moves user_id within owner's list to `score` (shared, jaccard), or drops it for None. Returns 1 if rewritten."""
+    cursor.execute("""
+        SELECT neighbor_id, shared_likes, jaccard FROM user_neighbors
+        WHERE user_id = %s ORDER BY rank_pos FOR UPDATE
+    """, (owner,))
+    current = [(row['neighbor_id'], row['shared_likes'], row['jaccard']) if isinstance(row, dict) else tuple(row)
+               for row in cursor.fetchall()]
+    entries = [entry for entry in current if entry[0] != user_id]
+    if score is not None:
+        entries.append((user_id, *score))
+    best = sorted(entries, key=lambda n: (-n[1], -n[2], n[0]))[:top_n]
+    if [(n, s, round(j, 4)) for n, s, j in best] == [(n, s, round(j, 4)) for n, s, j in current]:
+        return 0
+    _write_list(cursor, owner, best, top_n)
+    return 1
+
+
+# --- Background Refresh ---
+
+class NeighborRefresher:
+    """
+    Per-worker queue of users whose liked set changed. Rating writes only
+    submit() the user after their commit; a background thread refreshes
+    each queued user (and the lists they appear in) in its own short
+    transaction, so none of this holds locks inside a rating transaction.
+    A user queued several times before the thread gets to them is
+    refreshed once. Users that do not fit in the queue, or whose refresh
+    fails, are left to the next `manage.py build-user-neighbors`.
+    """
+
+    def __init__(self, connect, max_queued=REFRESH_QUEUE_MAX):
+        self.connect = connect            # () -> context manager yielding a connection (or None)
+        self.max_queued = max_queued
+        self._lock = threading.Condition()
+        self._queued = set()
+        self._stats = {"submitted": 0, "refreshed": 0, "lists_rewritten": 0, "dropped": 0, "failed": 0}
+        self._thread = threading.Thread(target=self._run, name="neighbor-refresher", daemon=True)
+        self._thread.start()
+
+    def submit(self, user_ids):
+        """Queues users for a refresh. Returns how many did not fit."""
+        with self._lock:
+            dropped = 0
+            for user_id in user_ids:
+                if user_id in self._queued:
+                    continue
+                if len(self._queued) >= self.max_queued:
+                    dropped += 1
+                    continue
+                self._queued.add(user_id)
+            self._stats["submitted"] += len(user_ids) - dropped
+            self._stats["dropped"] += dropped
+            self._lock.notify()
+        return dropped
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._queued:
+                    self._lock.wait()
+                batch, self._queued = sorted(self._queued), set()
+            self._refresh(batch)
+
+    def _refresh(self, user_ids):
+        try:
+            with self.connect() as conn:
+                if not conn:
+                    raise RuntimeError("Database connection failed")
+                cursor = conn.cursor()
+                try:
+                    for user_id in user_ids:
+                        for attempt in range(DEADLOCK_RETRIES + 1):
+                            try:
+                                rewritten = refresh_user_neighbors(cursor, user_id)
+                                conn.commit()
+                                break
+                            except Exception as err:
+                                conn.rollback()
+                                if getattr(err, "errno", None) == ER_LOCK_DEADLOCK and attempt < DEADLOCK_RETRIES:
+                                    continue
+                                with self._lock:
+                                    self._stats["failed"] += 1
+                                logger.exception("Neighbour refresh of user %s failed", user_id)
+                                rewritten = None
+                                break
+                        if rewritten is None:
+                            continue
+                        with self._lock:
+                            self._stats["refreshed"] += 1
+                            self._stats["lists_rewritten"] += rewritten
+                finally:
+                    cursor.close()
+        except Exception:
+            with self._lock:
+                self._stats["failed"] += len(user_ids)
+            logger.exception("Neighbour refresh of %d users failed", len(user_ids))
+            time.sleep(RETRY_DELAY_SECONDS)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, queued=len(self._queued), max_queued=self.max_queued)
+
+
+# --- Recall Report ---
+
+def neighbor_recall(cursor, user_ids, top_n=NEIGHBORS_PER_USER):
+    """
+    Compares stored neighbours with the exact SimilarUsers SQL for a sample
+    of users. Returns (mean recall, users evaluated).
+    """
+    recalls = []
+    for user_id in user_ids:
+        cursor.execute("""
+            SELECT r.user_id, COUNT(r.movie_id) AS shared_likes
+            FROM ratings r
+            WHERE r.movie_id IN (SELECT movie_id FROM ratings WHERE user_id = %s AND rating >= %s)
+              AND r.user_id != %s AND r.rating >= %s
+            GROUP BY r.user_id
+            HAVING shared_likes >= %s
+            ORDER BY shared_likes DESC, r.user_id
+            LIMIT %s
+        """, (user_id, MIN_RATING, user_id, MIN_RATING, SIMILARITY_THRESHOLD, top_n))
+        exact = [row[0] for row in cursor.fetchall()]
+        if not exact:
+            continue
+        cursor.execute("SELECT neighbor_id FROM user_neighbors WHERE user_id = %s", (user_id,))
+        approx = {row[0] for row in cursor.fetchall()}
+        recalls.append(len(approx.intersection(exact)) / len(exact))
+    return (sum(recalls) / len(recalls) if recalls else None), len(recalls)